@@ -1,18 +1,43 @@
 # app.py
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g, Response, has_request_context
 from flask_cors import CORS, cross_origin
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import inspect, text
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session as SqlaSession
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import safe_join
 import jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import secrets
+import hashlib
+import time
+import threading
+import atexit
+import queue
+from collections import deque
+import socket
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 import json
+import base64
+import mimetypes
 import os
 import re
+import shutil
+import unicodedata
+import click
 import stripe
+from sqlalchemy.dialects.mysql import match as mysql_match
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from dotenv import load_dotenv
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 未導入の環境ではサムネイルを作らず元画像をそのまま使う
+    Image = None
+    ImageOps = None
  
 app = Flask(__name__)
 
@@ -55,7 +80,9 @@ stripe.api_key = STRIPE_SECRET_KEY
  
 db = SQLAlchemy(app)
 _FORUM_SCHEMA_READY = False
+_SCHEMA_UPGRADES_READY = False
 _USER_ID_BACKFILL_READY = False
+_SEARCH_BACKEND = None
 
 FORUM_CATEGORY_LABELS = {
     "chat": "雑談",
@@ -109,6 +136,45 @@ def _allowed_image(filename):
     return _image_extension(filename) in ALLOWED_IMAGE_EXTENSIONS
 
 
+UPLOAD_HASH_CHUNK_SIZE = 64 * 1024
+# 同じ内容の再アップロードで参照が付く前に消さないよう、最終更新から一定時間は削除しない
+UPLOAD_DELETE_GRACE_SECONDS = int(os.getenv("UPLOAD_DELETE_GRACE_SECONDS", "600"))
+
+
+def _store_upload_by_content(file_storage, subdir):
+    # 内容の SHA-256 をファイル名にして、同じ画像は1つのファイルを共有する
+    ext = _image_extension(file_storage.filename)
+    if ext == "jpeg":
+        ext = "jpg"
+    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], subdir)
+    os.makedirs(upload_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(upload_dir, f".incoming_{secrets.token_hex(8)}.tmp")
+    try:
+        with open(tmp_path, 'wb') as output:
+            while True:
+                chunk = file_storage.stream.read(UPLOAD_HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                output.write(chunk)
+
+        stored_name = f"{digest.hexdigest()}.{ext}"
+        file_path = os.path.join(upload_dir, stored_name)
+        if os.path.isfile(file_path):
+            os.remove(tmp_path)
+            # 削除待ちのジョブが猶予期間内として扱うよう更新時刻を進める
+            os.utime(file_path, None)
+        else:
+            os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return f"uploads/{subdir}/{stored_name}"
+
+
 def _save_product_image(file_storage):
     if not file_storage or not file_storage.filename:
         return ""
@@ -118,12 +184,7 @@ def _save_product_image(file_storage):
     ext = _image_extension(file_storage.filename)
     if not ext:
         return None
-    unique_name = f"picturesid_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_{secrets.token_hex(8)}.{ext}"
-    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'products')
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, unique_name)
-    file_storage.save(file_path)
-    return f"uploads/products/{unique_name}"
+    return _store_upload_by_content(file_storage, 'products')
 
 
 def _save_profile_image(file_storage):
@@ -135,12 +196,76 @@ def _save_profile_image(file_storage):
     ext = _image_extension(file_storage.filename)
     if not ext:
         return None
-    unique_name = f"profileid_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_{secrets.token_hex(8)}.{ext}"
-    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'profiles')
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, unique_name)
-    file_storage.save(file_path)
-    return f"uploads/profiles/{unique_name}"
+    return _store_upload_by_content(file_storage, 'profiles')
+
+
+def _upload_reference_count(upload_path):
+    # 参照元は商品画像・商品の代表画像・プロフィール画像（いずれも image_url 系カラムにインデックスあり）。
+    # 出品取り消し(status=2)の商品は表示されないので参照に数えない
+    return (
+        ProductImage.query
+        .join(Product, Product.id == ProductImage.product_id)
+        .filter(ProductImage.image_url == upload_path, Product.status != 2)
+        .count()
+        + Product.query.filter(Product.image_url == upload_path, Product.status != 2).count()
+        + User.query.filter(User.profile_image == upload_path).count()
+    )
+
+
+def _referenced_upload_paths():
+    # GC 用に参照中のパスを集合で持つ（_upload_reference_count と同じ基準）
+    referenced = set()
+    queries = (
+        db.session.query(ProductImage.image_url)
+        .join(Product, Product.id == ProductImage.product_id)
+        .filter(Product.status != 2),
+        db.session.query(Product.image_url).filter(Product.status != 2, Product.image_url.isnot(None)),
+        db.session.query(User.profile_image).filter(User.profile_image.isnot(None)),
+    )
+    for query in queries:
+        for (path,) in query.yield_per(5000):
+            normalized = (path or "").replace("\\", "/").strip()
+            if normalized.startswith("uploads/"):
+                referenced.add(normalized)
+    return referenced
+
+
+def _iter_upload_files(root):
+    # 大量のファイルがあっても一覧をメモリに載せないよう、ディレクトリ単位で順に返す
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def _find_orphan_uploads(grace_seconds):
+    upload_root = app.config['UPLOAD_FOLDER']
+    referenced = _referenced_upload_paths()
+    # 縮小版は元ファイルの拡張子を除いたパスで照合する
+    referenced_stems = {path.rsplit(".", 1)[0] for path in referenced}
+    cutoff = time.time() - grace_seconds
+
+    for entry in _iter_upload_files(upload_root):
+        if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+            continue
+        upload_path = "uploads/" + os.path.relpath(entry.path, upload_root).replace(os.sep, "/")
+        if upload_path.startswith("uploads/thumbs/"):
+            stem = upload_path[len("uploads/thumbs/"):].rsplit(".", 1)[0]
+            source_stem = "uploads/" + re.sub(r'_w\d+$', '', stem)
+            if source_stem in referenced_stems:
+                continue
+        elif upload_path in referenced:
+            continue
+        yield upload_path, entry.path
 
 
 def _remove_upload_file_if_exists(upload_path):
@@ -151,14 +276,134 @@ def _remove_upload_file_if_exists(upload_path):
     if not normalized.startswith("uploads/"):
         return
 
+    # 同じ内容のファイルを他の商品やユーザーが参照している間は消さない
+    if _upload_reference_count(normalized) > 0:
+        return
+
     rel_path = normalized[len("uploads/"):]
     absolute_path = os.path.join(app.config['UPLOAD_FOLDER'], rel_path)
     if os.path.isfile(absolute_path):
+        age = time.time() - os.path.getmtime(absolute_path)
+        if age < UPLOAD_DELETE_GRACE_SECONDS:
+            _enqueue_job(
+                'remove_upload_file',
+                {"upload_path": normalized},
+                run_at=datetime.utcnow() + timedelta(seconds=UPLOAD_DELETE_GRACE_SECONDS - age)
+            )
+            db.session.commit()
+            return
         try:
             os.remove(absolute_path)
         except Exception:
             pass
 
+    for width in IMAGE_VARIANT_WIDTHS:
+        for fmt in IMAGE_VARIANT_FORMATS:
+            variant_path = _image_variant_path(normalized, width, fmt)
+            if variant_path and os.path.isfile(_upload_absolute_path(variant_path)):
+                try:
+                    os.remove(_upload_absolute_path(variant_path))
+                except Exception:
+                    pass
+
+
+# 一覧カード向けの縮小版。uploads/thumbs/<元のサブディレクトリ>/<元ファイル名>_w<幅>.<形式> に保存する
+IMAGE_VARIANT_WIDTHS = (320, 640)
+IMAGE_VARIANT_FORMATS = ("webp", "jpg")
+CARD_THUMBNAIL_WIDTH = 640
+CARD_THUMBNAIL_FORMAT = "webp"
+
+
+def _image_variant_path(upload_path, width, fmt):
+    normalized = (upload_path or "").replace("\\", "/").strip()
+    if not normalized.startswith("uploads/") or normalized.startswith("uploads/thumbs/"):
+        return ""
+    rel_path = normalized[len("uploads/"):]
+    stem = rel_path.rsplit(".", 1)[0]
+    return f"uploads/thumbs/{stem}_w{width}.{fmt}"
+
+
+def _upload_absolute_path(upload_path):
+    return os.path.join(app.config['UPLOAD_FOLDER'], upload_path[len("uploads/"):])
+
+
+def _existing_thumbnail_url(upload_path, width=CARD_THUMBNAIL_WIDTH):
+    variant = _image_variant_path(upload_path, width, CARD_THUMBNAIL_FORMAT)
+    if variant and os.path.isfile(_upload_absolute_path(variant)):
+        return variant
+    return None
+
+
+def _profile_thumbnail_url(user):
+    # アイコン表示には最小幅の縮小版で足りる。未生成なら None を返し、フロントは元画像を使う
+    if not user or not user.profile_image:
+        return None
+    return _existing_thumbnail_url(user.profile_image, IMAGE_VARIANT_WIDTHS[0])
+
+
+def _write_image_variants(upload_path, force=False):
+    # DB に触れないので、バックフィルではスレッドプールから並列に呼び出す
+    if Image is None or not _image_variant_path(upload_path, CARD_THUMBNAIL_WIDTH, CARD_THUMBNAIL_FORMAT):
+        return 0
+    source_path = _upload_absolute_path(upload_path)
+    if not os.path.isfile(source_path):
+        return 0
+
+    targets = []
+    for width in IMAGE_VARIANT_WIDTHS:
+        for fmt in IMAGE_VARIANT_FORMATS:
+            variant_path = _upload_absolute_path(_image_variant_path(upload_path, width, fmt))
+            if force or not os.path.isfile(variant_path):
+                targets.append((width, fmt, variant_path))
+    if not targets:
+        return 0
+
+    try:
+        with Image.open(source_path) as opened:
+            # スマホ写真の回転情報を反映し、アニメーション GIF は先頭フレームだけを使う
+            source = ImageOps.exif_transpose(opened)
+            source.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        app.logger.warning("Skipping image variants for %s: %s", upload_path, e)
+        return 0
+
+    written = 0
+    for width, fmt, variant_path in targets:
+        variant = source.copy()
+        variant.thumbnail((width, width * 4))
+        os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+        tmp_path = f"{variant_path}.{secrets.token_hex(4)}.tmp"
+        if fmt == "webp":
+            if variant.mode not in ("RGB", "RGBA"):
+                variant = variant.convert("RGBA" if "A" in variant.getbands() or variant.mode == "P" else "RGB")
+            variant.save(tmp_path, format="WEBP", quality=80, method=4)
+        else:
+            if variant.mode != "RGB":
+                variant = variant.convert("RGB")
+            variant.save(tmp_path, format="JPEG", quality=82, optimize=True, progressive=True)
+        os.replace(tmp_path, variant_path)
+        written += 1
+    return written
+
+
+def _generate_image_variants(upload_path):
+    _write_image_variants(upload_path)
+    thumbnail_url = _existing_thumbnail_url(upload_path)
+    if not thumbnail_url:
+        return
+    Product.query.filter(Product.primary_image_url == upload_path).update(
+        {Product.thumbnail_url: thumbnail_url},
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _enqueue_image_variants(upload_path):
+    if Image is None or not _image_variant_path(upload_path, CARD_THUMBNAIL_WIDTH, CARD_THUMBNAIL_FORMAT):
+        return
+    # 同じ内容のファイルは削除後に再アップロードされうるので冪等キーは付けない（既存の縮小版は作り直さない）
+    _enqueue_job('generate_image_variants', {"upload_path": upload_path})
+
 
 def _normalize_tags(raw_tags):
     if raw_tags is None:
@@ -246,13 +491,60 @@ def _build_latest_purchase_map(product_ids):
     return purchase_map
 
 
-def _serialize_product_card(product, image_map=None, purchase_map=None):
-    primary_image = product.image_url or ''
-    if not primary_image and image_map is not None:
-        primary_image = image_map.get(product.id, '')
+def _refresh_product_primary_image(product):
+    first_image = (
+        ProductImage.query
+        .filter_by(product_id=product.id)
+        .order_by(ProductImage.sort_order.asc(), ProductImage.id.asc())
+        .first()
+    )
+    product.primary_image_url = product.image_url or (first_image.image_url if first_image else '') or None
+    product.thumbnail_url = _existing_thumbnail_url(product.primary_image_url)
+
+
+def _set_product_latest_purchase(product, purchase):
+    if not product:
+        return
+    product.latest_purchase_id = purchase.id if purchase else None
+    product.latest_purchase_status = (purchase.status or '').strip().lower() if purchase else None
+
+
+def _backfill_product_card_fields(batch_size=500):
+    updated = 0
+    last_id = 0
+    while True:
+        products = (
+            Product.query
+            .filter(Product.id > last_id)
+            .order_by(Product.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not products:
+            break
+
+        product_ids = [p.id for p in products]
+        image_map = _build_primary_image_map(product_ids)
+        purchase_map = _build_latest_purchase_map(product_ids)
+        for product in products:
+            product.primary_image_url = product.image_url or image_map.get(product.id) or None
+            product.thumbnail_url = _existing_thumbnail_url(product.primary_image_url)
+            if product.primary_image_url and not product.thumbnail_url:
+                # 縮小版が無い既存画像はワーカーで生成し、完了時に thumbnail_url を埋める
+                _enqueue_image_variants(product.primary_image_url)
+            purchase = purchase_map.get(product.id)
+            product.latest_purchase_id = purchase["purchase_id"] if purchase else None
+            product.latest_purchase_status = purchase["status"] if purchase else None
+        db.session.commit()
+        updated += len(products)
+        last_id = product_ids[-1]
+    return updated
+
 
-    purchase = purchase_map.get(product.id) if purchase_map else None
-    purchase_status = purchase["status"] if purchase else ''
+def _serialize_product_card(product):
+    # 一覧カードは products の非正規化カラムだけで描画する（画像・購入状態の追加クエリなし）
+    primary_image = product.primary_image_url or product.image_url or ''
+    purchase_status = (product.latest_purchase_status or '').strip().lower()
     is_in_transaction = purchase_status in {'paid', 'preparing', 'shipped'}
 
     return {
@@ -263,12 +555,13 @@ def _serialize_product_card(product, image_map=None, purchase_map=None):
         "condition": product.condition,
         "category": product.category,
         "image_url": primary_image,
+        "thumbnail_url": product.thumbnail_url or primary_image,
         "created_at": product.created_at.isoformat() if product.created_at else None,
         "seller_id": product.seller_id,
         "status": product.status,
-        "purchase_id": purchase["purchase_id"] if purchase else None,
+        "purchase_id": product.latest_purchase_id,
         "purchase_status": purchase_status,
-        "purchase_status_label": purchase["status_label"] if purchase else '',
+        "purchase_status_label": _purchase_status_label(purchase_status) if purchase_status else '',
         "is_in_transaction": is_in_transaction
     }
 
@@ -325,6 +618,83 @@ def _condition_filter_values(value):
     values.update(MODERN_TO_LEGACY_CONDITIONS.get(normalized, set()))
     return list(values)
 
+
+# ============================
+# カーソル（キーセット）ページング
+# ============================
+def _encode_cursor(values):
+    payload = []
+    for value in values:
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = float(value)
+        payload.append(value)
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(token, sort_keys):
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except Exception:
+        raise ValueError('invalid cursor')
+    if not isinstance(payload, list) or len(payload) != len(sort_keys):
+        raise ValueError('invalid cursor')
+
+    # 改ざん・破損したカーソルは型ごとに検証し、すべて ValueError（400）として扱う
+    values = []
+    for value, (expr, _direction) in zip(payload, sort_keys):
+        column_type = getattr(expr, 'type', None)
+        if isinstance(column_type, db.DateTime):
+            if value is not None:
+                if not isinstance(value, str):
+                    raise ValueError('invalid cursor')
+                try:
+                    value = datetime.fromisoformat(value)
+                except ValueError:
+                    raise ValueError('invalid cursor')
+        elif isinstance(value, bool):
+            raise ValueError('invalid cursor')
+        elif isinstance(column_type, db.Integer):
+            if not isinstance(value, int):
+                raise ValueError('invalid cursor')
+        elif not isinstance(value, (int, float)):
+            raise ValueError('invalid cursor')
+        values.append(value)
+    return values
+
+
+def _keyset_condition(sort_keys, values):
+    # (a, b, c) の辞書順で「カーソルより後ろ」の行を表す条件を組み立てる
+    clauses = []
+    for index, (expr, direction) in enumerate(sort_keys):
+        prefix = [sort_keys[j][0] == values[j] for j in range(index)]
+        boundary = expr > values[index] if direction == 'asc' else expr < values[index]
+        clauses.append(db.and_(*prefix, boundary))
+    return db.or_(*clauses)
+
+
+def _keyset_order_by(sort_keys):
+    return [expr.asc() if direction == 'asc' else expr.desc() for expr, direction in sort_keys]
+
+
+def _product_sort_keys(sort, search_hits=None, recent_views=None):
+    if sort == 'relevance' and search_hits is not None:
+        return [(search_hits.c.score, 'desc'), (Product.created_at, 'desc'), (Product.id, 'desc')]
+    if sort == 'price_asc':
+        return [(Product.price, 'asc'), (Product.id, 'asc')]
+    if sort == 'price_desc':
+        return [(Product.price, 'desc'), (Product.id, 'desc')]
+    if sort == 'popular' and recent_views is not None:
+        return [(db.func.coalesce(recent_views.c.views, 0), 'desc'), (Product.created_at, 'desc'), (Product.id, 'desc')]
+    if sort == 'popular':
+        return [(Product.view_count, 'desc'), (Product.created_at, 'desc'), (Product.id, 'desc')]
+    return [(Product.created_at, 'desc'), (Product.id, 'desc')]
+
  
 # ============================
 # モデル定義
@@ -342,13 +712,20 @@ class User(db.Model):
     phone = db.Column(db.String(20))
     password_hash = db.Column(db.String(255), nullable=False)
     password = db.Column(db.String(255))
-    profile_image = db.Column(db.String(255))
+    profile_image = db.Column(db.String(255), index=True)
     bio = db.Column(db.String(120))
     address = db.Column(db.String(255))
     phone_number = db.Column(db.String(20))
     birth_date = db.Column(db.String(20))
     status = db.Column(db.SmallInteger, default=1)
     real_name = db.Column(db.String(10))
+    # 評価サマリー（評価投稿と同じトランザクションで更新）
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    recent_reviews_json = db.Column(db.Text)
+    # フォロー数（フォロー・解除・ブロックと同じトランザクションで加減算）
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, nullable=False)
     updated_at = db.Column(db.DateTime, nullable=False)
 
@@ -364,11 +741,25 @@ class Product(db.Model):
     sale_type = db.Column(db.String(50))  # 固定価格販売のみ
     seller_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     category = db.Column(db.String(100))
-    image_url = db.Column(db.String(255))
+    image_url = db.Column(db.String(255), index=True)
     status = db.Column(db.SmallInteger, default=1)  # 1: 販売中, 0: 売却済み, 2: 出品取り消し
+    view_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 閲覧数ロールアップ
+    # 一覧表示用の非正規化カラム（出品・購入・取引ステータス更新時に同じトランザクションで更新）
+    primary_image_url = db.Column(db.String(255))
+    thumbnail_url = db.Column(db.String(255))
+    latest_purchase_id = db.Column(db.Integer)
+    latest_purchase_status = db.Column(db.String(30))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_products_status_view_count', 'status', 'view_count', 'created_at', 'id'),
+        # 一覧・フォローフィード・プロフィール一覧の絞り込みと並び順に合わせた複合インデックス
+        db.Index('ix_products_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_products_seller_status_created', 'seller_id', 'status', 'created_at'),
+        db.Index('ix_products_status_price', 'status', 'price', 'id'),
+    )
+
 
 class Purchase(db.Model):
     __tablename__ = "purchases"
@@ -376,7 +767,8 @@ class Purchase(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     seller_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    buyer_email = db.Column(db.String(120))
+    buyer_email = db.Column(db.String(120), index=True)
+    buyer_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     amount = db.Column(db.Integer, nullable=False)
     currency = db.Column(db.String(10), default='jpy')
     stripe_session_id = db.Column(db.String(255), unique=True, nullable=False)
@@ -386,6 +778,11 @@ class Purchase(db.Model):
 
     product = db.relationship('Product')
 
+    __table_args__ = (
+        db.Index('ix_purchases_buyer_user_created', 'buyer_user_id', 'created_at'),
+        db.Index('ix_purchases_product_created', 'product_id', 'created_at'),
+    )
+
 
 class PurchaseReview(db.Model):
     __tablename__ = "purchase_reviews"
@@ -394,6 +791,8 @@ class PurchaseReview(db.Model):
     purchase_id = db.Column(db.Integer, db.ForeignKey('purchases.id'), nullable=False, index=True)
     reviewer_email = db.Column(db.String(120), nullable=False, index=True)
     reviewee_email = db.Column(db.String(120), nullable=False, index=True)
+    reviewer_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    reviewee_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.String(500))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -403,6 +802,8 @@ class PurchaseReview(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('purchase_id', 'reviewer_email', name='uq_purchase_reviews_purchase_reviewer'),
+        db.Index('ix_purchase_reviews_reviewee_user_created', 'reviewee_user_id', 'created_at'),
+        db.Index('ix_purchase_reviews_reviewer_user_purchase', 'reviewer_user_id', 'purchase_id'),
     )
 
 
@@ -410,23 +811,41 @@ class ProductView(db.Model):
     __tablename__ = "product_views"
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
     viewed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     product = db.relationship('Product')
 
 
+class ProductViewDaily(db.Model):
+    __tablename__ = "product_view_daily"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    view_date = db.Column(db.Date, nullable=False)
+    view_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'view_date', name='uq_product_view_daily_product_date'),
+        db.Index('ix_product_view_daily_date_product', 'view_date', 'product_id'),
+    )
+
+
 class ProductImage(db.Model):
     __tablename__ = "product_images"
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
-    image_url = db.Column(db.String(255), nullable=False)
+    image_url = db.Column(db.String(255), nullable=False, index=True)
     sort_order = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     product = db.relationship('Product', backref=db.backref('images', cascade='all, delete-orphan'))
 
+    __table_args__ = (
+        db.Index('ix_product_images_product_sort', 'product_id', 'sort_order'),
+    )
+
 
 class ProductShippingInfo(db.Model):
     __tablename__ = "product_shipping_info"
@@ -463,11 +882,18 @@ class ProductChatMessage(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
     sender_email = db.Column(db.String(120), nullable=False, index=True)
     receiver_email = db.Column(db.String(120), nullable=False, index=True)
+    sender_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    receiver_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     message = db.Column(db.Text, nullable=False)
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     product = db.relationship('Product')
+
+    __table_args__ = (
+        db.Index('ix_product_chat_messages_sender_user_product', 'sender_user_id', 'product_id', 'id'),
+        db.Index('ix_product_chat_messages_receiver_user_product', 'receiver_user_id', 'product_id', 'id'),
+    )
 class Favorite(db.Model):
     __tablename__ = "favorites"
 
@@ -498,6 +924,7 @@ class Notification(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_email = db.Column(db.String(120), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     notification_type = db.Column(db.String(30), nullable=False, default='general')
     title = db.Column(db.String(255), nullable=False)
     message = db.Column(db.Text, nullable=False)
@@ -507,6 +934,23 @@ class Notification(db.Model):
 
     product = db.relationship('Product')
 
+    __table_args__ = (
+        # 通知一覧のキーセットページング用（種別フィルタ付きは後者を使う）
+        db.Index('ix_notifications_user_created', 'user_email', 'created_at', 'id'),
+        db.Index('ix_notifications_user_type_created', 'user_email', 'notification_type', 'created_at', 'id'),
+        db.Index('ix_notifications_user_id_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_notifications_user_id_type_created', 'user_id', 'notification_type', 'created_at', 'id'),
+    )
+
+
+class NotificationCounter(db.Model):
+    __tablename__ = "notification_counters"
+
+    # 表示対象（ブロック相手の商品を除く）の未読通知数。行が無い場合は読み取り時に再集計する
+    user_email = db.Column(db.String(120), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 
 class UserNotificationSetting(db.Model):
     __tablename__ = "user_notification_settings"
@@ -557,10 +1001,12 @@ class ForumThreadLike(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     thread_id = db.Column(db.Integer, db.ForeignKey('forum_threads.id'), nullable=False)
     user_email = db.Column(db.String(120), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     __table_args__ = (
         db.UniqueConstraint('thread_id', 'user_email', name='uq_forum_thread_likes_thread_user'),
+        db.Index('ix_forum_thread_likes_user_thread', 'user_id', 'thread_id'),
     )
 
 
@@ -581,10 +1027,20 @@ class ForumFollow(db.Model):
     __tablename__ = "forum_follows"
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    follower_email = db.Column(db.String(120), nullable=False)
-    followee_email = db.Column(db.String(120), nullable=False)
+    follower_email = db.Column(db.String(120), nullable=False, index=True)
+    followee_email = db.Column(db.String(120), nullable=False, index=True)
+    follower_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    followee_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_forum_follows_follower_followee_user', 'follower_user_id', 'followee_user_id'),
+        db.Index('ix_forum_follows_followee_follower_user', 'followee_user_id', 'follower_user_id'),
+        # フォロー一覧のキーセットページング用
+        db.Index('ix_forum_follows_follower_created', 'follower_email', 'created_at', 'id'),
+        db.Index('ix_forum_follows_followee_created', 'followee_email', 'created_at', 'id'),
+    )
+
 
 class UserBlock(db.Model):
     __tablename__ = "user_blocks"
@@ -592,13 +1048,572 @@ class UserBlock(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     blocker_email = db.Column(db.String(120), nullable=False, index=True)
     blocked_email = db.Column(db.String(120), nullable=False, index=True)
+    blocker_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    blocked_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     __table_args__ = (
         db.UniqueConstraint('blocker_email', 'blocked_email', name='uq_user_blocks_blocker_blocked'),
+        db.Index('ix_user_blocks_blocker_blocked_user', 'blocker_user_id', 'blocked_user_id'),
+        db.Index('ix_user_blocks_blocked_blocker_user', 'blocked_user_id', 'blocker_user_id'),
+        db.Index('ix_user_blocks_blocker_created', 'blocker_email', 'created_at', 'id'),
+    )
+
+
+class FollowTimelineEntry(db.Model):
+    __tablename__ = "follow_timeline_entries"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    owner_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
+    seller_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)  # 商品の出品日時
+
+    __table_args__ = (
+        db.UniqueConstraint('owner_user_id', 'product_id', name='uq_follow_timeline_owner_product'),
+        db.Index('ix_follow_timeline_owner_created', 'owner_user_id', 'created_at', 'product_id'),
+        db.Index('ix_follow_timeline_owner_seller', 'owner_user_id', 'seller_user_id'),
+    )
+
+
+class StripeEvent(db.Model):
+    __tablename__ = "stripe_events"
+
+    # Stripe のイベントIDをそのまま主キーにして、再送されたイベントを一度だけ保存する
+    id = db.Column(db.String(255), primary_key=True)
+    event_type = db.Column(db.String(100), nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False)
+    # pending -> processed / ignored（処理に失敗した場合は failed）
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+
+class BackgroundJob(db.Model):
+    __tablename__ = "background_jobs"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    # pending -> running -> done / failed（失敗時は run_at を延ばして pending に戻す）
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    idempotency_key = db.Column(db.String(191), unique=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_background_jobs_status_run_at', 'status', 'run_at', 'id'),
+    )
+
+
+# FTS5 / MySQL FULLTEXT が使えない環境向けの転置インデックス（n-gram 単位）
+class ProductSearchTerm(db.Model):
+    __tablename__ = "product_search_terms"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
+    term = db.Column(db.String(8), nullable=False)
+    weight = db.Column(db.Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'term', name='uq_product_search_terms_product_term'),
+        db.Index('ix_product_search_terms_term_product', 'term', 'product_id'),
+    )
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = "schema_migrations"
+
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SocialGraphVersion(db.Model):
+    __tablename__ = "social_graph_user_versions"
+
+    # ユーザーごとのフォロー・ブロック関係の版数（変更した当事者の行だけを進める）
+    user_email = db.Column(db.String(120), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# メールアドレスは小文字・前後空白なしで保存し、検索側は lower() を使わずにインデックスで引く
+NORMALIZED_EMAIL_COLUMNS = (
+    (User, 'email'),
+    (Purchase, 'buyer_email'),
+    (PurchaseReview, 'reviewer_email'),
+    (PurchaseReview, 'reviewee_email'),
+    (ProductChatMessage, 'sender_email'),
+    (ProductChatMessage, 'receiver_email'),
+    (NewsPost, 'author_email'),
+    (Notification, 'user_email'),
+    (NotificationCounter, 'user_email'),
+    (UserNotificationSetting, 'user_email'),
+    (ForumThread, 'author_email'),
+    (ForumComment, 'author_email'),
+    (ForumThreadLike, 'user_email'),
+    (ForumCommentLike, 'user_email'),
+    (ForumFollow, 'follower_email'),
+    (ForumFollow, 'followee_email'),
+    (UserBlock, 'blocker_email'),
+    (UserBlock, 'blocked_email'),
+)
+
+
+def _normalize_email_on_set(target, value, oldvalue, initiator):
+    if isinstance(value, str):
+        return _normalize_email(value)
+    return value
+
+
+for _model, _column_name in NORMALIZED_EMAIL_COLUMNS:
+    sa_event.listen(getattr(_model, _column_name), 'set', _normalize_email_on_set, retval=True)
+
+
+# メール列と対になる整数ユーザーIDの列。移行期間中は両方に書き込み、参照はID側へ順次切り替える
+USER_ID_COLUMNS = (
+    (Purchase, 'buyer_email', 'buyer_user_id'),
+    (PurchaseReview, 'reviewer_email', 'reviewer_user_id'),
+    (PurchaseReview, 'reviewee_email', 'reviewee_user_id'),
+    (ProductChatMessage, 'sender_email', 'sender_user_id'),
+    (ProductChatMessage, 'receiver_email', 'receiver_user_id'),
+    (Notification, 'user_email', 'user_id'),
+    (ForumThreadLike, 'user_email', 'user_id'),
+    (ForumFollow, 'follower_email', 'follower_user_id'),
+    (ForumFollow, 'followee_email', 'followee_user_id'),
+    (UserBlock, 'blocker_email', 'blocker_user_id'),
+    (UserBlock, 'blocked_email', 'blocked_user_id'),
+)
+
+
+@sa_event.listens_for(SqlaSession, 'before_flush')
+def _assign_user_id_columns(session, flush_context, instances):
+    # 追加・メール変更された行のユーザーIDを、flush ごとに1回の IN クエリでまとめて埋める
+    pending = []
+    for obj in list(session.new) + list(session.dirty):
+        for model, email_column, id_column in USER_ID_COLUMNS:
+            if not isinstance(obj, model):
+                continue
+            email = getattr(obj, email_column)
+            if obj in session.new:
+                if getattr(obj, id_column) is None and email:
+                    pending.append((obj, email, id_column))
+            elif inspect(obj).attrs[email_column].history.has_changes():
+                pending.append((obj, email, id_column))
+    if not pending:
+        return
+
+    emails = {email for _obj, email, _id_column in pending if email}
+    with session.no_autoflush:
+        id_map = dict(session.query(User.email, User.id).filter(User.email.in_(emails)).all()) if emails else {}
+    for obj, email, id_column in pending:
+        setattr(obj, id_column, id_map.get(email))
+
+
+@sa_event.listens_for(SqlaSession, 'after_flush')
+def _link_rows_to_new_users(session, flush_context):
+    # 登録前にメールで作られた行（通知など）を、ユーザー作成時にIDへ結び付ける
+    for user in [obj for obj in session.new if isinstance(obj, User)]:
+        if not user.email or user.id is None:
+            continue
+        for model, email_column, id_column in USER_ID_COLUMNS:
+            table = model.__table__
+            session.execute(
+                table.update()
+                .where(table.c[email_column] == user.email, table.c[id_column].is_(None))
+                .values({id_column: user.id})
+            )
+
+
+# ============================
+# 商品全文検索インデックス
+# ============================
+SEARCH_NGRAM_SIZE = 2
+SEARCH_TITLE_WEIGHT = 3
+SEARCH_REBUILD_BATCH_SIZE = 500
+
+
+def _search_runs(value):
+    normalized = unicodedata.normalize('NFKC', str(value or '')).lower()
+    return re.findall(r'[^\W_]+', normalized)
+
+
+def _search_ngrams(value):
+    grams = []
+    for run in _search_runs(value):
+        if len(run) <= SEARCH_NGRAM_SIZE:
+            grams.append(run)
+            continue
+        for index in range(len(run) - SEARCH_NGRAM_SIZE + 1):
+            grams.append(run[index:index + SEARCH_NGRAM_SIZE])
+    return grams
+
+
+def _search_query_terms(keyword):
+    runs = _search_runs(keyword)
+    # n-gram より短い語は部分一致できないため LIKE 検索に任せる
+    if not runs or any(len(run) < SEARCH_NGRAM_SIZE for run in runs):
+        return None
+
+    terms = []
+    seen = set()
+    for gram in _search_ngrams(keyword):
+        if gram in seen:
+            continue
+        seen.add(gram)
+        terms.append(gram)
+    return terms
+
+
+def _ensure_search_index_once():
+    global _SEARCH_BACKEND
+    if _SEARCH_BACKEND:
+        return _SEARCH_BACKEND
+
+    dialect = db.engine.dialect.name
+    backend = 'terms'
+
+    if dialect == 'sqlite':
+        try:
+            db.session.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts "
+                "USING fts5(title, body, tokenize = 'unicode61 remove_diacritics 0')"
+            ))
+            db.session.commit()
+            backend = 'fts5'
+        except Exception:
+            db.session.rollback()
+    elif dialect == 'mysql':
+        try:
+            exists = db.session.execute(text(
+                "SELECT COUNT(*) FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'products' "
+                "AND index_name = 'ft_products_search'"
+            )).scalar()
+            if not exists:
+                # MySQL は ngram パーサで索引を自動保守するため同期処理は不要
+                db.session.execute(text(
+                    "ALTER TABLE products ADD FULLTEXT INDEX ft_products_search "
+                    "(title, description, category) WITH PARSER ngram"
+                ))
+            db.session.commit()
+            backend = 'mysql'
+        except Exception:
+            db.session.rollback()
+
+    if backend == 'terms':
+        ProductSearchTerm.__table__.create(db.engine, checkfirst=True)
+
+    _SEARCH_BACKEND = backend
+
+    # 索引の件数が対象商品数とずれていれば（導入前の商品・索引を通さない書き込みなど）作り直す
+    if backend != 'mysql':
+        if backend == 'fts5':
+            indexed_count = db.session.execute(text("SELECT COUNT(*) FROM products_fts")).scalar() or 0
+        else:
+            indexed_count = db.session.query(db.func.count(db.distinct(ProductSearchTerm.product_id))).scalar() or 0
+        product_count = Product.query.filter(Product.status != 2).count()
+        if indexed_count != product_count:
+            app.logger.warning(
+                "Search index has %s products but %s are searchable; rebuilding", indexed_count, product_count
+            )
+            _rebuild_product_search_index()
+    return backend
+
+
+def _search_documents(product):
+    title_grams = _search_ngrams(product.title)
+    body_grams = _search_ngrams(f"{product.description or ''} {product.category or ''}")
+    return title_grams, body_grams
+
+
+def _write_product_search_index(product):
+    backend = _SEARCH_BACKEND
+    if backend == 'fts5':
+        title_grams, body_grams = _search_documents(product)
+        db.session.execute(text("DELETE FROM products_fts WHERE rowid = :id"), {"id": product.id})
+        db.session.execute(
+            text("INSERT INTO products_fts (rowid, title, body) VALUES (:id, :title, :body)"),
+            {"id": product.id, "title": ' '.join(title_grams), "body": ' '.join(body_grams)}
+        )
+    elif backend == 'terms':
+        title_grams, body_grams = _search_documents(product)
+        weights = {}
+        for gram in title_grams:
+            weights[gram] = weights.get(gram, 0) + SEARCH_TITLE_WEIGHT
+        for gram in body_grams:
+            weights[gram] = weights.get(gram, 0) + 1
+        ProductSearchTerm.query.filter_by(product_id=product.id).delete(synchronize_session=False)
+        for term, weight in weights.items():
+            db.session.add(ProductSearchTerm(product_id=product.id, term=term, weight=weight))
+
+
+def _remove_product_search_index(product_id):
+    backend = _SEARCH_BACKEND
+    if backend == 'fts5':
+        db.session.execute(text("DELETE FROM products_fts WHERE rowid = :id"), {"id": product_id})
+    elif backend == 'terms':
+        ProductSearchTerm.query.filter_by(product_id=product_id).delete(synchronize_session=False)
+
+
+def _sync_product_search_index(product):
+    if not product or not product.id:
+        return
+    if product.status == 2:
+        _remove_product_search_index(product.id)
+    else:
+        _write_product_search_index(product)
+
+
+def _rebuild_product_search_index():
+    backend = _SEARCH_BACKEND
+    if backend == 'mysql':
+        return 0
+    if backend == 'fts5':
+        db.session.execute(text("DELETE FROM products_fts"))
+    else:
+        ProductSearchTerm.query.delete(synchronize_session=False)
+    db.session.commit()
+
+    indexed = 0
+    last_id = 0
+    while True:
+        products = (
+            Product.query
+            .filter(Product.id > last_id, Product.status != 2)
+            .order_by(Product.id.asc())
+            .limit(SEARCH_REBUILD_BATCH_SIZE)
+            .all()
+        )
+        if not products:
+            break
+        for product in products:
+            _write_product_search_index(product)
+        db.session.commit()
+        indexed += len(products)
+        last_id = products[-1].id
+    return indexed
+
+
+def _product_search_subquery(keyword):
+    backend = _ensure_search_index_once()
+    terms = _search_query_terms(keyword)
+    if not terms:
+        return None
+
+    if backend == 'fts5':
+        match_expr = ' '.join(f'"{term}"' for term in terms)
+        return (
+            text(
+                "SELECT rowid AS product_id, -bm25(products_fts, :title_weight, 1.0) AS score "
+                "FROM products_fts WHERE products_fts MATCH :match"
+            )
+            .bindparams(match=match_expr, title_weight=float(SEARCH_TITLE_WEIGHT))
+            .columns(product_id=db.Integer, score=db.Float)
+            .subquery('search_hits')
+        )
+
+    if backend == 'mysql':
+        boolean_query = ' '.join(f'+"{run}"' for run in _search_runs(keyword))
+        score = mysql_match(Product.title, Product.description, Product.category, against=boolean_query).in_boolean_mode()
+        return (
+            db.session.query(Product.id.label('product_id'), score.label('score'))
+            .filter(score > 0)
+            .subquery('search_hits')
+        )
+
+    return (
+        db.session.query(
+            ProductSearchTerm.product_id.label('product_id'),
+            db.func.sum(ProductSearchTerm.weight).label('score')
+        )
+        .filter(ProductSearchTerm.term.in_(terms))
+        .group_by(ProductSearchTerm.product_id)
+        .having(db.func.count(ProductSearchTerm.id) == len(terms))
+        .subquery('search_hits')
     )
  
  
+# ============================
+# 商品閲覧数の書き込みバッファ
+# ============================
+# 閲覧のたびに INSERT + commit すると人気商品で書き込みロックが直列化するため、
+# プロセス内で集計してバックグラウンドスレッドからまとめて書き込む
+VIEW_FLUSH_INTERVAL_SECONDS = float(os.getenv("VIEW_FLUSH_INTERVAL_SECONDS", "5"))
+VIEW_FLUSH_MAX_PENDING = int(os.getenv("VIEW_FLUSH_MAX_PENDING", "500"))
+
+_VIEW_BUFFER = {}
+_VIEW_BUFFER_PENDING = 0
+_VIEW_BUFFER_LOCK = threading.Lock()
+_VIEW_FLUSH_EVENT = threading.Event()
+_VIEW_FLUSHER_PID = None
+
+
+def _ensure_view_flusher_started():
+    global _VIEW_FLUSHER_PID, _VIEW_BUFFER, _VIEW_BUFFER_PENDING
+    pid = os.getpid()
+    if _VIEW_FLUSHER_PID == pid:
+        return
+
+    with _VIEW_BUFFER_LOCK:
+        if _VIEW_FLUSHER_PID == pid:
+            return
+        if _VIEW_FLUSHER_PID is not None:
+            # fork 後の子プロセスでは親の未書き込み分を二重計上しない
+            _VIEW_BUFFER = {}
+            _VIEW_BUFFER_PENDING = 0
+        _VIEW_FLUSHER_PID = pid
+
+    threading.Thread(target=_view_flusher_loop, name='product-view-flusher', daemon=True).start()
+
+
+def _view_flusher_loop():
+    while True:
+        _VIEW_FLUSH_EVENT.wait(VIEW_FLUSH_INTERVAL_SECONDS)
+        _VIEW_FLUSH_EVENT.clear()
+        _flush_product_views()
+
+
+def _record_product_view(product_id):
+    global _VIEW_BUFFER_PENDING
+    if not product_id:
+        return
+
+    _ensure_view_flusher_started()
+    key = (product_id, datetime.utcnow().date())
+    with _VIEW_BUFFER_LOCK:
+        _VIEW_BUFFER[key] = _VIEW_BUFFER.get(key, 0) + 1
+        _VIEW_BUFFER_PENDING += 1
+        should_flush = _VIEW_BUFFER_PENDING >= VIEW_FLUSH_MAX_PENDING
+
+    if should_flush:
+        _VIEW_FLUSH_EVENT.set()
+
+
+def _drain_view_buffer():
+    global _VIEW_BUFFER, _VIEW_BUFFER_PENDING
+    with _VIEW_BUFFER_LOCK:
+        pending = _VIEW_BUFFER
+        _VIEW_BUFFER = {}
+        _VIEW_BUFFER_PENDING = 0
+    return pending
+
+
+def _restore_view_buffer(pending):
+    global _VIEW_BUFFER_PENDING
+    with _VIEW_BUFFER_LOCK:
+        for key, count in pending.items():
+            _VIEW_BUFFER[key] = _VIEW_BUFFER.get(key, 0) + count
+            _VIEW_BUFFER_PENDING += count
+
+
+def _flush_product_views():
+    pending = _drain_view_buffer()
+    if not pending:
+        return 0
+
+    with app.app_context():
+        try:
+            _apply_view_rollups(pending)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # 書き込みに失敗した分は次回のフラッシュで再試行する
+            _restore_view_buffer(pending)
+            app.logger.exception("Product view flush failed")
+            return 0
+
+    return sum(pending.values())
+
+
+def _apply_view_rollups(counts):
+    # counts: {(product_id, view_date): 閲覧数}。products.view_count と日別バケットを加算更新する
+    per_product = {}
+    daily_rows = []
+    for (product_id, view_date), count in counts.items():
+        if not count:
+            continue
+        per_product[product_id] = per_product.get(product_id, 0) + count
+        daily_rows.append({"product_id": product_id, "view_date": view_date, "view_count": count})
+    if not per_product:
+        return
+
+    db.session.execute(
+        text("UPDATE products SET view_count = COALESCE(view_count, 0) + :delta WHERE id = :product_id"),
+        [{"product_id": product_id, "delta": delta} for product_id, delta in per_product.items()]
+    )
+
+    table = ProductViewDaily.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['product_id', 'view_date'],
+            set_={"view_count": table.c.view_count + stmt.excluded.view_count}
+        )
+        db.session.execute(stmt, daily_rows)
+    elif dialect == 'mysql':
+        stmt = mysql_insert(table)
+        stmt = stmt.on_duplicate_key_update(view_count=table.c.view_count + stmt.inserted.view_count)
+        db.session.execute(stmt, daily_rows)
+    else:
+        for row in daily_rows:
+            updated = db.session.execute(
+                table.update()
+                .where(table.c.product_id == row["product_id"], table.c.view_date == row["view_date"])
+                .values(view_count=table.c.view_count + row["view_count"])
+            ).rowcount
+            if not updated:
+                db.session.execute(table.insert(), row)
+
+
+def _compact_product_views():
+    # 旧方式で記録された product_views の生ログをロールアップへ畳み込み、削除する
+    max_id = db.session.query(db.func.max(ProductView.id)).scalar()
+    if not max_id:
+        return 0
+
+    view_day = db.func.date(ProductView.viewed_at)
+    rows = (
+        db.session.query(ProductView.product_id, view_day, db.func.count(ProductView.id))
+        .filter(ProductView.id <= max_id)
+        .group_by(ProductView.product_id, view_day)
+        .all()
+    )
+
+    counts = {}
+    compacted = 0
+    for product_id, day, count in rows:
+        if isinstance(day, str):
+            day = date.fromisoformat(day[:10])
+        elif isinstance(day, datetime):
+            day = day.date()
+        elif day is None:
+            day = datetime.utcnow().date()
+        counts[(product_id, day)] = counts.get((product_id, day), 0) + int(count or 0)
+        compacted += int(count or 0)
+
+    try:
+        _apply_view_rollups(counts)
+        ProductView.query.filter(ProductView.id <= max_id).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return compacted
+
+
+atexit.register(_flush_product_views)
+
+
 def _create_notification(user_email, notification_type, title, message, related_product_id=None, actor_email=None):
     email = _normalize_email(user_email)
     actor = _normalize_email(actor_email)
@@ -621,6 +1636,277 @@ def _create_notification(user_email, notification_type, title, message, related_
         message=message or '',
         related_product_id=related_product_id
     ))
+    if not _notification_hidden_by_block(email, related_product_id):
+        _increment_unread_notification_count(email)
+
+
+def _notification_hidden_by_block(email, related_product_id):
+    if not related_product_id:
+        return False
+    seller_email = (
+        db.session.query(User.email)
+        .join(Product, Product.seller_id == User.id)
+        .filter(Product.id == related_product_id)
+        .scalar()
+    )
+    seller_email = _normalize_email(seller_email)
+    if not seller_email or seller_email == email:
+        return False
+    return _get_block_relation(email, seller_email)["is_blocked"]
+
+
+def _visible_notifications_query(email):
+    query = Notification.query.filter(_user_ref_filter(Notification, 'user_email', 'user_id', email))
+    blocked_emails = _get_blocked_email_set(email)
+    if blocked_emails:
+        # ブロック関係にある出品者の商品に紐づく通知は表示しない
+        blocked_seller_ids = db.session.query(User.id).filter(User.email.in_(list(blocked_emails)))
+        hidden_product_ids = db.session.query(Product.id).filter(Product.seller_id.in_(blocked_seller_ids))
+        query = query.filter(
+            db.or_(
+                Notification.related_product_id.is_(None),
+                Notification.related_product_id.notin_(hidden_product_ids)
+            )
+        )
+    return query
+
+
+def _unread_notifications_query(email):
+    # カウンターと既読化で同じ条件を使う（is_read が NULL の行も未読として扱う）
+    return _visible_notifications_query(email).filter(Notification.is_read.isnot(True))
+
+
+def _count_unread_notifications(email):
+    return _unread_notifications_query(email).count()
+
+
+def _insert_ignore(table, row, key_columns):
+    # 既に同じキーの行があれば何もしない INSERT（同時実行でも重複エラーにしない）
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        db.session.execute(sqlite_insert(table).on_conflict_do_nothing(index_elements=key_columns), row)
+    elif dialect == 'mysql':
+        db.session.execute(mysql_insert(table).prefix_with('IGNORE'), row)
+    else:
+        exists = db.session.execute(
+            db.select(db.literal(1)).select_from(table)
+            .where(*[table.c[column] == row[column] for column in key_columns])
+        ).first()
+        if exists is None:
+            db.session.execute(table.insert(), row)
+
+
+def _upsert_notification_counter(email, increment):
+    # 行が無ければ表示対象の未読数を再集計した値で作り、あれば increment 時だけ +1 する単一の文。
+    # 行の作成と加算が同じ一意キーで直列化されるので、再集計と通知作成が並行しても加算を失わない
+    table = NotificationCounter.__table__
+    now = datetime.utcnow()
+    unread_subquery = (
+        _unread_notifications_query(email)
+        .with_entities(db.func.count(Notification.id))
+        .scalar_subquery()
+    )
+    source = db.select(db.literal(email), unread_subquery, db.literal(now))
+    columns = ['user_email', 'unread_count', 'updated_at']
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        stmt = sqlite_insert(table).from_select(columns, source)
+        if increment:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['user_email'],
+                set_={"unread_count": table.c.unread_count + 1, "updated_at": now}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=['user_email'])
+        db.session.execute(stmt)
+    elif dialect == 'mysql':
+        stmt = mysql_insert(table).from_select(columns, source)
+        if increment:
+            stmt = stmt.on_duplicate_key_update(unread_count=table.c.unread_count + 1, updated_at=now)
+        else:
+            stmt = stmt.prefix_with('IGNORE')
+        db.session.execute(stmt)
+    else:
+        updated = 0
+        if increment:
+            updated = db.session.execute(
+                table.update()
+                .where(table.c.user_email == email)
+                .values(unread_count=table.c.unread_count + 1, updated_at=now)
+            ).rowcount
+        if not updated and db.session.get(NotificationCounter, email) is None:
+            db.session.execute(table.insert().from_select(columns, source))
+
+
+def _get_unread_notification_count(email):
+    counter = db.session.get(NotificationCounter, email)
+    if counter is not None:
+        return int(counter.unread_count or 0)
+
+    try:
+        _upsert_notification_counter(email, increment=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return _count_unread_notifications(email)
+    counter = db.session.get(NotificationCounter, email, populate_existing=True)
+    return int(counter.unread_count or 0) if counter is not None else 0
+
+
+def _increment_unread_notification_count(email):
+    # 追加した通知行を flush してから数えるので、行を新しく作る場合もこの通知を含む
+    db.session.flush()
+    _upsert_notification_counter(email, increment=True)
+
+
+def _invalidate_unread_notification_counts(*emails):
+    targets = [email for email in emails if email]
+    if not targets:
+        return
+    db.session.execute(
+        NotificationCounter.__table__.delete()
+        .where(NotificationCounter.user_email.in_(targets))
+    )
+
+
+NOTIFICATION_FANOUT_BATCH_SIZE = 500
+
+
+def _blocked_counterparts(email, candidates):
+    # candidates のうち email とブロック関係（どちら向きでも）にあるメールを返す
+    if not email or not candidates:
+        return set()
+    blocked_by_me, blocked_me = _resolve_block_relations(email, candidates)
+    return blocked_by_me | blocked_me
+
+
+def _fan_out_notifications(recipient_emails, notification_type, title, message, related_product_id=None, actor_email=None):
+    # _create_notification の一括版。設定・ブロック関係をまとめて引き、通知行をまとめて INSERT する
+    actor = _normalize_email(actor_email)
+    notif_type = (notification_type or 'general').strip().lower()
+    recipients = []
+    seen = set()
+    for value in recipient_emails:
+        email = _normalize_email(value)
+        if not email or email == actor or email in seen:
+            continue
+        seen.add(email)
+        recipients.append(email)
+    if not recipients:
+        return 0
+
+    seller_email = None
+    if related_product_id:
+        seller_email = _normalize_email(
+            db.session.query(User.email)
+            .join(Product, Product.seller_id == User.id)
+            .filter(Product.id == related_product_id)
+            .scalar()
+        )
+
+    created = 0
+    for start in range(0, len(recipients), NOTIFICATION_FANOUT_BATCH_SIZE):
+        chunk = recipients[start:start + NOTIFICATION_FANOUT_BATCH_SIZE]
+        excluded = _blocked_counterparts(actor, chunk)
+        settings = {
+            _normalize_email(setting.user_email): setting
+            for setting in (
+                UserNotificationSetting.query
+                .filter(UserNotificationSetting.user_email.in_(chunk))
+                .all()
+            )
+        }
+        # 設定行が無いユーザーは既定値（プッシュ通知オン）として扱う
+        targets = [
+            email for email in chunk
+            if email not in excluded
+            and (email not in settings or _notification_setting_allows(settings[email], notif_type))
+        ]
+        if targets and related_product_id:
+            # ジョブ再実行時は、前回までにコミット済みのバッチで通知済みの宛先を飛ばす
+            delivered = {
+                _normalize_email(row[0])
+                for row in (
+                    db.session.query(Notification.user_email)
+                    .filter(
+                        Notification.user_email.in_(targets),
+                        Notification.notification_type == notif_type,
+                        Notification.related_product_id == related_product_id
+                    )
+                    .all()
+                )
+            }
+            targets = [email for email in targets if email not in delivered]
+        if not targets:
+            continue
+
+        hidden = set()
+        if seller_email and seller_email != actor:
+            hidden = _blocked_counterparts(seller_email, targets)
+
+        now = datetime.utcnow()
+        user_ids = dict(db.session.query(User.email, User.id).filter(User.email.in_(targets)).all())
+        try:
+            db.session.execute(
+                Notification.__table__.insert(),
+                [
+                    {
+                        "user_email": email,
+                        "user_id": user_ids.get(email),
+                        "notification_type": notif_type,
+                        "title": title or '通知',
+                        "message": message or '',
+                        "related_product_id": related_product_id,
+                        "is_read": False,
+                        "created_at": now
+                    }
+                    for email in targets
+                ]
+            )
+            counted = [email for email in targets if email not in hidden]
+            if counted:
+                # 行がある利用者は一括加算し、無い利用者だけ再集計付きの upsert で作る（各利用者に加算は1回）
+                existing = {
+                    row[0] for row in
+                    db.session.query(NotificationCounter.user_email)
+                    .filter(NotificationCounter.user_email.in_(counted))
+                    .all()
+                }
+                if existing:
+                    db.session.execute(
+                        NotificationCounter.__table__.update()
+                        .where(NotificationCounter.user_email.in_(existing))
+                        .values(unread_count=NotificationCounter.unread_count + 1, updated_at=now)
+                    )
+                for email in counted:
+                    if email not in existing:
+                        _upsert_notification_counter(email, increment=True)
+            _job_heartbeat()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        created += len(targets)
+    return created
+
+
+def _notify_followers_of_listing(product_id, seller_email, seller_name, product_title):
+    follower_emails = [
+        row.follower_email
+        for row in (
+            db.session.query(ForumFollow.follower_email)
+            .filter(ForumFollow.followee_email == seller_email)
+            .all()
+        )
+    ]
+    return _fan_out_notifications(
+        follower_emails,
+        notification_type='follow_listing',
+        title='フォロー中ユーザーが出品しました',
+        message=f"{seller_name}さんが「{product_title}」を出品しました。",
+        related_product_id=product_id,
+        actor_email=seller_email
+    )
 
 
 def _serialize_notification(notification):
@@ -644,117 +1930,569 @@ def _normalize_public_user_id(value):
     return (value or '').strip().lower()
 
 
-def _is_valid_public_user_id(value):
-    return bool(re.fullmatch(r'[a-z0-9_.-]{3,30}', value or ''))
+def _is_valid_public_user_id(value):
+    return bool(re.fullmatch(r'[a-z0-9_.-]{3,30}', value or ''))
+
+
+def _generate_unique_user_id(source):
+    base_source = _normalize_public_user_id(source)
+    base_source = base_source.split('@')[0] if '@' in base_source else base_source
+    sanitized = re.sub(r'[^a-z0-9_.-]', '', base_source)
+    base = (sanitized or 'user')[:50]
+
+    candidate = base
+    sequence = 1
+    while User.query.filter(db.func.lower(User.user_id) == candidate).first():
+        suffix = f"-{sequence}"
+        candidate = f"{base[:max(1, 50 - len(suffix))]}{suffix}"
+        sequence += 1
+    return candidate
+
+
+def _ensure_user_id_backfill_once():
+    global _USER_ID_BACKFILL_READY
+    if _USER_ID_BACKFILL_READY:
+        return
+
+    users = User.query.order_by(User.id.asc()).all()
+    seen = set()
+    changed = False
+
+    for user in users:
+        current = _normalize_public_user_id(user.user_id)
+        if current and current not in seen:
+            seen.add(current)
+            continue
+
+        source = user.email or current or f"user{user.id}"
+        new_user_id = _generate_unique_user_id(source)
+        user.user_id = new_user_id
+        seen.add(new_user_id)
+        changed = True
+
+    if changed:
+        db.session.commit()
+
+    _USER_ID_BACKFILL_READY = True
+
+
+def _coerce_optional_int(value):
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_forum_actor_email():
+    data = request.get_json(silent=True) or {}
+    email = _normalize_email(data.get('actor_email'))
+    if email:
+        return email
+    return _normalize_email(request.args.get('actor_email'))
+
+
+def _ensure_forum_schema_once():
+    global _FORUM_SCHEMA_READY
+    if _FORUM_SCHEMA_READY:
+        return
+
+    inspector = inspect(db.engine)
+    table_names = set(inspector.get_table_names())
+
+    # create missing forum like tables defined by SQLAlchemy models
+    if 'forum_thread_likes' not in table_names or 'forum_comment_likes' not in table_names:
+        db.create_all()
+        inspector = inspect(db.engine)
+        table_names = set(inspector.get_table_names())
+
+    if 'forum_comments' in table_names:
+        column_names = {col['name'] for col in inspector.get_columns('forum_comments')}
+        if 'parent_comment_id' not in column_names:
+            db.session.execute(text("ALTER TABLE forum_comments ADD COLUMN parent_comment_id INTEGER NULL"))
+            db.session.commit()
+
+    _FORUM_SCHEMA_READY = True
+
+
+# 既存テーブルに後から追加したカラム（create_all では追加されない）
+SCHEMA_COLUMN_UPGRADES = {
+    "users": [
+        ("rating_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("rating_sum", "INTEGER NOT NULL DEFAULT 0"),
+        ("recent_reviews_json", "TEXT NULL"),
+        ("follower_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("following_count", "INTEGER NOT NULL DEFAULT 0"),
+    ],
+    "products": [
+        ("view_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("primary_image_url", "VARCHAR(255) NULL"),
+        ("thumbnail_url", "VARCHAR(255) NULL"),
+        ("latest_purchase_id", "INTEGER NULL"),
+        ("latest_purchase_status", "VARCHAR(30) NULL"),
+    ],
+    "purchases": [("buyer_user_id", "INTEGER NULL")],
+    "purchase_reviews": [("reviewer_user_id", "INTEGER NULL"), ("reviewee_user_id", "INTEGER NULL")],
+    "product_chat_messages": [("sender_user_id", "INTEGER NULL"), ("receiver_user_id", "INTEGER NULL")],
+    "notifications": [("user_id", "INTEGER NULL")],
+    "forum_thread_likes": [("user_id", "INTEGER NULL")],
+    "forum_follows": [("follower_user_id", "INTEGER NULL"), ("followee_user_id", "INTEGER NULL")],
+    "user_blocks": [("blocker_user_id", "INTEGER NULL"), ("blocked_user_id", "INTEGER NULL")],
+}
+
+
+def _add_missing_columns(table_name, column_ddls):
+    inspector = inspect(db.engine)
+    if table_name not in set(inspector.get_table_names()):
+        return []
+
+    existing = {col['name'] for col in inspector.get_columns(table_name)}
+    added = []
+    for column_name, ddl in column_ddls:
+        if column_name in existing:
+            continue
+        db.session.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl}"))
+        added.append(column_name)
+    if added:
+        db.session.commit()
+    return added
+
+
+def _ensure_schema_upgrades_once():
+    global _SCHEMA_UPGRADES_READY
+    if _SCHEMA_UPGRADES_READY:
+        return
+
+    db.create_all()
+    added_columns = {}
+    for table_name, column_ddls in SCHEMA_COLUMN_UPGRADES.items():
+        added = _add_missing_columns(table_name, column_ddls)
+        if added:
+            added_columns[table_name] = added
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    _add_missing_user_foreign_keys()
+
+    if 'view_count' in added_columns.get('products', []):
+        _compact_product_views()
+    if 'primary_image_url' in added_columns.get('products', []):
+        _backfill_product_card_fields()
+
+    _run_pending_data_migrations()
+    _SCHEMA_UPGRADES_READY = True
+
+
+def _normalize_email_column(model, column_name):
+    table = model.__table__
+    column = table.c[column_name]
+    try:
+        db.session.execute(
+            table.update()
+            .where(column.isnot(None))
+            .values({column_name: db.func.lower(db.func.trim(column))})
+        )
+        db.session.commit()
+        return
+    except Exception:
+        # 大文字小文字違いの重複がユニーク制約に当たった場合は1行ずつ処理する
+        db.session.rollback()
+
+    pk_columns = list(table.primary_key.columns)
+    rows = db.session.execute(db.select(*pk_columns, column).where(column.isnot(None))).all()
+    for row in rows:
+        value = row[-1]
+        normalized = _normalize_email(value)
+        if normalized == value:
+            continue
+        pk_filter = db.and_(*[pk == row[index] for index, pk in enumerate(pk_columns)])
+        try:
+            db.session.execute(table.update().where(pk_filter).values({column_name: normalized}))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if model is User:
+                raise
+            # フォロー・ブロック・いいね等は正規化済みの行と重複しているので古い行を消す
+            db.session.execute(table.delete().where(pk_filter))
+            db.session.commit()
+
+
+def _add_missing_user_foreign_keys():
+    # SQLite は ALTER TABLE で外部キーを追加できないため、新規作成時のモデル定義に任せる
+    if db.engine.dialect.name == 'sqlite':
+        return
+    inspector = inspect(db.engine)
+    for model, _email_column, id_column in USER_ID_COLUMNS:
+        table_name = model.__tablename__
+        existing = {
+            tuple(fk['constrained_columns'])
+            for fk in inspector.get_foreign_keys(table_name)
+        }
+        if (id_column,) in existing:
+            continue
+        db.session.execute(text(
+            f"ALTER TABLE {table_name} ADD CONSTRAINT fk_{table_name}_{id_column} "
+            f"FOREIGN KEY ({id_column}) REFERENCES users (id)"
+        ))
+        db.session.commit()
+
+
+USER_ID_BACKFILL_BATCH_SIZE = 1000
+
+
+def _backfill_user_id_columns(batch_size=USER_ID_BACKFILL_BATCH_SIZE):
+    # 主キー範囲ごとに UPDATE ... = (SELECT users.id ...) を流し、長いロックを避ける
+    updated = 0
+    for model, email_column, id_column in USER_ID_COLUMNS:
+        table = model.__table__
+        max_id = db.session.query(db.func.max(table.c.id)).scalar() or 0
+        user_id_subquery = (
+            db.select(User.id)
+            .where(User.email == table.c[email_column])
+            .scalar_subquery()
+        )
+        for start in range(0, max_id, batch_size):
+            result = db.session.execute(
+                table.update()
+                .where(table.c.id > start, table.c.id <= start + batch_size)
+                .where(table.c[id_column].is_(None))
+                .values({id_column: user_id_subquery})
+            )
+            db.session.commit()
+            updated += result.rowcount or 0
+    with _USER_ID_BACKFILL_LOCK:
+        _USER_ID_BACKFILL_STATE.clear()
+    return updated
+
+
+USER_ID_BACKFILL_RECHECK_SECONDS = int(os.getenv("USER_ID_BACKFILL_RECHECK_SECONDS", "60"))
 
+_USER_ID_BACKFILL_STATE = {}  # (テーブル名, ID列) -> (未設定の行が残っているか, 確認時刻)
+_USER_ID_BACKFILL_LOCK = threading.Lock()
 
-def _generate_unique_user_id(source):
-    base_source = _normalize_public_user_id(source)
-    base_source = base_source.split('@')[0] if '@' in base_source else base_source
-    sanitized = re.sub(r'[^a-z0-9_.-]', '', base_source)
-    base = (sanitized or 'user')[:50]
 
-    candidate = base
-    sequence = 1
-    while User.query.filter(db.func.lower(User.user_id) == candidate).first():
-        suffix = f"-{sequence}"
-        candidate = f"{base[:max(1, 50 - len(suffix))]}{suffix}"
-        sequence += 1
-    return candidate
+def _user_id_backfill_pending(model, email_column, id_column):
+    # 移行が終わった列は以後IDだけで引く。残っている間は一定間隔で確認し直す
+    key = (model.__tablename__, id_column)
+    now = time.monotonic()
+    with _USER_ID_BACKFILL_LOCK:
+        state = _USER_ID_BACKFILL_STATE.get(key)
+    if state is not None and (not state[0] or now - state[1] < USER_ID_BACKFILL_RECHECK_SECONDS):
+        return state[0]
 
+    table = model.__table__
+    pending = db.session.execute(
+        db.select(table.c.id)
+        .join(User.__table__, User.__table__.c.email == table.c[email_column])
+        .where(table.c[id_column].is_(None))
+        .limit(1)
+    ).first() is not None
+    with _USER_ID_BACKFILL_LOCK:
+        _USER_ID_BACKFILL_STATE[key] = (pending, now)
+    return pending
+
+
+def _user_ref_filter(model, email_column, id_column, email):
+    # 整数IDの列で引き、バックフィル前（IDが NULL）の行だけメール列でも拾う
+    email = _normalize_email(email)
+    email_attr = getattr(model, email_column)
+    id_attr = getattr(model, id_column)
+    user = _find_user_by_email(email)
+    if user is None:
+        return email_attr == email
+    condition = id_attr == user.id
+    if _user_id_backfill_pending(model, email_column, id_column):
+        condition = db.or_(condition, db.and_(id_attr.is_(None), email_attr == email))
+    return condition
+
+
+EMAIL_CONFLICT_REPORT_LIMIT = 50
+
+
+def _find_case_duplicate_user_emails():
+    normalized = db.func.lower(db.func.trim(User.email))
+    duplicated = (
+        db.session.query(normalized)
+        .filter(User.email.isnot(None))
+        .group_by(normalized)
+        .having(db.func.count(User.id) > 1)
+        .order_by(normalized)
+        .limit(EMAIL_CONFLICT_REPORT_LIMIT)
+        .all()
+    )
+    conflicts = []
+    for (email,) in duplicated:
+        rows = User.query.filter(normalized == email).order_by(User.id.asc()).all()
+        conflicts.append((email, [(user.id, user.email) for user in rows]))
+    return conflicts
+
+
+def _migrate_normalize_emails():
+    # 大文字小文字違いで重複するユーザーは自動で統合できない（正規化しないとログインできない）ため、
+    # 1行も書き換えずに一覧を出して止める。運用側で統合・削除してから再実行する
+    conflicts = _find_case_duplicate_user_emails()
+    if conflicts:
+        details = "; ".join(
+            f"{email}: " + ", ".join(f"id={user_id} {raw}" for user_id, raw in rows)
+            for email, rows in conflicts
+        )
+        raise RuntimeError(f"users with case-duplicate emails must be merged before normalizing: {details}")
 
-def _ensure_user_id_backfill_once():
-    global _USER_ID_BACKFILL_READY
-    if _USER_ID_BACKFILL_READY:
-        return
+    table_names = set(inspect(db.engine).get_table_names())
+    for model, column_name in NORMALIZED_EMAIL_COLUMNS:
+        if model.__tablename__ in table_names:
+            _normalize_email_column(model, column_name)
 
-    users = User.query.order_by(User.id.asc()).all()
-    seen = set()
-    changed = False
 
-    for user in users:
-        current = _normalize_public_user_id(user.user_id)
-        if current and current not in seen:
-            seen.add(current)
+def _backfill_user_rating_summaries():
+    users = User.__table__
+    aggregates = (
+        db.session.query(
+            PurchaseReview.reviewee_email,
+            db.func.count(PurchaseReview.id),
+            db.func.coalesce(db.func.sum(PurchaseReview.rating), 0)
+        )
+        .group_by(PurchaseReview.reviewee_email)
+        .all()
+    )
+    db.session.execute(users.update().values(rating_count=0, rating_sum=0, recent_reviews_json=None))
+    for reviewee_email, rating_count, rating_sum in aggregates:
+        if not reviewee_email:
             continue
+        db.session.execute(
+            users.update()
+            .where(users.c.email == reviewee_email)
+            .values(
+                rating_count=int(rating_count or 0),
+                rating_sum=int(rating_sum or 0),
+                recent_reviews_json=_build_recent_reviews_json(reviewee_email)
+            )
+        )
+    db.session.commit()
+    return len(aggregates)
 
-        source = user.email or current or f"user{user.id}"
-        new_user_id = _generate_unique_user_id(source)
-        user.user_id = new_user_id
-        seen.add(new_user_id)
-        changed = True
 
-    if changed:
+FOLLOW_COUNT_RECONCILE_BATCH_SIZE = 1000
+
+
+def _reconcile_follow_counts(batch_size=FOLLOW_COUNT_RECONCILE_BATCH_SIZE):
+    # forum_follows から数え直し、ずれている行だけを主キー範囲ごとに更新する
+    users = User.__table__
+    follower_subquery = (
+        db.select(db.func.count(ForumFollow.id))
+        .where(ForumFollow.followee_email == users.c.email)
+        .scalar_subquery()
+    )
+    following_subquery = (
+        db.select(db.func.count(ForumFollow.id))
+        .where(ForumFollow.follower_email == users.c.email)
+        .scalar_subquery()
+    )
+    max_id = db.session.query(db.func.max(users.c.id)).scalar() or 0
+    repaired = 0
+    for start in range(0, max_id, batch_size):
+        result = db.session.execute(
+            users.update()
+            .where(users.c.id > start, users.c.id <= start + batch_size)
+            .where(db.or_(
+                users.c.follower_count != follower_subquery,
+                users.c.following_count != following_subquery
+            ))
+            .values(follower_count=follower_subquery, following_count=following_subquery)
+        )
         db.session.commit()
+        repaired += result.rowcount or 0
+    return repaired
+
+
+def _backfill_follow_timeline():
+    # 既存のフォロー関係から販売中商品をタイムラインへまとめて展開する（大量フォロワーの出品者は読み取り時に補う）
+    timeline = FollowTimelineEntry.__table__
+    source = (
+        db.select(
+            ForumFollow.follower_user_id,
+            Product.id,
+            Product.seller_id,
+            db.func.coalesce(Product.created_at, db.func.now())
+        )
+        .select_from(ForumFollow)
+        .join(Product, Product.seller_id == ForumFollow.followee_user_id)
+        .join(User, User.id == ForumFollow.followee_user_id)
+        .where(
+            ForumFollow.follower_user_id.isnot(None),
+            Product.status == 1,
+            User.follower_count <= FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS
+        )
+        .distinct()
+    )
+    result = db.session.execute(
+        timeline.insert().from_select(['owner_user_id', 'product_id', 'seller_user_id', 'created_at'], source)
+    )
+    db.session.commit()
+    return result.rowcount or 0
+
+
+def _seed_social_graph_versions():
+    versions = SocialGraphVersion.__table__
+    existing = db.select(versions.c.user_email).where(versions.c.user_email == User.email)
+    result = db.session.execute(
+        versions.insert().from_select(
+            ['user_email', 'version', 'updated_at'],
+            db.select(User.email, db.literal(0), db.func.now())
+            .where(User.email.isnot(None), ~db.exists(existing))
+        )
+    )
+    db.session.commit()
+    return result.rowcount or 0
 
-    _USER_ID_BACKFILL_READY = True
 
+# 一度だけ実行するデータ移行（適用済みの名前は schema_migrations に記録する）
+DATA_MIGRATIONS = (
+    ("normalize_emails", _migrate_normalize_emails),
+    ("backfill_user_id_columns", _backfill_user_id_columns),
+    ("backfill_user_rating_summaries", _backfill_user_rating_summaries),
+    ("backfill_follow_counts", _reconcile_follow_counts),
+    ("backfill_follow_timeline", _backfill_follow_timeline),
+    ("seed_social_graph_versions", _seed_social_graph_versions),
+)
 
-def _coerce_optional_int(value):
-    if value is None or value == '':
-        return None
-    try:
-        return int(value)
-    except (TypeError, ValueError):
-        return None
+
+def _run_pending_data_migrations():
+    applied = {row.name for row in SchemaMigration.query.all()}
+    for name, migrate in DATA_MIGRATIONS:
+        if name in applied:
+            continue
+        migrate()
+        db.session.add(SchemaMigration(name=name))
+        db.session.commit()
 
 
-def _get_forum_actor_email():
-    data = request.get_json(silent=True) or {}
-    email = _normalize_email(data.get('actor_email'))
-    if email:
-        return email
-    return _normalize_email(request.args.get('actor_email'))
+# ============================
+# ソーシャルグラフキャッシュ（フォロー・ブロックの隣接集合をプロセス内に保持）
+# ============================
+SOCIAL_GRAPH_CACHE_MAX_USERS = int(os.getenv("SOCIAL_GRAPH_CACHE_MAX_USERS", "10000"))
 
+_SOCIAL_GRAPH_CACHE = {}  # email -> (version, 隣接集合)
+_SOCIAL_GRAPH_LOCK = threading.Lock()
 
-def _ensure_forum_schema_once():
-    global _FORUM_SCHEMA_READY
-    if _FORUM_SCHEMA_READY:
-        return
 
-    inspector = inspect(db.engine)
-    table_names = set(inspector.get_table_names())
+def _social_graph_versions(emails):
+    # リクエスト中は一度読んだ版数を使い回し、未取得のユーザーだけをまとめて引く
+    known = g.setdefault('_social_graph_versions', {}) if has_request_context() else {}
+    missing = [email for email in emails if email not in known]
+    if missing:
+        rows = dict(
+            db.session.query(SocialGraphVersion.user_email, SocialGraphVersion.version)
+            .filter(SocialGraphVersion.user_email.in_(missing))
+            .all()
+        )
+        for email in missing:
+            known[email] = int(rows.get(email) or 0)
+    return {email: known[email] for email in emails}
+
+
+def _bump_social_graph_versions(*emails):
+    # フォロー・ブロックの書き込みと同じトランザクションで当事者の版数だけを進める。
+    # 他プロセスは次のリクエストで版数の違いに気付き、その当事者のエントリだけを読み直す
+    targets = sorted({_normalize_email(email) for email in emails if _normalize_email(email)})
+    versions = SocialGraphVersion.__table__
+    now = datetime.utcnow()
+    for email in targets:
+        _insert_ignore(versions, {"user_email": email, "version": 0, "updated_at": now}, ['user_email'])
+        db.session.execute(
+            versions.update()
+            .where(versions.c.user_email == email)
+            .values(version=versions.c.version + 1, updated_at=now)
+        )
+    with _SOCIAL_GRAPH_LOCK:
+        for email in targets:
+            _SOCIAL_GRAPH_CACHE.pop(email, None)
+    if has_request_context():
+        known = g.get('_social_graph_versions')
+        if known:
+            for email in targets:
+                known.pop(email, None)
+
+
+def _load_social_graph_entry(email):
+    following = {
+        _normalize_email(row[0])
+        for row in (
+            db.session.query(ForumFollow.followee_email)
+            .filter(_user_ref_filter(ForumFollow, 'follower_email', 'follower_user_id', email))
+            .all()
+        )
+        if row[0]
+    }
+    blocked_by_me = set()
+    blocked_me = set()
+    rows = (
+        db.session.query(UserBlock.blocker_email, UserBlock.blocked_email)
+        .filter(
+            db.or_(
+                _user_ref_filter(UserBlock, 'blocker_email', 'blocker_user_id', email),
+                _user_ref_filter(UserBlock, 'blocked_email', 'blocked_user_id', email)
+            )
+        )
+        .all()
+    )
+    for blocker, blocked in rows:
+        blocker = _normalize_email(blocker)
+        blocked = _normalize_email(blocked)
+        if blocker == email and blocked:
+            blocked_by_me.add(blocked)
+        elif blocked == email and blocker:
+            blocked_me.add(blocker)
+    return {
+        "following": frozenset(following),
+        "blocked_by_me": frozenset(blocked_by_me),
+        "blocked_me": frozenset(blocked_me),
+    }
 
-    # create missing forum like tables defined by SQLAlchemy models
-    if 'forum_thread_likes' not in table_names or 'forum_comment_likes' not in table_names:
-        db.create_all()
-        inspector = inspect(db.engine)
-        table_names = set(inspector.get_table_names())
 
-    if 'forum_comments' in table_names:
-        column_names = {col['name'] for col in inspector.get_columns('forum_comments')}
-        if 'parent_comment_id' not in column_names:
-            db.session.execute(text("ALTER TABLE forum_comments ADD COLUMN parent_comment_id INTEGER NULL"))
-            db.session.commit()
+def _social_graph_entry(email):
+    # データより先に版数を読むので、読み込み中に更新が入っても次のリクエストで読み直される
+    version = _social_graph_versions([email])[email]
+    with _SOCIAL_GRAPH_LOCK:
+        cached = _SOCIAL_GRAPH_CACHE.get(email)
+    if cached is not None and cached[0] == version:
+        return cached[1]
 
-    _FORUM_SCHEMA_READY = True
+    entry = _load_social_graph_entry(email)
+    with _SOCIAL_GRAPH_LOCK:
+        if email not in _SOCIAL_GRAPH_CACHE and len(_SOCIAL_GRAPH_CACHE) >= SOCIAL_GRAPH_CACHE_MAX_USERS:
+            _SOCIAL_GRAPH_CACHE.pop(next(iter(_SOCIAL_GRAPH_CACHE)))
+        _SOCIAL_GRAPH_CACHE[email] = (version, entry)
+    return entry
+
+
+def _is_following(follower_email, followee_email):
+    follower = _normalize_email(follower_email)
+    followee = _normalize_email(followee_email)
+    if not follower or not followee:
+        return False
+    return followee in _social_graph_entry(follower)["following"]
 
 
 def _get_blocked_email_set(email):
     normalized = _normalize_email(email)
     if not normalized:
         return set()
+    entry = _social_graph_entry(normalized)
+    return set(entry["blocked_by_me"] | entry["blocked_me"])
 
-    rows = (
-        UserBlock.query
-        .filter(
-            db.or_(
-                db.func.lower(UserBlock.blocker_email) == normalized,
-                db.func.lower(UserBlock.blocked_email) == normalized
-            )
-        )
-        .all()
-    )
 
-    blocked_set = set()
-    for row in rows:
-        blocker = _normalize_email(row.blocker_email)
-        blocked = _normalize_email(row.blocked_email)
-        if blocker == normalized and blocked:
-            blocked_set.add(blocked)
-        elif blocked == normalized and blocker:
-            blocked_set.add(blocker)
-    return blocked_set
+def _resolve_block_relations(email, target_emails):
+    # email から見た target_emails のブロック関係を (自分がブロック, 相手からブロック) の集合で返す
+    normalized = _normalize_email(email)
+    targets = {_normalize_email(target) for target in target_emails if _normalize_email(target)}
+    if not normalized or not targets:
+        return set(), set()
+    entry = _social_graph_entry(normalized)
+    return set(entry["blocked_by_me"] & targets), set(entry["blocked_me"] & targets)
 
 
 def _coerce_bool(value):
@@ -774,7 +2512,7 @@ def _get_or_create_notification_setting(email):
 
     setting = (
         UserNotificationSetting.query
-        .filter(db.func.lower(UserNotificationSetting.user_email) == normalized)
+        .filter(UserNotificationSetting.user_email == normalized)
         .first()
     )
     if setting:
@@ -795,7 +2533,10 @@ def _notification_enabled_for_type(email, notification_type):
     setting = _get_or_create_notification_setting(email)
     if not setting:
         return False
+    return _notification_setting_allows(setting, notification_type)
 
+
+def _notification_setting_allows(setting, notification_type):
     if not setting.push_notification:
         return False
 
@@ -817,8 +2558,9 @@ def _get_block_relation(email_a, email_b):
             "is_blocked": False
         }
 
-    blocked_by_a = UserBlock.query.filter_by(blocker_email=a, blocked_email=b).first() is not None
-    blocked_by_b = UserBlock.query.filter_by(blocker_email=b, blocked_email=a).first() is not None
+    entry = _social_graph_entry(a)
+    blocked_by_a = b in entry["blocked_by_me"]
+    blocked_by_b = b in entry["blocked_me"]
     return {
         "blocked_by_a": blocked_by_a,
         "blocked_by_b": blocked_by_b,
@@ -826,11 +2568,43 @@ def _get_block_relation(email_a, email_b):
     }
 
 
+USER_LOOKUP_BATCH_SIZE = 500
+
+
+def _request_user_cache():
+    # リクエスト単位のメール -> User の対応表（見つからなかったメールは None を保持）
+    cache = g.get('_user_by_email')
+    if cache is None:
+        cache = {}
+        g._user_by_email = cache
+    return cache
+
+
+def _prime_users_by_email(emails):
+    cache = _request_user_cache()
+    missing = []
+    seen = set()
+    for email in emails:
+        normalized = _normalize_email(email)
+        if normalized and normalized not in cache and normalized not in seen:
+            seen.add(normalized)
+            missing.append(normalized)
+
+    for start in range(0, len(missing), USER_LOOKUP_BATCH_SIZE):
+        chunk = missing[start:start + USER_LOOKUP_BATCH_SIZE]
+        users = User.query.filter(User.email.in_(chunk)).all()
+        for user in users:
+            cache[_normalize_email(user.email)] = user
+        for email in chunk:
+            cache.setdefault(email, None)
+    return cache
+
+
 def _find_user_by_email(email):
     normalized = _normalize_email(email)
     if not normalized:
         return None
-    return User.query.filter(db.func.lower(User.email) == normalized).first()
+    return _prime_users_by_email([normalized]).get(normalized)
 
 
 def _display_name_from_email(email, user=None):
@@ -839,6 +2613,53 @@ def _display_name_from_email(email, user=None):
     return (email.split('@')[0] if email else 'ユーザー')
 
 
+USER_RECENT_REVIEWS_LIMIT = 5
+
+
+def _build_recent_reviews_json(reviewee_email):
+    rows = (
+        PurchaseReview.query
+        .filter(PurchaseReview.reviewee_email == reviewee_email)
+        .filter(PurchaseReview.comment.isnot(None))
+        .filter(db.func.length(db.func.trim(PurchaseReview.comment)) > 0)
+        .order_by(PurchaseReview.created_at.desc(), PurchaseReview.id.desc())
+        .limit(USER_RECENT_REVIEWS_LIMIT)
+        .all()
+    )
+    return json.dumps([
+        {
+            "id": row.id,
+            "rating": int(row.rating or 0),
+            "comment": row.comment or '',
+            "reviewer_email": _normalize_email(row.reviewer_email),
+            "created_at": row.created_at.isoformat() if row.created_at else None
+        }
+        for row in rows
+    ], ensure_ascii=False)
+
+
+def _apply_review_to_user_rating(review):
+    # 件数・合計はSQL側で加算し、同時投稿でも取りこぼさないようにする
+    db.session.flush()
+    users = User.__table__
+    result = db.session.execute(
+        users.update()
+        .where(users.c.email == review.reviewee_email)
+        .values(
+            rating_count=users.c.rating_count + 1,
+            rating_sum=users.c.rating_sum + int(review.rating or 0)
+        )
+    )
+    if not result.rowcount or not (review.comment or '').strip():
+        return
+    # 上の UPDATE で行ロックを取った後に最新コメント一覧を作り直す
+    db.session.execute(
+        users.update()
+        .where(users.c.email == review.reviewee_email)
+        .values(recent_reviews_json=_build_recent_reviews_json(review.reviewee_email))
+    )
+
+
 def _build_user_rating_summary(target_email):
     normalized_email = _normalize_email(target_email)
     if not normalized_email:
@@ -848,39 +2669,43 @@ def _build_user_rating_summary(target_email):
             "reviews": []
         }
 
-    aggregate = (
-        db.session.query(
-            db.func.count(PurchaseReview.id),
-            db.func.avg(PurchaseReview.rating)
+    user = _find_user_by_email(normalized_email)
+    if user:
+        rating_count = int(user.rating_count or 0)
+        rating_sum = int(user.rating_sum or 0)
+        recent_reviews_json = user.recent_reviews_json
+    else:
+        # 集計列を持つユーザー行が無い（退会済みなど）場合はレビューから直接集計する
+        rating_count, rating_sum = (
+            db.session.query(
+                db.func.count(PurchaseReview.id),
+                db.func.coalesce(db.func.sum(PurchaseReview.rating), 0)
+            )
+            .filter(PurchaseReview.reviewee_email == normalized_email)
+            .one()
         )
-        .filter(db.func.lower(PurchaseReview.reviewee_email) == normalized_email)
-        .first()
-    )
-
-    rating_count = int((aggregate[0] if aggregate else 0) or 0)
-    rating_average = float((aggregate[1] if aggregate else 0) or 0)
+        rating_count = int(rating_count or 0)
+        rating_sum = int(rating_sum or 0)
+        recent_reviews_json = _build_recent_reviews_json(normalized_email) if rating_count else None
+    rating_average = (rating_sum / rating_count) if rating_count else 0.0
 
-    comment_rows = (
-        PurchaseReview.query
-        .filter(db.func.lower(PurchaseReview.reviewee_email) == normalized_email)
-        .filter(PurchaseReview.comment.isnot(None))
-        .filter(db.func.length(db.func.trim(PurchaseReview.comment)) > 0)
-        .order_by(PurchaseReview.created_at.desc(), PurchaseReview.id.desc())
-        .limit(5)
-        .all()
-    )
+    try:
+        cached_reviews = json.loads(recent_reviews_json or '[]')
+    except ValueError:
+        cached_reviews = []
 
+    _prime_users_by_email(item.get("reviewer_email") for item in cached_reviews)
     review_comments = []
-    for row in comment_rows:
-        reviewer_email = _normalize_email(row.reviewer_email)
+    for item in cached_reviews:
+        reviewer_email = _normalize_email(item.get("reviewer_email"))
         reviewer_user = _find_user_by_email(reviewer_email)
         review_comments.append({
-            "id": row.id,
-            "rating": int(row.rating or 0),
-            "comment": row.comment or '',
+            "id": item.get("id"),
+            "rating": int(item.get("rating") or 0),
+            "comment": item.get("comment") or '',
             "reviewer_email": reviewer_email,
             "reviewer_name": _display_name_from_email(reviewer_email, reviewer_user),
-            "created_at": row.created_at.isoformat() if row.created_at else None
+            "created_at": item.get("created_at")
         })
 
     return {
@@ -890,6 +2715,14 @@ def _build_user_rating_summary(target_email):
     }
 
 
+def _chat_sender_filter(email):
+    return _user_ref_filter(ProductChatMessage, 'sender_email', 'sender_user_id', email)
+
+
+def _chat_receiver_filter(email):
+    return _user_ref_filter(ProductChatMessage, 'receiver_email', 'receiver_user_id', email)
+
+
 def _serialize_chat_message(chat_message, seller_email, current_email):
     sender_email = _normalize_email(chat_message.sender_email)
     sender_user = _find_user_by_email(sender_email)
@@ -906,6 +2739,195 @@ def _serialize_chat_message(chat_message, seller_email, current_email):
         "created_at": chat_message.created_at.isoformat() if chat_message.created_at else None,
         "is_own": sender_email == _normalize_email(current_email)
     }
+
+
+# ============================
+# ユーザー向けイベント配信（SSE）
+# ============================
+# 同一プロセス内はコミット直後に直接配信し、他ワーカーで書き込まれた行は
+# プロセスごとに1本のブローカースレッドが DB をポーリングして配信する。
+# ストリームは接続中ずっとワーカーを1つ占有するため、本番では gunicorn の
+# gthread / gevent など接続数に見合うスレッド・非同期ワーカーで動かし、
+# 1プロセスあたりの同時接続数を EVENT_STREAM_MAX_CONNECTIONS で制限する
+EVENT_BROKER_POLL_SECONDS = float(os.getenv("EVENT_BROKER_POLL_SECONDS", "2"))
+# id の大小はコミット順と一致しない（MySQL では採番後に遅れてコミットされる行がある）ため、
+# 前回ポーリング時刻からこの秒数だけ遡って読み直し、配信済みの id は読み飛ばす
+EVENT_BROKER_OVERLAP_SECONDS = float(os.getenv("EVENT_BROKER_OVERLAP_SECONDS", "30"))
+EVENT_STREAM_MAX_CONNECTIONS = int(os.getenv("EVENT_STREAM_MAX_CONNECTIONS", "100"))
+EVENT_STREAM_KEEPALIVE_SECONDS = 15
+EVENT_SUBSCRIBER_QUEUE_SIZE = 100
+EVENT_BROKER_BATCH_SIZE = 500
+EVENT_RECENT_KEYS_LIMIT = 5000
+
+_EVENT_SUBSCRIBERS = {}
+_EVENT_STREAM_COUNT = 0
+_EVENT_LOCK = threading.Lock()
+_EVENT_RECENT_KEYS = set()
+_EVENT_RECENT_ORDER = deque()
+_EVENT_POLL_SINCE = {"chat_message": None, "notification": None}
+_EVENT_POLL_SEEN = {"chat_message": {}, "notification": {}}  # id -> created_at（重複窓の間だけ保持）
+_EVENT_BROKER_PID = None
+
+
+def _user_events_for_row(kind, row):
+    if kind == 'chat_message':
+        payload = {
+            "id": row.id,
+            "product_id": row.product_id,
+            "sender_email": _normalize_email(row.sender_email),
+            "receiver_email": _normalize_email(row.receiver_email),
+            "created_at": row.created_at.isoformat() if row.created_at else None
+        }
+        return [(payload["sender_email"], payload), (payload["receiver_email"], payload)]
+    email = _normalize_email(row.user_email)
+    # 一覧（_visible_notifications_query）と同じく、ブロック関係にある出品者の商品の通知は配信しない
+    if _notification_hidden_by_block(email, row.related_product_id):
+        return []
+    return [(email, _serialize_notification(row))]
+
+
+def _publish_user_event(email, event_type, payload, event_id=None):
+    if not email:
+        return
+
+    with _EVENT_LOCK:
+        if event_id is not None:
+            key = (event_type, event_id, email)
+            if key in _EVENT_RECENT_KEYS:
+                return
+            _EVENT_RECENT_KEYS.add(key)
+            _EVENT_RECENT_ORDER.append(key)
+            while len(_EVENT_RECENT_ORDER) > EVENT_RECENT_KEYS_LIMIT:
+                _EVENT_RECENT_KEYS.discard(_EVENT_RECENT_ORDER.popleft())
+        subscribers = list(_EVENT_SUBSCRIBERS.get(email, ()))
+
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait((event_type, payload))
+        except queue.Full:
+            # 受信が追いつかないクライアントは差分取得で追いつけるので破棄する
+            pass
+
+
+def _subscribe_user_events(email):
+    global _EVENT_STREAM_COUNT
+    subscriber = queue.Queue(maxsize=EVENT_SUBSCRIBER_QUEUE_SIZE)
+    with _EVENT_LOCK:
+        # 上限に達したら接続を受け付けない（クライアントはポーリングへフォールバックする）
+        if _EVENT_STREAM_COUNT >= EVENT_STREAM_MAX_CONNECTIONS:
+            return None
+        _EVENT_STREAM_COUNT += 1
+        _EVENT_SUBSCRIBERS.setdefault(email, set()).add(subscriber)
+    _ensure_event_broker_started()
+    return subscriber
+
+
+def _unsubscribe_user_events(email, subscriber):
+    global _EVENT_STREAM_COUNT
+    with _EVENT_LOCK:
+        subscribers = _EVENT_SUBSCRIBERS.get(email)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        _EVENT_STREAM_COUNT -= 1
+        if not subscribers:
+            _EVENT_SUBSCRIBERS.pop(email, None)
+
+
+def _ensure_event_broker_started():
+    global _EVENT_BROKER_PID
+    pid = os.getpid()
+    if _EVENT_BROKER_PID == pid:
+        return
+    with _EVENT_LOCK:
+        if _EVENT_BROKER_PID == pid:
+            return
+        _EVENT_BROKER_PID = pid
+    threading.Thread(target=_event_broker_loop, name='user-event-broker', daemon=True).start()
+
+
+def _event_broker_loop():
+    while True:
+        time.sleep(EVENT_BROKER_POLL_SECONDS)
+        with _EVENT_LOCK:
+            emails = set(_EVENT_SUBSCRIBERS.keys())
+        if not emails:
+            # 購読者がいない間はポーリングせず、再開時は現在時刻から始める
+            for kind in _EVENT_POLL_SINCE:
+                _EVENT_POLL_SINCE[kind] = None
+                _EVENT_POLL_SEEN[kind].clear()
+            continue
+
+        with app.app_context():
+            try:
+                _poll_user_events(emails)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("User event broker poll failed")
+
+
+def _poll_user_events(emails):
+    for kind, model in (("chat_message", ProductChatMessage), ("notification", Notification)):
+        poll_started_at = datetime.utcnow()
+        since = _EVENT_POLL_SINCE[kind]
+        _EVENT_POLL_SINCE[kind] = poll_started_at
+        if since is None:
+            continue
+
+        cutoff = since - timedelta(seconds=EVENT_BROKER_OVERLAP_SECONDS)
+        seen = _EVENT_POLL_SEEN[kind]
+        for row_id in [row_id for row_id, created_at in seen.items() if created_at < cutoff]:
+            del seen[row_id]
+
+        sort_keys = [(model.created_at, 'asc'), (model.id, 'asc')]
+        base_query = model.query.filter(model.created_at >= cutoff)
+        if kind == 'notification':
+            base_query = base_query.filter(model.user_email.in_(list(emails)))
+        last = None
+        while True:
+            query = base_query
+            if last is not None:
+                query = query.filter(_keyset_condition(sort_keys, last))
+            rows = query.order_by(*_keyset_order_by(sort_keys)).limit(EVENT_BROKER_BATCH_SIZE).all()
+            for row in rows:
+                if row.id in seen:
+                    continue
+                seen[row.id] = row.created_at
+                for email, payload in _user_events_for_row(kind, row):
+                    if email in emails:
+                        _publish_user_event(email, kind, payload, event_id=row.id)
+            if len(rows) < EVENT_BROKER_BATCH_SIZE:
+                break
+            last = [rows[-1].created_at, rows[-1].id]
+
+
+@sa_event.listens_for(SqlaSession, 'after_flush')
+def _collect_user_events(session, flush_context):
+    pending = None
+    for obj in session.new:
+        if isinstance(obj, ProductChatMessage):
+            kind = 'chat_message'
+        elif isinstance(obj, Notification):
+            kind = 'notification'
+        else:
+            continue
+        if pending is None:
+            pending = session.info.setdefault('pending_user_events', [])
+        for email, payload in _user_events_for_row(kind, obj):
+            pending.append((email, kind, payload, obj.id))
+
+
+@sa_event.listens_for(SqlaSession, 'after_commit')
+def _publish_committed_user_events(session):
+    for email, kind, payload, event_id in session.info.pop('pending_user_events', []):
+        _publish_user_event(email, kind, payload, event_id=event_id)
+
+
+@sa_event.listens_for(SqlaSession, 'after_rollback')
+def _discard_user_events(session):
+    session.info.pop('pending_user_events', None)
+
+
 # ============================
 # ヘルスチェック
 # ============================
@@ -949,7 +2971,7 @@ def register():
     if User.query.filter(db.func.lower(User.user_id) == user_id).first():
         return jsonify({"error": "user_id は既に使われています"}), 409
 
-    if User.query.filter_by(email=data['email']).first():
+    if User.query.filter_by(email=_normalize_email(data['email'])).first():
         return jsonify({"error": "email は既に使われています"}), 409
 
     bio = (data.get('bio') or '').strip()
@@ -1010,7 +3032,7 @@ def login():
     if not email or not password:
         return jsonify({"error": "email と password が必要"}), 400
  
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter_by(email=_normalize_email(email)).first()
     if not user or not check_password_hash(user.password, password):
         return jsonify({"error": "認証失敗"}), 401
  
@@ -1035,7 +3057,7 @@ def login():
 # ============================
 @app.route('/api/user/<email>', methods=['GET'])
 def get_user(email):
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter_by(email=_normalize_email(email)).first()
     if not user:
         return jsonify({"error": "ユーザーが見つかりません"}), 404
 
@@ -1044,7 +3066,8 @@ def get_user(email):
         "user_id": user.user_id,
         "user_name": user.user_name or user.name,
         "email": user.email,
-        "profile_image": user.profile_image
+        "profile_image": user.profile_image,
+        "profile_thumbnail_url": _profile_thumbnail_url(user)
     }), 200
 
 
@@ -1053,12 +3076,12 @@ def get_user(email):
 # ============================
 @app.route('/api/profile/<email>', methods=['GET'])
 def get_profile(email):
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter_by(email=_normalize_email(email)).first()
     if not user:
         return jsonify({"error": "ユーザーが見つかりません"}), 404
 
-    follower_count = ForumFollow.query.filter_by(followee_email=user.email).count()
-    following_count = ForumFollow.query.filter_by(follower_email=user.email).count()
+    follower_count = int(user.follower_count or 0)
+    following_count = int(user.following_count or 0)
     rating_summary = _build_user_rating_summary(user.email)
 
     return jsonify({
@@ -1067,6 +3090,7 @@ def get_profile(email):
         "user_name": user.user_name or user.name,
         "email": user.email,
         "profile_image": user.profile_image,
+        "profile_thumbnail_url": _profile_thumbnail_url(user),
         "bio": user.bio,
         "address": user.address,
         "phone_number": user.phone_number or user.phone,
@@ -1090,8 +3114,8 @@ def get_profile_by_id(user_id):
     if not user:
         return jsonify({"error": "ユーザーが見つかりません"}), 404
 
-    follower_count = ForumFollow.query.filter_by(followee_email=user.email).count()
-    following_count = ForumFollow.query.filter_by(follower_email=user.email).count()
+    follower_count = int(user.follower_count or 0)
+    following_count = int(user.following_count or 0)
     rating_summary = _build_user_rating_summary(user.email)
 
     return jsonify({
@@ -1100,6 +3124,7 @@ def get_profile_by_id(user_id):
         "user_name": user.user_name or user.name,
         "email": user.email,
         "profile_image": user.profile_image,
+        "profile_thumbnail_url": _profile_thumbnail_url(user),
         "bio": user.bio,
         "created_at": user.created_at.isoformat() if user.created_at else None,
         "follower_count": follower_count,
@@ -1113,7 +3138,7 @@ def get_profile_by_id(user_id):
 # ============================
 @app.route('/api/profile/<email>', methods=['PUT'])
 def update_profile(email):
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter_by(email=_normalize_email(email)).first()
     if not user:
         return jsonify({"error": "ユーザーが見つかりません"}), 404
 
@@ -1185,6 +3210,7 @@ def update_profile(email):
             "user_name": user.user_name,
             "email": user.email,
             "profile_image": user.profile_image,
+            "profile_thumbnail_url": _profile_thumbnail_url(user),
             "bio": user.bio
         }
     }), 200
@@ -1192,7 +3218,7 @@ def update_profile(email):
 
 @app.route('/api/profile/<email>/image', methods=['POST'])
 def upload_profile_image(email):
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter_by(email=_normalize_email(email)).first()
     if not user:
         return jsonify({"error": "ユーザーが見つかりません"}), 404
 
@@ -1209,6 +3235,9 @@ def upload_profile_image(email):
     old_path = user.profile_image or ""
     user.profile_image = uploaded_url
     user.updated_at = datetime.utcnow()
+    if old_path and old_path != uploaded_url:
+        _enqueue_job('remove_upload_file', {"upload_path": old_path})
+    _enqueue_image_variants(uploaded_url)
 
     try:
         db.session.commit()
@@ -1216,9 +3245,6 @@ def upload_profile_image(email):
         db.session.rollback()
         return jsonify({"error": "プロフィール画像の更新に失敗しました", "detail": str(e)}), 500
 
-    if old_path and old_path != uploaded_url:
-        _remove_upload_file_if_exists(old_path)
-
     return jsonify({
         "message": "プロフィール画像を更新しました",
         "profile_image": user.profile_image
@@ -1236,17 +3262,24 @@ def get_products():
         max_price = request.args.get('max_price', type=int)
         condition = request.args.get('condition', '').strip()
         seller_id = request.args.get('seller_id', type=int)
-        sort = request.args.get('sort', 'newest')
+        sort = request.args.get('sort') or ('relevance' if keyword else 'newest')
         page = request.args.get('page', 1, type=int)
         limit = request.args.get('limit', 20, type=int)
         include_sold = (request.args.get('include_sold') or '').strip().lower() in {'1', 'true', 'yes', 'on'}
         viewer_email = _normalize_email(request.args.get('viewer_email'))
+        # cursor パラメータがあればキーセット方式（空文字は先頭ページ）
+        cursor_mode = 'cursor' in request.args
+        cursor_token = (request.args.get('cursor') or '').strip()
+        include_total = _coerce_bool(request.args.get('include_total'))
+        popular_days = request.args.get('popular_days', type=int)
+        if popular_days is not None:
+            popular_days = max(1, min(popular_days, 90))
         blocked_seller_ids = set()
 
         if viewer_email:
             blocked_emails = _get_blocked_email_set(viewer_email)
             if blocked_emails:
-                blocked_users = User.query.filter(db.func.lower(User.email).in_(list(blocked_emails))).all()
+                blocked_users = User.query.filter(User.email.in_(list(blocked_emails))).all()
                 blocked_seller_ids = {user.id for user in blocked_users if user.id}
 
         # 取り消し済み(status=2)は全一覧から除外する
@@ -1263,6 +3296,7 @@ def get_products():
         if blocked_seller_ids:
             query = query.filter(~Product.seller_id.in_(blocked_seller_ids))
 
+        search_hits = None
         if keyword:
             if keyword.startswith('#'):
                 tag_keyword = keyword[1:].strip()
@@ -1273,14 +3307,18 @@ def get_products():
                 else:
                     query = query.filter(Product.id == -1)
             else:
-                search_pattern = f"%{keyword}%"
-                query = query.filter(
-                    db.or_(
-                        Product.title.like(search_pattern),
-                        Product.description.like(search_pattern),
-                        Product.category.like(search_pattern)
+                search_hits = _product_search_subquery(keyword)
+                if search_hits is not None:
+                    query = query.join(search_hits, search_hits.c.product_id == Product.id)
+                else:
+                    search_pattern = f"%{keyword}%"
+                    query = query.filter(
+                        db.or_(
+                            Product.title.like(search_pattern),
+                            Product.description.like(search_pattern),
+                            Product.category.like(search_pattern)
+                        )
                     )
-                )
 
         if min_price is not None:
             query = query.filter(Product.price >= min_price)
@@ -1294,36 +3332,63 @@ def get_products():
             else:
                 query = query.filter(Product.id == -1)
 
-        if sort == 'price_asc':
-            query = query.order_by(Product.price.asc())
-        elif sort == 'price_desc':
-            query = query.order_by(Product.price.desc())
-        elif sort == 'popular':
-            query = (
-                query.outerjoin(ProductView, ProductView.product_id == Product.id)
-                .group_by(Product.id)
-                .order_by(
-                    db.func.count(ProductView.id).desc(),
-                    Product.created_at.desc()
+        recent_views = None
+        if sort == 'popular' and popular_days:
+            since = (datetime.utcnow() - timedelta(days=popular_days - 1)).date()
+            recent_views = (
+                db.session.query(
+                    ProductViewDaily.product_id.label('product_id'),
+                    db.func.sum(ProductViewDaily.view_count).label('views')
                 )
+                .filter(ProductViewDaily.view_date >= since)
+                .group_by(ProductViewDaily.product_id)
+                .subquery('recent_views')
             )
-        else:
-            query = query.order_by(Product.created_at.desc())
+            query = query.outerjoin(recent_views, recent_views.c.product_id == Product.id)
+
+        sort_keys = _product_sort_keys(sort, search_hits, recent_views)
+        query = query.order_by(*_keyset_order_by(sort_keys))
+
+        if cursor_mode:
+            limit = max(1, min(limit or 20, 100))
+            try:
+                cursor_values = _decode_cursor(cursor_token, sort_keys)
+            except ValueError:
+                return jsonify({"error": "cursor が不正です", "products": []}), 400
+
+            total = query.count() if include_total else None
+            page_query = query
+            if cursor_values is not None:
+                page_query = page_query.filter(_keyset_condition(sort_keys, cursor_values))
+
+            rows = page_query.add_columns(*[expr for expr, _direction in sort_keys]).limit(limit + 1).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            products = [row[0] for row in rows]
+            next_cursor = _encode_cursor(list(rows[-1][1:])) if has_more and rows else None
+
+            return jsonify({
+                "total": total,
+                "limit": limit,
+                "next_cursor": next_cursor,
+                "has_more": has_more,
+                "products": [
+                    _serialize_product_card(p)
+                    for p in products
+                ]
+            }), 200
 
         total = query.count()
         offset = (page - 1) * limit
         products = query.offset(offset).limit(limit).all()
 
-        image_map = _build_primary_image_map([p.id for p in products])
-        purchase_map = _build_latest_purchase_map([p.id for p in products])
-
         result = {
             "total": total,
             "page": page,
             "limit": limit,
             "total_pages": (total + limit - 1) // limit,
             "products": [
-                _serialize_product_card(p, image_map, purchase_map)
+                _serialize_product_card(p)
                 for p in products
             ]
         }
@@ -1346,11 +3411,7 @@ def get_product_detail(product_id):
         if not product or product.status == 2:
             return jsonify({"error": "商品が見つかりません"}), 404
 
-        try:
-            db.session.add(ProductView(product_id=product.id))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+        _record_product_view(product.id)
 
         images = (
             ProductImage.query
@@ -1398,6 +3459,7 @@ def get_product_detail(product_id):
                 "user_name": seller.user_name if seller else "不明",
                 "email": seller.email if seller else None,
                 "profile_image": seller.profile_image if seller else None,
+                "profile_thumbnail_url": _profile_thumbnail_url(seller),
                 "rating": {
                     "count": int(seller_rating.get("count", 0) or 0),
                     "average": float(seller_rating.get("average", 0) or 0)
@@ -1417,6 +3479,7 @@ def get_product_detail(product_id):
 @app.route('/api/products', methods=['POST'])
 def create_product():
     try:
+        _ensure_search_index_once()
         image_urls = []
         image_url = ''
         if request.content_type and request.content_type.startswith('multipart/form-data'):
@@ -1480,6 +3543,8 @@ def create_product():
             seller_id=seller_id,
             category=data.get('category', ''),
             image_url=primary_image_url,
+            primary_image_url=primary_image_url or None,
+            thumbnail_url=_existing_thumbnail_url(primary_image_url),
             status=1
         )
 
@@ -1502,6 +3567,7 @@ def create_product():
                     image_url=url,
                     sort_order=index
                 ))
+                _enqueue_image_variants(url)
 
         if parsed_tags:
             for tag in parsed_tags:
@@ -1510,7 +3576,10 @@ def create_product():
                     tag=tag
                 ))
 
+        _sync_product_search_index(new_product)
+
         seller = User.query.get(seller_id)
+        seller_email = None
         if seller and seller.email:
             seller_email = _normalize_email(seller.email)
             seller_name = seller.user_name or seller.name or (seller_email.split('@')[0] if seller_email else '出品者')
@@ -1524,26 +3593,22 @@ def create_product():
                 actor_email=seller_email
             )
 
-            follower_rows = (
-                ForumFollow.query
-                .filter(db.func.lower(ForumFollow.followee_email) == seller_email)
-                .all()
+            # フォロワーへの通知は件数に比例して重いのでジョブとして応答後にまとめて配信する
+            _enqueue_job(
+                'notify_followers_of_listing',
+                {
+                    "product_id": new_product.id,
+                    "seller_email": seller_email,
+                    "seller_name": seller_name,
+                    "product_title": new_product.title
+                },
+                idempotency_key=f"listing-followers:{new_product.id}"
+            )
+            _enqueue_job(
+                'fan_out_follow_timeline',
+                {"product_id": new_product.id},
+                idempotency_key=f"follow-timeline:{new_product.id}"
             )
-            notified_followers = set()
-            for row in follower_rows:
-                follower_email = _normalize_email(row.follower_email)
-                if not follower_email or follower_email == seller_email or follower_email in notified_followers:
-                    continue
-                notified_followers.add(follower_email)
-
-                _create_notification(
-                    user_email=follower_email,
-                    notification_type='follow_listing',
-                    title='フォロー中ユーザーが出品しました',
-                    message=f"{seller_name}さんが「{new_product.title}」を出品しました。",
-                    related_product_id=new_product.id,
-                    actor_email=seller_email
-                )
 
         db.session.commit()
 
@@ -1564,6 +3629,7 @@ def create_product():
 @app.route('/api/seed-products', methods=['POST'])
 def seed_products():
     try:
+        _ensure_search_index_once()
         # 既存の商品数を確認（8件以上あれば追加しない）
         existing_count = Product.query.count()
         if existing_count >= 8:
@@ -1648,10 +3714,15 @@ def seed_products():
             }
         ]
 
+        seeded = []
         for product_data in test_products:
             product = Product(**product_data)
             db.session.add(product)
+            seeded.append(product)
 
+        db.session.flush()
+        for product in seeded:
+            _sync_product_search_index(product)
         db.session.commit()
 
         return jsonify({
@@ -1675,6 +3746,7 @@ def cleanup_blob_urls():
         count = 0
         for product in products:
             product.image_url = ''
+            _refresh_product_primary_image(product)
             count += 1
 
         db.session.commit()
@@ -1698,7 +3770,7 @@ def cancel_product(product_id):
     if not seller_email:
         return jsonify({"error": "seller_email が必要です"}), 400
 
-    user = User.query.filter_by(email=seller_email).first()
+    user = User.query.filter_by(email=_normalize_email(seller_email)).first()
     if not user:
         return jsonify({"error": "ユーザーが見つかりません"}), 404
 
@@ -1716,10 +3788,12 @@ def cancel_product(product_id):
     if existing_purchase:
         return jsonify({"error": "購入済みのため取り消しできません"}), 400
 
-    product.status = 2
-    product.updated_at = datetime.utcnow()
-
     try:
+        _ensure_search_index_once()
+        product.status = 2
+        product.updated_at = datetime.utcnow()
+        _sync_product_search_index(product)
+        _trim_follow_timeline(product.id)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -1738,6 +3812,7 @@ def cancel_product(product_id):
 def get_product_chat_messages(product_id):
     current_email = _normalize_email(request.args.get('email'))
     requested_counterpart = _normalize_email(request.args.get('with_user'))
+    after_id = request.args.get('after_id', type=int)
 
     if not current_email:
         return jsonify({"error": "email が必要です"}), 400
@@ -1782,7 +3857,59 @@ def get_product_chat_messages(product_id):
     if is_sold and not is_seller and not is_purchase_buyer:
         return jsonify({"error": "購入後チャットは購入者と出品者のみ利用できます"}), 403
 
-    base_query = ProductChatMessage.query.filter_by(product_id=product.id)
+    base_query = ProductChatMessage.query.filter_by(product_id=product.id)
+    own_messages_filter = db.or_(
+        _chat_sender_filter(current_email),
+        _chat_receiver_filter(current_email)
+    )
+
+    # 差分ポーリング: after_id より新しい自分宛て/自分発のメッセージだけを返す
+    if after_id is not None and (requested_counterpart or not is_seller):
+        counterpart = requested_counterpart if is_seller else seller_email
+        new_rows = (
+            base_query
+            .filter(ProductChatMessage.id > after_id)
+            .filter(own_messages_filter)
+            .order_by(ProductChatMessage.id.asc())
+            .all()
+        )
+        if not new_rows:
+            return jsonify({
+                "product_id": product.id,
+                "changed": False,
+                "last_message_id": after_id,
+                "messages": []
+            }), 200
+
+        new_messages = []
+        has_updates = False
+        other_activity = False
+        if not _get_block_relation(current_email, counterpart)["is_blocked"]:
+            _prime_users_by_email(row.sender_email for row in new_rows)
+            for row in new_rows:
+                sender_email = _normalize_email(row.sender_email)
+                receiver_email = _normalize_email(row.receiver_email)
+                other_email = receiver_email if sender_email == current_email else sender_email
+                if other_email != counterpart:
+                    other_activity = True
+                    continue
+                if receiver_email == current_email and not row.is_read:
+                    row.is_read = True
+                    has_updates = True
+                new_messages.append(_serialize_chat_message(row, seller_email, current_email))
+
+        if has_updates:
+            db.session.commit()
+
+        return jsonify({
+            "product_id": product.id,
+            "changed": True,
+            "selected_counterpart_email": counterpart,
+            "participants_changed": bool(is_seller and other_activity),
+            "last_message_id": new_rows[-1].id,
+            "messages": new_messages
+        }), 200
+
     participants = []
     selected_counterpart = ''
 
@@ -1791,8 +3918,8 @@ def get_product_chat_messages(product_id):
             base_query
             .filter(
                 db.or_(
-                    db.func.lower(ProductChatMessage.sender_email) == seller_email,
-                    db.func.lower(ProductChatMessage.receiver_email) == seller_email
+                    _chat_sender_filter(seller_email),
+                    _chat_receiver_filter(seller_email)
                 )
             )
             .order_by(ProductChatMessage.created_at.desc(), ProductChatMessage.id.desc())
@@ -1826,6 +3953,7 @@ def get_product_chat_messages(product_id):
             reverse=True
         )
 
+        _prime_users_by_email(ordered_counterparts)
         for email in ordered_counterparts:
             participant_user = _find_user_by_email(email)
             participants.append({
@@ -1856,20 +3984,15 @@ def get_product_chat_messages(product_id):
             base_query
             .filter(
                 db.or_(
-                    db.and_(
-                        db.func.lower(ProductChatMessage.sender_email) == current_email,
-                        db.func.lower(ProductChatMessage.receiver_email) == selected_counterpart
-                    ),
-                    db.and_(
-                        db.func.lower(ProductChatMessage.sender_email) == selected_counterpart,
-                        db.func.lower(ProductChatMessage.receiver_email) == current_email
-                    )
+                    db.and_(_chat_sender_filter(current_email), _chat_receiver_filter(selected_counterpart)),
+                    db.and_(_chat_sender_filter(selected_counterpart), _chat_receiver_filter(current_email))
                 )
             )
             .order_by(ProductChatMessage.created_at.asc(), ProductChatMessage.id.asc())
             .all()
         )
 
+        _prime_users_by_email(row.sender_email for row in chat_rows)
         for row in chat_rows:
             if _normalize_email(row.receiver_email) == current_email and not row.is_read:
                 row.is_read = True
@@ -1879,8 +4002,17 @@ def get_product_chat_messages(product_id):
     if has_updates:
         db.session.commit()
 
+    last_message_id = (
+        db.session.query(db.func.max(ProductChatMessage.id))
+        .filter(ProductChatMessage.product_id == product.id)
+        .filter(own_messages_filter)
+        .scalar()
+    ) or 0
+
     return jsonify({
         "product_id": product.id,
+        "changed": True,
+        "last_message_id": last_message_id,
         "seller_email": seller_email,
         "current_email": current_email,
         "current_role": "seller" if is_seller else "buyer",
@@ -1955,14 +4087,8 @@ def post_product_chat_message(product_id):
                 .filter_by(product_id=product.id)
                 .filter(
                     db.or_(
-                        db.and_(
-                            db.func.lower(ProductChatMessage.sender_email) == seller_email,
-                            db.func.lower(ProductChatMessage.receiver_email) == receiver_email
-                        ),
-                        db.and_(
-                            db.func.lower(ProductChatMessage.sender_email) == receiver_email,
-                            db.func.lower(ProductChatMessage.receiver_email) == seller_email
-                        )
+                        db.and_(_chat_sender_filter(seller_email), _chat_receiver_filter(receiver_email)),
+                        db.and_(_chat_sender_filter(receiver_email), _chat_receiver_filter(seller_email))
                     )
                 )
                 .first()
@@ -2017,7 +4143,7 @@ def get_favorites():
     if not email:
         return jsonify({"error": "email が必要です"}), 400
 
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter_by(email=_normalize_email(email)).first()
     if not user:
         return jsonify({"favorites": []}), 200
 
@@ -2028,13 +4154,12 @@ def get_favorites():
 
     products = Product.query.filter(Product.id.in_(product_ids), Product.status == 1).all()
     product_map = {p.id: p for p in products}
-    image_map = _build_primary_image_map([p.id for p in products])
 
     cards = []
     for favorite in favorites:
         product = product_map.get(favorite.product_id)
         if product:
-            cards.append(_serialize_product_card(product, image_map))
+            cards.append(_serialize_product_card(product))
 
     return jsonify({"favorites": cards}), 200
 
@@ -2047,7 +4172,7 @@ def get_favorite_status():
     if not email or not product_id:
         return jsonify({"error": "email と product_id が必要です"}), 400
 
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter_by(email=_normalize_email(email)).first()
     if not user:
         return jsonify({"is_favorite": False}), 200
 
@@ -2064,7 +4189,7 @@ def add_favorite():
     if not email or not product_id:
         return jsonify({"error": "email と product_id が必要です"}), 400
 
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter_by(email=_normalize_email(email)).first()
     if not user:
         return jsonify({"error": "ユーザーが見つかりません"}), 404
 
@@ -2096,7 +4221,7 @@ def remove_favorite():
     if not email or not product_id:
         return jsonify({"error": "email と product_id が必要です"}), 400
 
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter_by(email=_normalize_email(email)).first()
     if not user:
         return jsonify({"message": "お気に入りに登録されていません"}), 200
 
@@ -2127,13 +4252,12 @@ def get_profile_favorites(user_id):
 
     products = Product.query.filter(Product.id.in_(product_ids), Product.status == 1).all()
     product_map = {p.id: p for p in products}
-    image_map = _build_primary_image_map([p.id for p in products])
 
     result = []
     for favorite in favorites:
         product = product_map.get(favorite.product_id)
         if product:
-            result.append(_serialize_product_card(product, image_map))
+            result.append(_serialize_product_card(product))
 
     return jsonify({"favorites": result}), 200
 
@@ -2156,7 +4280,6 @@ def get_profile_purchases(user_id):
     product_ids = [p.product_id for p in purchases]
     products = Product.query.filter(Product.id.in_(product_ids)).all()
     product_map = {p.id: p for p in products}
-    image_map = _build_primary_image_map([p.id for p in products])
 
     result = []
     for purchase in purchases:
@@ -2167,7 +4290,7 @@ def get_profile_purchases(user_id):
         condition = ""
 
         if product:
-            image_url = product.image_url or image_map.get(product.id, "")
+            image_url = product.primary_image_url or product.image_url or ""
             title = product.title
             category = product.category or ""
             condition = product.condition or ""
@@ -2201,7 +4324,7 @@ def get_recommendations():
     if email:
         blocked_emails = _get_blocked_email_set(email)
         if blocked_emails:
-            blocked_users = User.query.filter(db.func.lower(User.email).in_(list(blocked_emails))).all()
+            blocked_users = User.query.filter(User.email.in_(list(blocked_emails))).all()
             blocked_seller_ids = {user.id for user in blocked_users if user.id}
             if blocked_seller_ids:
                 base_query = base_query.filter(~Product.seller_id.in_(blocked_seller_ids))
@@ -2230,12 +4353,184 @@ def get_recommendations():
         .all()
     )
 
-    image_map = _build_primary_image_map([p.id for p in products])
     return jsonify({
-        "recommendations": [_serialize_product_card(product, image_map) for product in products]
+        "recommendations": [_serialize_product_card(product) for product in products]
     }), 200
 
 
+# ============================
+# フォロータイムライン（出品時にフォロワーへ書き込み、フィードは1本の範囲読み取りにする）
+# ============================
+FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.getenv("FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS", "5000"))
+FOLLOW_TIMELINE_BACKFILL_LIMIT = 50
+
+
+def _fan_out_follow_timeline(product_id):
+    product = db.session.get(Product, product_id)
+    if not product or product.status != 1 or not product.seller_id:
+        return 0
+    seller = db.session.get(User, product.seller_id)
+    if not seller or int(seller.follower_count or 0) > FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS:
+        # 大量フォロワーの出品者は書き込まず、フィード読み取り時に直接引く
+        return 0
+    _resolve_follow_user_ids_for_followee(seller)
+
+    source = (
+        db.select(
+            ForumFollow.follower_user_id,
+            db.literal(product.id),
+            db.literal(product.seller_id),
+            db.literal(product.created_at or datetime.utcnow())
+        )
+        .where(
+            ForumFollow.followee_user_id == product.seller_id,
+            ForumFollow.follower_user_id.isnot(None),
+            ~db.exists().where(
+                FollowTimelineEntry.owner_user_id == ForumFollow.follower_user_id,
+                FollowTimelineEntry.product_id == product.id
+            )
+        )
+        .distinct()
+    )
+    result = db.session.execute(
+        FollowTimelineEntry.__table__.insert().from_select(
+            ['owner_user_id', 'product_id', 'seller_user_id', 'created_at'], source
+        )
+    )
+    return result.rowcount or 0
+
+
+def _resolve_follow_user_ids_for_followee(seller):
+    # 移行前の行などユーザーIDが未設定のフォローを、展開前にメールから埋める
+    follows = ForumFollow.__table__
+    db.session.execute(
+        follows.update()
+        .where(follows.c.followee_user_id.is_(None), follows.c.followee_email == seller.email)
+        .values(followee_user_id=seller.id)
+    )
+    db.session.execute(
+        follows.update()
+        .where(follows.c.followee_user_id == seller.id, follows.c.follower_user_id.is_(None))
+        .values(follower_user_id=db.select(User.id).where(User.email == follows.c.follower_email).scalar_subquery())
+    )
+    unresolved = (
+        db.session.query(db.func.count(ForumFollow.id))
+        .filter(ForumFollow.followee_user_id == seller.id, ForumFollow.follower_user_id.is_(None))
+        .scalar()
+    )
+    if unresolved:
+        app.logger.warning("Follow timeline for seller %s skips %s follows without a user", seller.id, unresolved)
+
+
+def _refill_follow_timeline_for_seller(seller_user_id):
+    # フォロワー数がしきい値を下回った出品者は、展開対象外だった間の出品を全フォロワーへ書き戻す
+    seller = db.session.get(User, seller_user_id)
+    if not seller or int(seller.follower_count or 0) > FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS:
+        return 0
+    _resolve_follow_user_ids_for_followee(seller)
+
+    recent = (
+        db.select(
+            Product.id.label('product_id'),
+            Product.seller_id.label('seller_id'),
+            db.func.coalesce(Product.created_at, db.func.now()).label('created_at')
+        )
+        .where(Product.seller_id == seller.id, Product.status == 1)
+        .order_by(Product.created_at.desc(), Product.id.desc())
+        .limit(FOLLOW_TIMELINE_BACKFILL_LIMIT)
+        .subquery()
+    )
+    source = (
+        db.select(ForumFollow.follower_user_id, recent.c.product_id, recent.c.seller_id, recent.c.created_at)
+        .select_from(ForumFollow)
+        .join(recent, recent.c.seller_id == ForumFollow.followee_user_id)
+        .where(
+            ForumFollow.followee_user_id == seller.id,
+            ForumFollow.follower_user_id.isnot(None),
+            ~db.exists().where(
+                FollowTimelineEntry.owner_user_id == ForumFollow.follower_user_id,
+                FollowTimelineEntry.product_id == recent.c.product_id
+            )
+        )
+        .distinct()
+    )
+    result = db.session.execute(
+        FollowTimelineEntry.__table__.insert().from_select(
+            ['owner_user_id', 'product_id', 'seller_user_id', 'created_at'], source
+        )
+    )
+    return result.rowcount or 0
+
+
+def _backfill_follow_timeline_for_follow(follower_user_id, followee_user_id):
+    # 新しくフォローした出品者の直近の販売中商品をタイムラインへ追加する
+    still_following = (
+        ForumFollow.query
+        .filter(ForumFollow.follower_user_id == follower_user_id, ForumFollow.followee_user_id == followee_user_id)
+        .first()
+    )
+    followee = db.session.get(User, followee_user_id)
+    if not still_following or not followee or int(followee.follower_count or 0) > FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS:
+        return 0
+
+    source = (
+        db.select(
+            db.literal(follower_user_id),
+            Product.id,
+            Product.seller_id,
+            db.func.coalesce(Product.created_at, db.func.now())
+        )
+        .where(
+            Product.seller_id == followee_user_id,
+            Product.status == 1,
+            ~db.exists().where(
+                FollowTimelineEntry.owner_user_id == follower_user_id,
+                FollowTimelineEntry.product_id == Product.id
+            )
+        )
+        .order_by(Product.created_at.desc(), Product.id.desc())
+        .limit(FOLLOW_TIMELINE_BACKFILL_LIMIT)
+    )
+    result = db.session.execute(
+        FollowTimelineEntry.__table__.insert().from_select(
+            ['owner_user_id', 'product_id', 'seller_user_id', 'created_at'], source
+        )
+    )
+    return result.rowcount or 0
+
+
+def _enqueue_follow_timeline_backfill(follower_email, followee_email):
+    follower = _find_user_by_email(follower_email)
+    followee = _find_user_by_email(followee_email)
+    if not follower or not followee:
+        return
+    _enqueue_job(
+        'backfill_follow_timeline',
+        {"follower_user_id": follower.id, "followee_user_id": followee.id}
+    )
+
+
+def _remove_follow_timeline_entries(follower_email, followee_email):
+    follower = _find_user_by_email(follower_email)
+    followee = _find_user_by_email(followee_email)
+    if not follower or not followee:
+        return
+    db.session.execute(
+        FollowTimelineEntry.__table__.delete()
+        .where(
+            FollowTimelineEntry.owner_user_id == follower.id,
+            FollowTimelineEntry.seller_user_id == followee.id
+        )
+    )
+
+
+def _trim_follow_timeline(product_id):
+    # 売却・出品取り消しで販売中でなくなった商品を全員のタイムラインから外す
+    db.session.execute(
+        FollowTimelineEntry.__table__.delete().where(FollowTimelineEntry.product_id == product_id)
+    )
+
+
 @app.route('/api/follow/feed', methods=['GET'])
 def get_follow_feed():
     email = (request.args.get('email') or '').strip().lower()
@@ -2245,41 +4540,64 @@ def get_follow_feed():
     if not email:
         return jsonify({"products": []}), 200
 
-    follow_rows = (
-        ForumFollow.query
-        .filter(db.func.lower(ForumFollow.follower_email) == email)
-        .all()
-    )
-    followee_emails = {
-        _normalize_email(row.followee_email)
-        for row in follow_rows
-        if _normalize_email(row.followee_email)
-    }
-    blocked_emails = _get_blocked_email_set(email)
-    if blocked_emails:
-        followee_emails = {item for item in followee_emails if item not in blocked_emails}
-    if not followee_emails:
-        return jsonify({"products": []}), 200
-
-    followee_users = User.query.filter(db.func.lower(User.email).in_(list(followee_emails))).all()
-    if not followee_users:
+    viewer = _find_user_by_email(email)
+    if not viewer:
         return jsonify({"products": []}), 200
 
-    followee_ids = [user.id for user in followee_users]
-    user_map = {user.id: user for user in followee_users}
-
+    blocked_ids = db.union(
+        db.select(UserBlock.blocked_user_id).where(UserBlock.blocker_user_id == viewer.id, UserBlock.blocked_user_id.isnot(None)),
+        db.select(UserBlock.blocker_user_id).where(UserBlock.blocked_user_id == viewer.id, UserBlock.blocker_user_id.isnot(None))
+    )
     products = (
         Product.query
-        .filter(Product.seller_id.in_(followee_ids), Product.status == 1)
-        .order_by(Product.created_at.desc(), Product.id.desc())
+        .join(FollowTimelineEntry, FollowTimelineEntry.product_id == Product.id)
+        .filter(
+            FollowTimelineEntry.owner_user_id == viewer.id,
+            Product.seller_id.notin_(blocked_ids),
+            Product.status == 1
+        )
+        .order_by(FollowTimelineEntry.created_at.desc(), FollowTimelineEntry.product_id.desc())
         .limit(limit)
         .all()
     )
-    image_map = _build_primary_image_map([p.id for p in products])
 
+    # 書き込み展開の対象外にした大量フォロワーの出品者だけは読み取り時に引いて混ぜる
+    pulled_seller_ids = [
+        row[0]
+        for row in (
+            db.session.query(ForumFollow.followee_user_id)
+            .join(User, User.id == ForumFollow.followee_user_id)
+            .filter(
+                ForumFollow.follower_user_id == viewer.id,
+                User.follower_count > FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS
+            )
+            .all()
+        )
+    ]
+    if pulled_seller_ids:
+        pulled = (
+            Product.query
+            .filter(
+                Product.seller_id.in_(pulled_seller_ids),
+                Product.seller_id.notin_(blocked_ids),
+                Product.status == 1
+            )
+            .order_by(Product.created_at.desc(), Product.id.desc())
+            .limit(limit)
+            .all()
+        )
+        merged = {product.id: product for product in products + pulled}
+        products = sorted(
+            merged.values(),
+            key=lambda product: (product.created_at or datetime.min, product.id),
+            reverse=True
+        )[:limit]
+
+    seller_ids = list({product.seller_id for product in products if product.seller_id})
+    user_map = {user.id: user for user in User.query.filter(User.id.in_(seller_ids)).all()} if seller_ids else {}
     result = []
     for product in products:
-        card = _serialize_product_card(product, image_map)
+        card = _serialize_product_card(product)
         seller = user_map.get(product.seller_id)
         card["seller_name"] = seller.user_name if seller else ""
         card["seller_user_id"] = seller.user_id if seller else ""
@@ -2292,41 +4610,47 @@ def get_follow_feed():
 def get_notifications():
     email = (request.args.get('email') or '').strip().lower()
     if not email:
-        return jsonify({"notifications": [], "unread_count": 0}), 200
-
-    notifications = (
-        Notification.query
-        .filter_by(user_email=email)
-        .order_by(Notification.created_at.desc(), Notification.id.desc())
-        .all()
-    )
-    blocked_emails = _get_blocked_email_set(email)
-    if blocked_emails:
-        blocked_users = User.query.filter(db.func.lower(User.email).in_(list(blocked_emails))).all()
-        blocked_seller_ids = {user.id for user in blocked_users if user.id}
-        related_ids = [item.related_product_id for item in notifications if item.related_product_id]
-        product_map = {}
-        if related_ids:
-            products = Product.query.filter(Product.id.in_(related_ids)).all()
-            product_map = {product.id: product for product in products}
-
-        filtered = []
-        for item in notifications:
-            if item.related_product_id and blocked_seller_ids:
-                product = product_map.get(item.related_product_id)
-                if product and product.seller_id in blocked_seller_ids:
-                    continue
-            filtered.append(item)
-        notifications = filtered
+        return jsonify({"notifications": [], "unread_count": 0, "next_cursor": None, "has_more": False}), 200
 
-    unread_count = sum(1 for item in notifications if not item.is_read)
+    limit = max(1, min(request.args.get('limit', 30, type=int) or 30, 100))
+    notif_type = (request.args.get('type') or '').strip().lower()
+    sort_keys = [(Notification.created_at, 'desc'), (Notification.id, 'desc')]
+    try:
+        cursor_values = _decode_cursor((request.args.get('cursor') or '').strip(), sort_keys)
+    except ValueError:
+        return jsonify({"error": "cursor が不正です", "notifications": []}), 400
+
+    query = _visible_notifications_query(email)
+    if notif_type:
+        query = query.filter(Notification.notification_type == notif_type)
+    if cursor_values is not None:
+        query = query.filter(_keyset_condition(sort_keys, cursor_values))
+
+    notifications = query.order_by(*_keyset_order_by(sort_keys)).limit(limit + 1).all()
+    has_more = len(notifications) > limit
+    notifications = notifications[:limit]
+    next_cursor = None
+    if has_more and notifications:
+        last = notifications[-1]
+        next_cursor = _encode_cursor([last.created_at, last.id])
 
     return jsonify({
         "notifications": [_serialize_notification(item) for item in notifications],
-        "unread_count": unread_count
+        "unread_count": _get_unread_notification_count(email),
+        "next_cursor": next_cursor,
+        "has_more": has_more
     }), 200
 
 
+@app.route('/api/notifications/unread-count', methods=['GET'])
+def get_notification_unread_count():
+    email = _normalize_email(request.args.get('email'))
+    if not email:
+        return jsonify({"unread_count": 0}), 200
+
+    return jsonify({"unread_count": _get_unread_notification_count(email)}), 200
+
+
 @app.route('/api/notifications/read-all', methods=['POST'])
 def mark_notifications_read_all():
     data = request.get_json() or {}
@@ -2337,9 +4661,17 @@ def mark_notifications_read_all():
     try:
         updated_count = (
             Notification.query
-            .filter_by(user_email=email, is_read=False)
+            .filter(
+                _user_ref_filter(Notification, 'user_email', 'user_id', email),
+                Notification.is_read.isnot(True)
+            )
             .update({Notification.is_read: True}, synchronize_session=False)
         )
+        db.session.execute(
+            NotificationCounter.__table__.update()
+            .where(NotificationCounter.user_email == email)
+            .values(unread_count=0, updated_at=datetime.utcnow())
+        )
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -2348,6 +4680,35 @@ def mark_notifications_read_all():
     return jsonify({"message": "既読に更新しました", "updated": updated_count}), 200
 
 
+@app.route('/api/events/stream', methods=['GET'])
+def stream_user_events():
+    email = _normalize_email(request.args.get('email'))
+    if not email:
+        return jsonify({"error": "email が必要です"}), 400
+
+    subscriber = _subscribe_user_events(email)
+    if subscriber is None:
+        return jsonify({"error": "同時接続数の上限に達しました"}), 503, {"Retry-After": "30"}
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event_type, payload = subscriber.get(timeout=EVENT_STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event_type}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        finally:
+            _unsubscribe_user_events(email, subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
 @app.route('/api/notification-settings', methods=['GET'])
 def get_notification_settings():
     email = _normalize_email(request.args.get('email'))
@@ -2450,9 +4811,46 @@ def get_news_post(news_id):
         return jsonify({"error": "お知らせが見つかりません"}), 404
     return jsonify(post), 200
 
+# アップロード画像はファイル名が内容ごとに一意なので、ブラウザ・CDN に長期キャッシュさせる。
+# 縮小版は元画像と同じ URL のまま generate-thumbnails --force で作り直されるため immutable にせず、
+# 短い max-age と更新時刻・サイズ由来の ETag で再検証させる。
+# UPLOAD_SERVE_MODE=x-accel（nginx）/ x-sendfile（Apache 等）でファイル本体の送信をフロントのプロキシに任せる
+UPLOAD_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+THUMBNAIL_CACHE_MAX_AGE = 24 * 60 * 60
+UPLOAD_SERVE_MODE = os.getenv("UPLOAD_SERVE_MODE", "").strip().lower()
+UPLOAD_ACCEL_REDIRECT_PREFIX = os.getenv("UPLOAD_ACCEL_REDIRECT_PREFIX", "/protected-uploads/")
+CONTENT_HASH_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+app.config['USE_X_SENDFILE'] = UPLOAD_SERVE_MODE == 'x-sendfile'
+
+
 @app.route('/uploads/<path:filename>')
 def serve_upload(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    absolute_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if absolute_path is None or not os.path.isfile(absolute_path):
+        return jsonify({"error": "ファイルが見つかりません"}), 404
+
+    is_thumbnail = filename.replace('\\', '/').lstrip('/').startswith('thumbs/')
+    max_age = THUMBNAIL_CACHE_MAX_AGE if is_thumbnail else UPLOAD_CACHE_MAX_AGE
+    if UPLOAD_SERVE_MODE == 'x-accel':
+        response = Response(status=200)
+        response.headers['X-Accel-Redirect'] = UPLOAD_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + filename.lstrip('/')
+        response.content_type = mimetypes.guess_type(absolute_path)[0] or 'application/octet-stream'
+    else:
+        # 内容ハッシュ名の元画像はハッシュそのものを強い ETag にする（縮小版などは更新時刻とサイズから生成）
+        stem = os.path.basename(absolute_path).rsplit('.', 1)[0]
+        etag = stem if CONTENT_HASH_NAME_PATTERN.match(stem) else True
+        response = send_from_directory(
+            app.config['UPLOAD_FOLDER'],
+            filename,
+            max_age=max_age,
+            etag=etag,
+            conditional=True
+        )
+    if is_thumbnail:
+        response.headers['Cache-Control'] = f"public, max-age={max_age}"
+    else:
+        response.headers['Cache-Control'] = f"public, max-age={max_age}, immutable"
+    return response
 
 
 # ============================
@@ -2472,7 +4870,7 @@ def get_forum_threads():
         if category and category != 'all':
             query = query.filter(ForumThread.category == category)
         if author_email:
-            query = query.filter(db.func.lower(ForumThread.author_email) == author_email)
+            query = query.filter(ForumThread.author_email == author_email)
 
         if sort == 'popular':
             query = query.order_by(
@@ -2681,7 +5079,7 @@ def _apply_forum_thread_like(thread, actor_email, liked):
             ForumThreadLike.query
             .filter(
                 ForumThreadLike.thread_id == thread.id,
-                db.func.lower(ForumThreadLike.user_email) == actor_email
+                ForumThreadLike.user_email == actor_email
             )
             .first()
         )
@@ -2706,7 +5104,7 @@ def _apply_forum_comment_like(comment, actor_email, liked):
             ForumCommentLike.query
             .filter(
                 ForumCommentLike.comment_id == comment.id,
-                db.func.lower(ForumCommentLike.user_email) == actor_email
+                ForumCommentLike.user_email == actor_email
             )
             .first()
         )
@@ -2799,6 +5197,30 @@ def unlike_forum_comment(comment_id):
 
     return jsonify({"like_count": comment.like_count, "liked": False}), 200
 
+
+def _adjust_follow_counts(follower_email, followee_email, delta):
+    # SQL側で加減算し、同時のフォロー・解除でも値を取りこぼさない
+    users = User.__table__
+    if delta >= 0:
+        follower_value = users.c.follower_count + delta
+        following_value = users.c.following_count + delta
+    else:
+        follower_value = db.case((users.c.follower_count + delta > 0, users.c.follower_count + delta), else_=0)
+        following_value = db.case((users.c.following_count + delta > 0, users.c.following_count + delta), else_=0)
+    db.session.execute(
+        users.update().where(users.c.email == followee_email).values(follower_count=follower_value)
+    )
+    db.session.execute(
+        users.update().where(users.c.email == follower_email).values(following_count=following_value)
+    )
+    if delta < 0:
+        followee = db.session.execute(
+            db.select(users.c.id, users.c.follower_count).where(users.c.email == followee_email)
+        ).first()
+        if followee and followee.follower_count <= FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS < followee.follower_count - delta:
+            _enqueue_job('refill_follow_timeline', {"seller_user_id": followee.id})
+
+
 @app.route('/api/forum/follow/status', methods=['GET'])
 def get_forum_follow_status():
     follower_email = _normalize_email(request.args.get('follower_email'))
@@ -2816,10 +5238,7 @@ def get_forum_follow_status():
             "is_blocked": True
         }), 200
 
-    is_following = ForumFollow.query.filter_by(
-        follower_email=follower_email,
-        followee_email=followee_email
-    ).first() is not None
+    is_following = _is_following(follower_email, followee_email)
 
     return jsonify({
         "following": is_following,
@@ -2858,6 +5277,9 @@ def follow_user():
 
     try:
         db.session.add(follow)
+        _adjust_follow_counts(follower_email, followee_email, 1)
+        _bump_social_graph_versions(follower_email, followee_email)
+        _enqueue_follow_timeline_backfill(follower_email, followee_email)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -2885,6 +5307,9 @@ def unfollow_user():
 
     try:
         db.session.delete(follow)
+        _adjust_follow_counts(follower_email, followee_email, -1)
+        _bump_social_graph_versions(follower_email, followee_email)
+        _remove_follow_timeline_entries(follower_email, followee_email)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -2910,10 +5335,7 @@ def get_follow_status():
             "is_blocked": True
         }), 200
 
-    is_following = ForumFollow.query.filter_by(
-        follower_email=follower_email,
-        followee_email=followee_email
-    ).first() is not None
+    is_following = _is_following(follower_email, followee_email)
 
     return jsonify({
         "following": is_following,
@@ -2952,6 +5374,9 @@ def follow_user_general():
 
     try:
         db.session.add(follow)
+        _adjust_follow_counts(follower_email, followee_email, 1)
+        _bump_social_graph_versions(follower_email, followee_email)
+        _enqueue_follow_timeline_backfill(follower_email, followee_email)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -2979,6 +5404,9 @@ def unfollow_user_general():
 
     try:
         db.session.delete(follow)
+        _adjust_follow_counts(follower_email, followee_email, -1)
+        _bump_social_graph_versions(follower_email, followee_email)
+        _remove_follow_timeline_entries(follower_email, followee_email)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -2987,38 +5415,50 @@ def unfollow_user_general():
     return jsonify({"message": "フォロー解除しました"}), 200
 
 
+FOLLOW_LIST_DEFAULT_LIMIT = 50
+FOLLOW_LIST_MAX_LIMIT = 200
+
+
 @app.route('/api/follow/list', methods=['GET'])
 def get_follow_list():
     email = _normalize_email(request.args.get('email'))
     list_type = (request.args.get('type') or 'following').strip().lower()
+    limit = request.args.get('limit', FOLLOW_LIST_DEFAULT_LIMIT, type=int) or FOLLOW_LIST_DEFAULT_LIMIT
+    limit = max(1, min(limit, FOLLOW_LIST_MAX_LIMIT))
 
     if not email:
         return jsonify({"error": "email が必要です"}), 400
     if list_type not in {'following', 'followers'}:
         return jsonify({"error": "type は following または followers を指定してください"}), 400
 
+    sort_keys = [(ForumFollow.created_at, 'desc'), (ForumFollow.id, 'desc')]
+    try:
+        cursor_values = _decode_cursor((request.args.get('cursor') or '').strip(), sort_keys)
+    except ValueError:
+        return jsonify({"error": "cursor が不正です", "users": []}), 400
+
+    if list_type == 'following':
+        query = ForumFollow.query.filter(ForumFollow.follower_email == email)
+    else:
+        query = ForumFollow.query.filter(ForumFollow.followee_email == email)
+    if cursor_values is not None:
+        query = query.filter(_keyset_condition(sort_keys, cursor_values))
+
+    rows = query.order_by(*_keyset_order_by(sort_keys)).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor([rows[-1].created_at, rows[-1].id]) if has_more and rows else None
+
     if list_type == 'following':
-        rows = (
-            ForumFollow.query
-            .filter(db.func.lower(ForumFollow.follower_email) == email)
-            .order_by(ForumFollow.created_at.desc(), ForumFollow.id.desc())
-            .all()
-        )
         target_emails = [_normalize_email(row.followee_email) for row in rows if _normalize_email(row.followee_email)]
     else:
-        rows = (
-            ForumFollow.query
-            .filter(db.func.lower(ForumFollow.followee_email) == email)
-            .order_by(ForumFollow.created_at.desc(), ForumFollow.id.desc())
-            .all()
-        )
         target_emails = [_normalize_email(row.follower_email) for row in rows if _normalize_email(row.follower_email)]
 
     if not target_emails:
-        return jsonify({"users": []}), 200
+        return jsonify({"users": [], "next_cursor": next_cursor, "has_more": has_more}), 200
 
-    users = User.query.filter(db.func.lower(User.email).in_(target_emails)).all()
-    user_map = {_normalize_email(user.email): user for user in users if user.email}
+    user_map = _prime_users_by_email(target_emails)
+    blocked_by_me, blocked_me = _resolve_block_relations(email, target_emails)
 
     result = []
     seen = set()
@@ -3031,18 +5471,17 @@ def get_follow_list():
         if not target_user:
             continue
 
-        block_relation = _get_block_relation(email, target_email)
         result.append({
             "email": target_user.email,
             "user_id": target_user.user_id,
             "user_name": target_user.user_name or target_user.name or (target_user.email.split('@')[0] if target_user.email else 'ユーザー'),
             "profile_image": target_user.profile_image,
-            "blocked_by_me": block_relation["blocked_by_a"],
-            "blocked_me": block_relation["blocked_by_b"],
-            "is_blocked": block_relation["is_blocked"]
+            "blocked_by_me": target_email in blocked_by_me,
+            "blocked_me": target_email in blocked_me,
+            "is_blocked": target_email in blocked_by_me or target_email in blocked_me
         })
 
-    return jsonify({"users": result}), 200
+    return jsonify({"users": result, "next_cursor": next_cursor, "has_more": has_more}), 200
 
 
 @app.route('/api/block/status', methods=['GET'])
@@ -3064,21 +5503,30 @@ def get_block_status():
 @app.route('/api/block/list', methods=['GET'])
 def get_block_list():
     email = _normalize_email(request.args.get('email'))
+    limit = request.args.get('limit', FOLLOW_LIST_DEFAULT_LIMIT, type=int) or FOLLOW_LIST_DEFAULT_LIMIT
+    limit = max(1, min(limit, FOLLOW_LIST_MAX_LIMIT))
     if not email:
         return jsonify({"error": "email が必要です"}), 400
 
-    rows = (
-        UserBlock.query
-        .filter(db.func.lower(UserBlock.blocker_email) == email)
-        .order_by(UserBlock.created_at.desc(), UserBlock.id.desc())
-        .all()
-    )
+    sort_keys = [(UserBlock.created_at, 'desc'), (UserBlock.id, 'desc')]
+    try:
+        cursor_values = _decode_cursor((request.args.get('cursor') or '').strip(), sort_keys)
+    except ValueError:
+        return jsonify({"error": "cursor が不正です", "users": []}), 400
+
+    query = UserBlock.query.filter(UserBlock.blocker_email == email)
+    if cursor_values is not None:
+        query = query.filter(_keyset_condition(sort_keys, cursor_values))
+    rows = query.order_by(*_keyset_order_by(sort_keys)).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor([rows[-1].created_at, rows[-1].id]) if has_more and rows else None
+
     blocked_emails = [_normalize_email(row.blocked_email) for row in rows if _normalize_email(row.blocked_email)]
     if not blocked_emails:
-        return jsonify({"users": []}), 200
+        return jsonify({"users": [], "next_cursor": next_cursor, "has_more": has_more}), 200
 
-    users = User.query.filter(db.func.lower(User.email).in_(blocked_emails)).all()
-    user_map = {_normalize_email(user.email): user for user in users if user.email}
+    user_map = _prime_users_by_email(blocked_emails)
 
     result = []
     for blocked_email in blocked_emails:
@@ -3092,7 +5540,7 @@ def get_block_list():
             "profile_image": user.profile_image
         })
 
-    return jsonify({"users": result}), 200
+    return jsonify({"users": result, "next_cursor": next_cursor, "has_more": has_more}), 200
 
 
 @app.route('/api/block', methods=['POST'])
@@ -3119,12 +5567,12 @@ def block_user():
     follow_rows = ForumFollow.query.filter(
         db.or_(
             db.and_(
-                db.func.lower(ForumFollow.follower_email) == blocker_email,
-                db.func.lower(ForumFollow.followee_email) == blocked_email
+                ForumFollow.follower_email == blocker_email,
+                ForumFollow.followee_email == blocked_email
             ),
             db.and_(
-                db.func.lower(ForumFollow.follower_email) == blocked_email,
-                db.func.lower(ForumFollow.followee_email) == blocker_email
+                ForumFollow.follower_email == blocked_email,
+                ForumFollow.followee_email == blocker_email
             )
         )
     ).all()
@@ -3133,6 +5581,11 @@ def block_user():
         db.session.add(block)
         for row in follow_rows:
             db.session.delete(row)
+            _adjust_follow_counts(row.follower_email, row.followee_email, -1)
+            _remove_follow_timeline_entries(row.follower_email, row.followee_email)
+        # ブロックで表示対象の通知が変わるため未読数を再集計させる
+        _invalidate_unread_notification_counts(blocker_email, blocked_email)
+        _bump_social_graph_versions(blocker_email, blocked_email)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -3156,6 +5609,8 @@ def unblock_user():
 
     try:
         db.session.delete(block_row)
+        _invalidate_unread_notification_counts(blocker_email, blocked_email)
+        _bump_social_graph_versions(blocker_email, blocked_email)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -3226,6 +5681,11 @@ def _build_purchase_review_context(purchase, current_email=''):
         .all()
     )
 
+    _prime_users_by_email(
+        email
+        for row in review_rows
+        for email in (row.reviewer_email, row.reviewee_email)
+    )
     reviews = [_serialize_purchase_review(row, party_info) for row in review_rows]
     my_review = next((item for item in reviews if item["reviewer_email"] == actor_email), None)
 
@@ -3349,6 +5809,8 @@ def update_purchase_status(purchase_id):
     seller_email = _normalize_email(seller_user.email) if seller_user and seller_user.email else ''
     buyer_email = _normalize_email(purchase.buyer_email)
     product = Product.query.get(purchase.product_id)
+    if product and product.latest_purchase_id in {None, purchase.id}:
+        _set_product_latest_purchase(product, purchase)
 
     notify_target = ''
     actor_name = _display_name_from_email(actor_email, _find_user_by_email(actor_email))
@@ -3429,7 +5891,7 @@ def submit_purchase_review(purchase_id):
         PurchaseReview.query
         .filter(
             PurchaseReview.purchase_id == purchase.id,
-            db.func.lower(PurchaseReview.reviewer_email) == reviewer_email
+            PurchaseReview.reviewer_email == reviewer_email
         )
         .first()
     )
@@ -3449,6 +5911,7 @@ def submit_purchase_review(purchase_id):
 
     try:
         db.session.add(review)
+        _apply_review_to_user_rating(review)
 
         _create_notification(
             user_email=reviewee_email,
@@ -3539,6 +6002,7 @@ def _upsert_purchase_from_session(session):
     db.session.add(purchase)
     if product.status == 1:
         product.status = 0
+        _trim_follow_timeline(product.id)
 
     buyer_email = (session.get('customer_email') or '').strip().lower()
     seller = User.query.get(product.seller_id) if product.seller_id else None
@@ -3564,6 +6028,8 @@ def _upsert_purchase_from_session(session):
             actor_email=buyer_email
         )
     try:
+        db.session.flush()
+        _set_product_latest_purchase(product, purchase)
         db.session.commit()
     except Exception:
         db.session.rollback()
@@ -3597,7 +6063,7 @@ def create_checkout_session():
         return jsonify({"error": "商品が見つかりません"}), 404
 
     if customer_email and product.seller_id:
-        buyer = User.query.filter_by(email=customer_email).first()
+        buyer = User.query.filter_by(email=_normalize_email(customer_email)).first()
         if buyer and buyer.id == product.seller_id:
             return jsonify({"error": "自分の商品は購入できません"}), 400
 
@@ -3671,9 +6137,27 @@ def stripe_webhook():
     except stripe.error.SignatureVerificationError:
         return jsonify({"error": "署名検証に失敗しました"}), 400
 
-    if event.get('type') == 'checkout.session.completed':
-        session = event['data']['object']
-        _upsert_purchase_from_session(session)
+    # stripe-python の新しい版では StripeObject が dict ではないため .get() を使わない
+    event_id = event['id'] if 'id' in event else None
+    if not event_id:
+        return jsonify({"error": "イベントIDがありません"}), 400
+
+    # 署名検証済みの生ペイロードを保存してすぐに応答し、処理はジョブに任せる
+    if db.session.get(StripeEvent, event_id) is None:
+        try:
+            db.session.add(StripeEvent(
+                id=event_id,
+                event_type=(event['type'] if 'type' in event else '') or '',
+                payload=payload.decode('utf-8') if isinstance(payload, bytes) else payload,
+                status='pending'
+            ))
+            _enqueue_job('process_stripe_event', {"event_id": event_id}, idempotency_key=f"stripe-event:{event_id}")
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # 同じイベントの再送が同時に届いた場合は先に保存された方を使う
+            if db.session.get(StripeEvent, event_id) is None:
+                return jsonify({"error": "イベントの保存に失敗しました", "detail": str(e)}), 500
 
     return jsonify({"status": "success"}), 200
 
@@ -3704,11 +6188,550 @@ def get_purchase_by_session(session_id):
     return jsonify(_format_purchase_response(purchase, product)), 200
 
 
+# ============================
+# バックグラウンドジョブ
+# ============================
+# 応答に不要な後続処理は background_jobs に積み、呼び出し元と同じトランザクションで確定させる。
+# 本番は flask run-jobs を別プロセスで起動する。Web プロセス内のワーカーは既定で起動せず、
+# ローカル開発では .env の JOB_EMBEDDED_WORKERS=1 でプロセス内ワーカーに処理させる
+JOB_EMBEDDED_WORKERS = int(os.getenv("JOB_EMBEDDED_WORKERS", "0"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "5"))
+JOB_LOCK_TIMEOUT_SECONDS = int(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", "600"))
+JOB_RETRY_BASE_SECONDS = 10
+JOB_RETRY_MAX_SECONDS = 3600
+# 完了・失敗したジョブの保持期間。ワーカーが JOB_PURGE_INTERVAL_SECONDS ごとに古い行を削除する
+JOB_DONE_RETENTION_DAYS = int(os.getenv("JOB_DONE_RETENTION_DAYS", "7"))
+JOB_FAILED_RETENTION_DAYS = int(os.getenv("JOB_FAILED_RETENTION_DAYS", "30"))
+JOB_PURGE_INTERVAL_SECONDS = 3600
+JOB_PURGE_BATCH_SIZE = 1000
+
+_JOB_WAKE_EVENT = threading.Event()
+_JOB_WORKER_LOCK = threading.Lock()
+_EMBEDDED_JOB_WORKER_PID = None
+_JOB_CONTEXT = threading.local()
+_JOB_LAST_PURGE_AT = None
+
+
+class JobLockLostError(RuntimeError):
+    pass
+
+
+def _handle_stripe_checkout_completed(session):
+    purchase, product = _upsert_purchase_from_session(session)
+    if purchase is None and product is not None:
+        # 商品はあるのに購入を確定できなかった場合は再試行させる
+        raise RuntimeError(f"failed to record purchase for session {session.get('id')}")
+
+
+STRIPE_EVENT_HANDLERS = {
+    "checkout.session.completed": _handle_stripe_checkout_completed,
+}
+
+
+def _process_stripe_event(event_id, replay=False):
+    stripe_event = db.session.get(StripeEvent, event_id)
+    if stripe_event is None:
+        return None
+    if stripe_event.status in {'processed', 'ignored'} and not replay:
+        return stripe_event.status
+
+    handler = STRIPE_EVENT_HANDLERS.get(stripe_event.event_type)
+    try:
+        if handler is not None:
+            # 購入の作成は stripe_session_id で重複を防いでいるので、再処理しても二重計上しない
+            handler(json.loads(stripe_event.payload)['data']['object'])
+    except Exception as e:
+        db.session.rollback()
+        stripe_event = db.session.get(StripeEvent, event_id)
+        stripe_event.status = 'failed'
+        stripe_event.attempts = (stripe_event.attempts or 0) + 1
+        stripe_event.last_error = f"{type(e).__name__}: {e}"[:2000]
+        db.session.commit()
+        raise
+
+    stripe_event = db.session.get(StripeEvent, event_id)
+    stripe_event.status = 'processed' if handler is not None else 'ignored'
+    stripe_event.attempts = (stripe_event.attempts or 0) + 1
+    stripe_event.last_error = None
+    stripe_event.processed_at = datetime.utcnow()
+    db.session.commit()
+    return stripe_event.status
+
+
+BACKGROUND_JOB_HANDLERS = {
+    "notify_followers_of_listing": _notify_followers_of_listing,
+    "remove_upload_file": _remove_upload_file_if_exists,
+    "process_stripe_event": _process_stripe_event,
+    "generate_image_variants": _generate_image_variants,
+    "fan_out_follow_timeline": _fan_out_follow_timeline,
+    "backfill_follow_timeline": _backfill_follow_timeline_for_follow,
+    "refill_follow_timeline": _refill_follow_timeline_for_seller,
+}
+
+
+def _enqueue_job(job_type, payload=None, idempotency_key=None, run_at=None, max_attempts=5):
+    if job_type not in BACKGROUND_JOB_HANDLERS:
+        raise ValueError(f"unknown job type: {job_type}")
+
+    if idempotency_key:
+        existing = BackgroundJob.query.filter_by(idempotency_key=idempotency_key).first()
+        if existing:
+            return existing
+
+    job = BackgroundJob(
+        job_type=job_type,
+        payload=json.dumps(payload or {}, ensure_ascii=False),
+        status='pending',
+        attempts=0,
+        max_attempts=max_attempts,
+        run_at=run_at or datetime.utcnow(),
+        idempotency_key=idempotency_key
+    )
+    db.session.add(job)
+    db.session.info['background_jobs_enqueued'] = True
+    return job
+
+
+@sa_event.listens_for(SqlaSession, 'after_commit')
+def _wake_job_workers(session):
+    # ワーカーの起動はリクエスト受付時に行い、ここでは待機中のワーカーを起こすだけにする
+    if not session.info.pop('background_jobs_enqueued', False):
+        return
+    _JOB_WAKE_EVENT.set()
+
+
+@sa_event.listens_for(SqlaSession, 'after_rollback')
+def _discard_job_wakeup(session):
+    session.info.pop('background_jobs_enqueued', None)
+
+
+def _job_retry_delay(attempts):
+    return min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+
+
+def _fail_exhausted_stale_jobs(now, stale_before):
+    # 試行回数を使い切ったままロック期限が切れたジョブ（毎回ワーカーごと落ちるジョブ）は取り直さずに失敗させる
+    jobs = BackgroundJob.__table__
+    result = db.session.execute(
+        jobs.update()
+        .where(
+            jobs.c.status == 'running',
+            jobs.c.locked_at < stale_before,
+            jobs.c.attempts >= jobs.c.max_attempts
+        )
+        .values(
+            status='failed',
+            locked_by=None,
+            locked_at=None,
+            finished_at=now,
+            last_error=f"JobLockExpired: no result within {JOB_LOCK_TIMEOUT_SECONDS}s on the final attempt"
+        )
+    )
+    db.session.commit()
+    return result.rowcount or 0
+
+
+def _claim_next_job(worker_id):
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=JOB_LOCK_TIMEOUT_SECONDS)
+    _fail_exhausted_stale_jobs(now, stale_before)
+    # 落ちたワーカーが掴んだままのジョブも、試行回数が残っていればロック期限切れで取り直す
+    claimable = db.or_(
+        db.and_(BackgroundJob.status == 'pending', BackgroundJob.run_at <= now),
+        db.and_(
+            BackgroundJob.status == 'running',
+            BackgroundJob.locked_at < stale_before,
+            BackgroundJob.attempts < BackgroundJob.max_attempts
+        )
+    )
+    candidate_ids = [
+        row.id
+        for row in (
+            db.session.query(BackgroundJob.id)
+            .filter(claimable)
+            .order_by(BackgroundJob.run_at.asc(), BackgroundJob.id.asc())
+            .limit(10)
+            .all()
+        )
+    ]
+    for job_id in candidate_ids:
+        # SKIP LOCKED を使わず、条件付き UPDATE の更新件数で取得できたかを判定する（SQLite / MySQL 共通）
+        result = db.session.execute(
+            BackgroundJob.__table__.update()
+            .where(BackgroundJob.id == job_id)
+            .where(claimable)
+            .values(
+                status='running',
+                locked_by=worker_id,
+                locked_at=now,
+                attempts=BackgroundJob.attempts + 1
+            )
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return job_id
+    return None
+
+
+def _job_heartbeat():
+    # 長いジョブはバッチごとに呼び出してロック期限を延ばす。別ワーカーに取り直されていたら中断する
+    job_id = getattr(_JOB_CONTEXT, 'job_id', None)
+    if job_id is None:
+        return
+    jobs = BackgroundJob.__table__
+    result = db.session.execute(
+        jobs.update()
+        .where(jobs.c.id == job_id, jobs.c.locked_by == _JOB_CONTEXT.worker_id)
+        .values(locked_at=datetime.utcnow())
+    )
+    if result.rowcount != 1:
+        raise JobLockLostError(f"job {job_id} was reclaimed by another worker")
+
+
+def _finish_job(job_id, worker_id, **values):
+    # ロックを持っているワーカーだけが状態を書き込める
+    jobs = BackgroundJob.__table__
+    result = db.session.execute(
+        jobs.update()
+        .where(jobs.c.id == job_id, jobs.c.locked_by == worker_id)
+        .values(locked_by=None, locked_at=None, **values)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _run_job(job_id, worker_id):
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or job.locked_by != worker_id:
+        return False
+
+    handler = BACKGROUND_JOB_HANDLERS.get(job.job_type)
+    job_type = job.job_type
+    _JOB_CONTEXT.job_id = job_id
+    _JOB_CONTEXT.worker_id = worker_id
+    try:
+        if handler is None:
+            raise LookupError(f"unknown job type: {job_type}")
+        handler(**json.loads(job.payload or '{}'))
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(BackgroundJob, job_id)
+        last_error = f"{type(e).__name__}: {e}"[:2000]
+        if job.attempts >= job.max_attempts:
+            values = {"status": 'failed', "finished_at": datetime.utcnow()}
+        else:
+            values = {"status": 'pending', "run_at": datetime.utcnow() + timedelta(seconds=_job_retry_delay(job.attempts))}
+        if _finish_job(job_id, worker_id, last_error=last_error, **values):
+            app.logger.warning("Background job %s (%s) failed: %s", job_id, job_type, last_error)
+        else:
+            app.logger.warning("Background job %s (%s) lost its lock: %s", job_id, job_type, last_error)
+        return False
+    finally:
+        _JOB_CONTEXT.job_id = None
+        _JOB_CONTEXT.worker_id = None
+
+    if not _finish_job(job_id, worker_id, status='done', finished_at=datetime.utcnow(), last_error=None):
+        app.logger.warning("Background job %s (%s) finished after its lock was reclaimed", job_id, job_type)
+        return False
+    return True
+
+
+def _purge_finished_jobs(now=None, batch_size=JOB_PURGE_BATCH_SIZE):
+    now = now or datetime.utcnow()
+    jobs = BackgroundJob.__table__
+    purged = 0
+    for status, days in (('done', JOB_DONE_RETENTION_DAYS), ('failed', JOB_FAILED_RETENTION_DAYS)):
+        cutoff = now - timedelta(days=days)
+        while True:
+            job_ids = [
+                row[0] for row in db.session.execute(
+                    db.select(jobs.c.id)
+                    .where(jobs.c.status == status, jobs.c.finished_at < cutoff)
+                    .order_by(jobs.c.id.asc())
+                    .limit(batch_size)
+                ).all()
+            ]
+            if not job_ids:
+                break
+            db.session.execute(jobs.delete().where(jobs.c.id.in_(job_ids), jobs.c.status == status))
+            db.session.commit()
+            purged += len(job_ids)
+    return purged
+
+
+def _purge_finished_jobs_if_due():
+    global _JOB_LAST_PURGE_AT
+    now = time.monotonic()
+    with _JOB_WORKER_LOCK:
+        if _JOB_LAST_PURGE_AT is not None and now - _JOB_LAST_PURGE_AT < JOB_PURGE_INTERVAL_SECONDS:
+            return 0
+        _JOB_LAST_PURGE_AT = now
+    return _purge_finished_jobs()
+
+
+def _job_worker_loop(worker_id, stop_event, exit_when_idle=False):
+    while not stop_event.is_set():
+        with app.app_context():
+            try:
+                job_id = _claim_next_job(worker_id)
+                if job_id is not None:
+                    _run_job(job_id, worker_id)
+                    continue
+                _purge_finished_jobs_if_due()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Background job worker %s failed", worker_id)
+
+        if exit_when_idle:
+            return
+        _JOB_WAKE_EVENT.wait(JOB_POLL_INTERVAL_SECONDS)
+        _JOB_WAKE_EVENT.clear()
+
+
+def _job_worker_id(index):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def _ensure_embedded_job_workers_started():
+    global _EMBEDDED_JOB_WORKER_PID
+    pid = os.getpid()
+    if _EMBEDDED_JOB_WORKER_PID == pid:
+        return
+    with _JOB_WORKER_LOCK:
+        if _EMBEDDED_JOB_WORKER_PID == pid:
+            return
+        _EMBEDDED_JOB_WORKER_PID = pid
+
+    never_stop = threading.Event()
+    for index in range(JOB_EMBEDDED_WORKERS):
+        threading.Thread(
+            target=_job_worker_loop,
+            args=(_job_worker_id(index), never_stop),
+            name=f'background-job-{index}',
+            daemon=True
+        ).start()
+
+
+@app.before_request
+def _start_embedded_job_workers():
+    # 再起動直後に残っている待機中・再試行待ちのジョブも処理されるよう、最初のリクエストで起動する
+    if JOB_EMBEDDED_WORKERS > 0:
+        _ensure_embedded_job_workers_started()
+
+
+# ============================
+# 管理コマンド
+# ============================
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    _ensure_schema_upgrades_once()
+    click.echo("schema is up to date")
+
+
+@app.cli.command('compact-product-views')
+def compact_product_views_command():
+    _ensure_schema_upgrades_once()
+    compacted = _compact_product_views()
+    click.echo(f"compacted product views: {compacted}")
+
+
+@app.cli.command('backfill-product-cards')
+def backfill_product_cards_command():
+    _ensure_schema_upgrades_once()
+    updated = _backfill_product_card_fields()
+    click.echo(f"backfilled products: {updated}")
+
+
+@app.cli.command('purge-jobs')
+def purge_jobs_command():
+    _ensure_schema_upgrades_once()
+    purged = _purge_finished_jobs()
+    click.echo(f"purged finished jobs: {purged}")
+
+
+@app.cli.command('run-jobs')
+@click.option('--workers', default=4, show_default=True, type=int, help='並列に処理するワーカースレッド数')
+@click.option('--once', is_flag=True, help='実行可能なジョブが無くなったら終了する')
+def run_jobs_command(workers, once):
+    _ensure_schema_upgrades_once()
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(
+            target=_job_worker_loop,
+            args=(_job_worker_id(index), stop_event, once),
+            name=f'background-job-{index}',
+            daemon=True
+        )
+        for index in range(max(1, workers))
+    ]
+    for thread in threads:
+        thread.start()
+    click.echo(f"job workers started: {len(threads)}")
+
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        # 実行中のジョブは完了させてから終了する
+        stop_event.set()
+        _JOB_WAKE_EVENT.set()
+        for thread in threads:
+            thread.join()
+    click.echo("job workers stopped")
+
+
+@app.cli.command('replay-stripe-events')
+@click.option('--event-id', 'event_ids', multiple=True, help='再処理するイベントID（複数指定可）')
+@click.option('--status', default='failed', show_default=True, help='--event-id 未指定時に対象とする状態（all で全件）')
+@click.option('--since', default=None, help='この日時（ISO形式）以降に受信したイベントに限定する')
+def replay_stripe_events_command(event_ids, status, since):
+    _ensure_schema_upgrades_once()
+    if event_ids:
+        targets = list(event_ids)
+    else:
+        query = db.session.query(StripeEvent.id)
+        if status != 'all':
+            query = query.filter(StripeEvent.status == status)
+        if since:
+            query = query.filter(StripeEvent.received_at >= datetime.fromisoformat(since))
+        targets = [row.id for row in query.order_by(StripeEvent.received_at.asc()).all()]
+
+    processed = 0
+    for event_id in targets:
+        try:
+            result = _process_stripe_event(event_id, replay=True)
+        except Exception as e:
+            click.echo(f"{event_id}: failed ({e})")
+            continue
+        if result is None:
+            click.echo(f"{event_id}: not found")
+            continue
+        processed += 1
+        click.echo(f"{event_id}: {result}")
+    click.echo(f"replayed stripe events: {processed}/{len(targets)}")
+
+
+@app.cli.command('generate-thumbnails')
+@click.option('--workers', default=4, show_default=True, type=int, help='並列に変換するスレッド数')
+@click.option('--force', is_flag=True, help='既存の縮小版も作り直す')
+def generate_thumbnails_command(workers, force):
+    _ensure_schema_upgrades_once()
+    if Image is None:
+        raise click.ClickException("Pillow がインストールされていません")
+
+    upload_root = app.config['UPLOAD_FOLDER']
+    thumbs_root = os.path.join(upload_root, 'thumbs')
+
+    def iter_upload_paths():
+        for dirpath, dirnames, filenames in os.walk(upload_root):
+            if os.path.abspath(dirpath) == os.path.abspath(upload_root) and 'thumbs' in dirnames:
+                dirnames.remove('thumbs')
+            for filename in filenames:
+                if _allowed_image(filename):
+                    rel_path = os.path.relpath(os.path.join(dirpath, filename), upload_root)
+                    yield "uploads/" + rel_path.replace(os.sep, "/")
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for count in executor.map(lambda path: _write_image_variants(path, force), iter_upload_paths()):
+            written += count
+    click.echo(f"written image variants: {written} (under {thumbs_root})")
+
+    updated = 0
+    last_id = 0
+    while True:
+        products = (
+            Product.query
+            .filter(Product.id > last_id, Product.primary_image_url.isnot(None))
+            .order_by(Product.id.asc())
+            .limit(500)
+            .all()
+        )
+        if not products:
+            break
+        for product in products:
+            thumbnail_url = _existing_thumbnail_url(product.primary_image_url)
+            if product.thumbnail_url != thumbnail_url:
+                product.thumbnail_url = thumbnail_url
+                updated += 1
+        db.session.commit()
+        last_id = products[-1].id
+    click.echo(f"updated product thumbnails: {updated}")
+
+
+@app.cli.command('gc-uploads')
+@click.option('--grace-hours', default=24, show_default=True, type=float, help='最終更新からこの時間以内のファイルは対象外にする')
+@click.option('--quarantine-dir', default=None, help='削除せずにこのディレクトリへ移動する')
+@click.option('--dry-run', is_flag=True, help='対象を表示するだけで削除しない')
+def gc_uploads_command(grace_hours, quarantine_dir, dry_run):
+    _ensure_schema_upgrades_once()
+    upload_root = app.config['UPLOAD_FOLDER']
+    if quarantine_dir:
+        quarantine_root = os.path.join(os.path.abspath(quarantine_dir), datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+        if os.path.commonpath([quarantine_root, os.path.abspath(upload_root)]) == os.path.abspath(upload_root):
+            # アップロード配下に移すと公開されたままになる
+            raise click.ClickException("--quarantine-dir は UPLOAD_FOLDER の外を指定してください")
+
+    removed = 0
+    freed_bytes = 0
+    failed = 0
+    for upload_path, absolute_path in _find_orphan_uploads(grace_hours * 3600):
+        # 1件の失敗で全体を止めず、最後に件数を報告する
+        try:
+            size = os.path.getsize(absolute_path)
+            if dry_run:
+                click.echo(f"orphan: {upload_path} ({size} bytes)")
+            elif quarantine_dir:
+                target = os.path.join(quarantine_root, os.path.relpath(absolute_path, upload_root))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # 隔離先は別ファイルシステムのことが多いので rename ではなく move（コピー＋削除にフォールバック）
+                shutil.move(absolute_path, target)
+            else:
+                os.remove(absolute_path)
+        except OSError as e:
+            failed += 1
+            click.echo(f"failed: {upload_path} ({e})", err=True)
+            continue
+        removed += 1
+        freed_bytes += size
+
+    action = "found" if dry_run else ("quarantined" if quarantine_dir else "removed")
+    click.echo(f"{action} orphan uploads: {removed} ({freed_bytes} bytes), failed: {failed}")
+    if failed:
+        raise click.ClickException(f"{failed} orphan uploads could not be processed")
+
+
+@app.cli.command('backfill-user-ids')
+@click.option('--batch-size', default=USER_ID_BACKFILL_BATCH_SIZE, show_default=True, type=int)
+def backfill_user_ids_command(batch_size):
+    _ensure_schema_upgrades_once()
+    updated = _backfill_user_id_columns(batch_size=max(1, batch_size))
+    click.echo(f"backfilled user id columns: {updated} rows")
+
+
+@app.cli.command('reconcile-follow-counts')
+@click.option('--batch-size', default=FOLLOW_COUNT_RECONCILE_BATCH_SIZE, show_default=True, type=int)
+def reconcile_follow_counts_command(batch_size):
+    _ensure_schema_upgrades_once()
+    repaired = _reconcile_follow_counts(batch_size=max(1, batch_size))
+    click.echo(f"repaired follow counts: {repaired} users")
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    _ensure_schema_upgrades_once()
+    backend = _ensure_search_index_once()
+    indexed = _rebuild_product_search_index()
+    click.echo(f"search backend: {backend}, indexed products: {indexed}")
+
+
 # ============================
 # エントリポイント
 # ============================
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        _ensure_schema_upgrades_once()
         _ensure_user_id_backfill_once()
+        _ensure_search_index_once()
     app.run(host='0.0.0.0', port=5000, debug=True)
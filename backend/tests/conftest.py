@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+
+import pytest
+
+# app を import する前にテスト用の SQLite とアップロード先へ向ける
+_TEST_ROOT = tempfile.mkdtemp(prefix="bibli-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_TEST_ROOT, "test.db").replace(os.sep, "/")
+os.environ["UPLOAD_FOLDER"] = os.path.join(_TEST_ROOT, "uploads")
+os.environ["JOB_EMBEDDED_WORKERS"] = "0"
+
+import app as bibli  # noqa: E402
+
+
+@pytest.fixture
+def ctx():
+    with bibli.app.app_context():
+        bibli.db.create_all()
+        bibli._SOCIAL_GRAPH_CACHE.clear()
+        bibli._USER_ID_BACKFILL_STATE.clear()
+        try:
+            yield bibli
+        finally:
+            bibli.db.session.remove()
+            bibli.db.drop_all()
+            with bibli.db.engine.begin() as conn:
+                conn.exec_driver_sql("DROP TABLE IF EXISTS products_fts")
+            bibli._SEARCH_BACKEND = None
+            bibli._SOCIAL_GRAPH_CACHE.clear()
+            bibli._USER_ID_BACKFILL_STATE.clear()
+            bibli._SCHEMA_UPGRADES_READY = False
+            shutil.rmtree(bibli.app.config["UPLOAD_FOLDER"], ignore_errors=True)
+
+
+@pytest.fixture
+def client(ctx):
+    return ctx.app.test_client()
+
+
+@pytest.fixture
+def make_user(ctx):
+    def _make_user(name, **fields):
+        now = datetime.utcnow()
+        user = ctx.User(
+            user_id=name,
+            user_name=name,
+            email=f"{name}@example.com",
+            password_hash="x",
+            created_at=now,
+            updated_at=now,
+            **fields
+        )
+        ctx.db.session.add(user)
+        ctx.db.session.commit()
+        return user
+    return _make_user
+
+
+@pytest.fixture
+def drain_jobs(ctx):
+    def _drain_jobs():
+        ctx._job_worker_loop("test-worker", threading.Event(), exit_when_idle=True)
+    return _drain_jobs
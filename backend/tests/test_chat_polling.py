@@ -0,0 +1,73 @@
+import pytest
+
+
+@pytest.fixture
+def chat(ctx, make_user):
+    seller = make_user("seller")
+    make_user("buyer")
+    make_user("other")
+    product = ctx.Product(title="book", price=500, seller_id=seller.id, status=1)
+    ctx.db.session.add(product)
+    ctx.db.session.commit()
+    return product.id
+
+
+def _post(ctx, product_id, sender, receiver, message):
+    row = ctx.ProductChatMessage(
+        product_id=product_id,
+        sender_email=f"{sender}@example.com",
+        receiver_email=f"{receiver}@example.com",
+        message=message,
+    )
+    ctx.db.session.add(row)
+    ctx.db.session.commit()
+    return row.id
+
+
+def _poll(client, product_id, email, **params):
+    query = {"email": f"{email}@example.com", **params}
+    response = client.get(f"/api/products/{product_id}/chat/messages", query_string=query)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_full_response_reports_the_last_message_id(ctx, client, chat):
+    _post(ctx, chat, "buyer", "seller", "hello")
+    last_id = _post(ctx, chat, "seller", "buyer", "hi")
+
+    body = _poll(client, chat, "buyer")
+
+    assert body["last_message_id"] == last_id
+    assert [m["message"] for m in body["messages"]] == ["hello", "hi"]
+
+
+def test_poll_without_new_rows_is_unchanged(ctx, client, chat):
+    last_id = _post(ctx, chat, "buyer", "seller", "hello")
+
+    body = _poll(client, chat, "buyer", after_id=last_id)
+
+    assert body == {"product_id": chat, "changed": False, "last_message_id": last_id, "messages": []}
+
+
+def test_poll_returns_only_rows_after_the_cursor(ctx, client, chat):
+    first_id = _post(ctx, chat, "buyer", "seller", "hello")
+    _post(ctx, chat, "seller", "buyer", "hi")
+    last_id = _post(ctx, chat, "seller", "buyer", "still there?")
+
+    body = _poll(client, chat, "buyer", after_id=first_id)
+
+    assert body["changed"] is True
+    assert body["last_message_id"] == last_id
+    assert [m["message"] for m in body["messages"]] == ["hi", "still there?"]
+    ctx.db.session.expire_all()
+    assert all(row.is_read for row in ctx.ProductChatMessage.query.filter_by(receiver_email="buyer@example.com"))
+
+
+def test_seller_poll_flags_activity_from_another_counterpart(ctx, client, chat):
+    cursor = _post(ctx, chat, "buyer", "seller", "hello")
+    _post(ctx, chat, "other", "seller", "is this available?")
+
+    body = _poll(client, chat, "seller", after_id=cursor, with_user="buyer@example.com")
+
+    assert body["messages"] == []
+    assert body["participants_changed"] is True
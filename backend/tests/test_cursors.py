@@ -0,0 +1,116 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def listed(ctx, make_user):
+    seller = make_user("seller")
+    base = datetime(2024, 1, 1, 12, 0, 0)
+    products = []
+    # created_at と価格が同じ商品を混ぜて、タイブレーク（id）も検証する
+    for index in range(7):
+        product = ctx.Product(
+            title=f"item{index}",
+            price=[300, 100, 300, 200, 100, 300, 200][index],
+            seller_id=seller.id,
+            status=1,
+            created_at=base + timedelta(minutes=index // 2)
+        )
+        ctx.db.session.add(product)
+        products.append(product)
+    ctx.db.session.commit()
+    return seller, products
+
+
+def _walk(client, **params):
+    pages = []
+    cursor = ""
+    while True:
+        res = client.get("/api/products", query_string={"cursor": cursor, "limit": 3, **params})
+        assert res.status_code == 200
+        body = res.get_json()
+        pages.append([product["id"] for product in body["products"]])
+        if not body["has_more"]:
+            assert body["next_cursor"] is None
+            return pages
+        cursor = body["next_cursor"]
+
+
+@pytest.mark.parametrize("sort", ["newest", "price_asc", "price_desc"])
+def test_cursor_pages_match_offset_order_without_gaps(client, listed, sort):
+    expected = [product["id"] for product in client.get(
+        "/api/products", query_string={"sort": sort, "limit": 100}
+    ).get_json()["products"]]
+
+    pages = _walk(client, sort=sort)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [product_id for page in pages for product_id in page] == expected
+
+
+def test_new_listing_does_not_shift_later_pages(client, ctx, listed):
+    seller, products = listed
+    first = client.get("/api/products", query_string={"cursor": "", "limit": 3}).get_json()
+
+    ctx.db.session.add(ctx.Product(title="new", price=1, seller_id=seller.id, status=1, created_at=datetime(2030, 1, 1)))
+    ctx.db.session.commit()
+    second = client.get("/api/products", query_string={"cursor": first["next_cursor"], "limit": 3}).get_json()
+
+    seen = [product["id"] for product in first["products"] + second["products"]]
+    assert len(seen) == len(set(seen)) == 6
+
+
+def test_invalid_cursor_is_rejected(client, listed):
+    assert client.get("/api/products", query_string={"cursor": "not-a-cursor"}).status_code == 400
+    # 並び順のキー数が違うカーソルも受け付けない
+    three_keys = client.get("/api/products", query_string={"cursor": "", "limit": 1, "sort": "popular"}).get_json()["next_cursor"]
+    assert client.get("/api/products", query_string={"cursor": three_keys, "sort": "price_asc"}).status_code == 400
+
+
+def test_follow_list_cursor_walks_all_followers(client, ctx, make_user):
+    target = make_user("target")
+    followers = [make_user(f"fan{i}") for i in range(5)]
+    same_time = datetime(2024, 1, 1)
+    for follower in followers:
+        ctx.db.session.add(ctx.ForumFollow(follower_email=follower.email, followee_email=target.email, created_at=same_time))
+    ctx.db.session.commit()
+
+    emails = []
+    cursor = ""
+    while True:
+        body = client.get("/api/follow/list", query_string={
+            "email": target.email, "type": "followers", "limit": 2, "cursor": cursor
+        }).get_json()
+        emails.extend(user["email"] for user in body["users"])
+        if not body["has_more"]:
+            break
+        cursor = body["next_cursor"]
+
+    assert sorted(emails) == sorted(follower.email for follower in followers)
+    assert len(emails) == 5
+
+
+def _raw_cursor(payload):
+    raw = json.dumps(payload).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+@pytest.mark.parametrize("payload", [
+    [1704067200, 1],
+    [{"at": "2024-01-01T00:00:00"}, 1],
+    ["not-a-date", 1],
+    ["2024-01-01T00:00:00", "1"],
+    ["2024-01-01T00:00:00", True],
+    ["2024-01-01T00:00:00", 1.5],
+])
+@pytest.mark.parametrize("path", ["/api/products", "/api/notifications", "/api/follow/list", "/api/block/list"])
+def test_wrong_typed_cursor_is_rejected(client, make_user, path, payload):
+    user = make_user("reader")
+
+    res = client.get(path, query_string={"email": user.email, "cursor": _raw_cursor(payload)})
+
+    assert res.status_code == 400
+    assert "error" in res.get_json()
@@ -0,0 +1,133 @@
+import pytest
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+
+def test_emails_are_normalized_on_write(ctx, make_user):
+    user = make_user("alice")
+    user.email = "  Alice@Example.COM "
+    ctx.db.session.add(ctx.ForumFollow(follower_email="Bob@Example.com", followee_email=" ALICE@example.com"))
+    ctx.db.session.commit()
+
+    ctx.db.session.expire_all()
+    assert ctx.User.query.one().email == "alice@example.com"
+    follow = ctx.ForumFollow.query.one()
+    assert (follow.follower_email, follow.followee_email) == ("bob@example.com", "alice@example.com")
+    assert follow.followee_user_id == user.id
+
+
+def test_login_and_profile_accept_mixed_case_email(client, ctx, make_user):
+    hashed = generate_password_hash("secret", method="pbkdf2:sha256")
+    make_user("alice", password=hashed)
+
+    res = client.post("/api/login", json={"email": " Alice@Example.com", "password": "secret"})
+    assert res.status_code == 200, res.get_json()
+    assert client.get("/api/profile/ALICE@example.com").get_json()["user_id"] == "alice"
+
+
+def _insert_raw(ctx, sql, **params):
+    # ORM のイベントを通さず、正規化前の旧データを再現する
+    ctx.db.session.execute(text(sql), params)
+    ctx.db.session.commit()
+
+
+def test_migration_lowercases_legacy_rows_and_drops_case_duplicates(ctx, make_user):
+    make_user("alice")
+    _insert_raw(ctx, "UPDATE users SET email = 'Alice@Example.com'")
+    for follower in ("Bob@Example.com", "bob@example.com"):
+        _insert_raw(
+            ctx,
+            "INSERT INTO forum_follows (follower_email, followee_email) VALUES (:follower, 'ALICE@EXAMPLE.COM')",
+            follower=follower
+        )
+    _insert_raw(ctx, "INSERT INTO user_blocks (blocker_email, blocked_email) VALUES ('Carol@Example.com', 'Dave@Example.com')")
+
+    ctx._migrate_normalize_emails()
+
+    ctx.db.session.expire_all()
+    assert ctx.User.query.one().email == "alice@example.com"
+    follows = {(row.follower_email, row.followee_email) for row in ctx.ForumFollow.query.all()}
+    assert follows == {("bob@example.com", "alice@example.com")}
+    block = ctx.UserBlock.query.one()
+    assert (block.blocker_email, block.blocked_email) == ("carol@example.com", "dave@example.com")
+
+
+def test_migration_stops_with_a_list_of_conflicting_users(ctx, make_user):
+    make_user("alice")
+    make_user("alice2")
+    _insert_raw(ctx, "UPDATE users SET email = 'ALICE@example.com' WHERE user_id = 'alice2'")
+    _insert_raw(ctx, "INSERT INTO user_blocks (blocker_email, blocked_email) VALUES ('Carol@Example.com', 'Dave@Example.com')")
+
+    with pytest.raises(RuntimeError) as excinfo:
+        ctx._run_pending_data_migrations()
+
+    assert "alice@example.com: id=1 alice@example.com, id=2 ALICE@example.com" in str(excinfo.value)
+    ctx.db.session.rollback()
+    ctx.db.session.expire_all()
+    # 何も書き換えず、移行も適用済みにしない
+    assert sorted(user.email for user in ctx.User.query.all()) == ["ALICE@example.com", "alice@example.com"]
+    assert ctx.UserBlock.query.one().blocker_email == "Carol@Example.com"
+    assert ctx.db.session.get(ctx.SchemaMigration, "normalize_emails") is None
+
+
+def test_user_id_backfill_fills_rows_written_before_the_columns_existed(ctx, make_user):
+    alice = make_user("alice")
+    bob = make_user("bob")
+    _insert_raw(ctx, "INSERT INTO forum_follows (follower_email, followee_email) VALUES ('alice@example.com', 'bob@example.com')")
+
+    assert ctx._backfill_user_id_columns(batch_size=1) == 2
+
+    follow = ctx.ForumFollow.query.one()
+    assert (follow.follower_user_id, follow.followee_user_id) == (alice.id, bob.id)
+
+
+def test_rows_without_user_ids_are_read_by_email_until_backfilled(client, ctx, make_user):
+    alice = make_user("alice")
+    make_user("bob")
+    seller = make_user("seller")
+    product = ctx.Product(title="book", price=500, seller_id=seller.id, status=1)
+    ctx.db.session.add(product)
+    ctx.db.session.commit()
+    _insert_raw(ctx, "INSERT INTO notifications (user_email, notification_type, title, message, is_read) VALUES ('alice@example.com', 'general', 't', 'm', 0)")
+    _insert_raw(ctx, "INSERT INTO forum_follows (follower_email, followee_email) VALUES ('alice@example.com', 'seller@example.com')")
+    _insert_raw(ctx, "INSERT INTO user_blocks (blocker_email, blocked_email) VALUES ('bob@example.com', 'alice@example.com')")
+    _insert_raw(
+        ctx,
+        "INSERT INTO product_chat_messages (product_id, sender_email, receiver_email, message, is_read) "
+        "VALUES (:product_id, 'alice@example.com', 'seller@example.com', 'hello', 0)",
+        product_id=product.id
+    )
+
+    def _reads():
+        ctx._SOCIAL_GRAPH_CACHE.clear()
+        with ctx.app.app_context(), ctx.app.test_request_context():
+            entry = ctx._social_graph_entry(alice.email)
+        notifications = client.get("/api/notifications", query_string={"email": alice.email}).get_json()
+        chat = client.get(f"/api/products/{product.id}/chat/messages", query_string={"email": alice.email}).get_json()
+        return (
+            len(notifications["notifications"]),
+            sorted(entry["following"]),
+            sorted(entry["blocked_me"]),
+            [m["message"] for m in chat["messages"]],
+        )
+
+    expected = (1, ["seller@example.com"], ["bob@example.com"], ["hello"])
+    assert _reads() == expected
+    assert ctx._user_id_backfill_pending(ctx.Notification, "user_email", "user_id") is True
+
+    ctx._backfill_user_id_columns()
+
+    assert ctx._user_id_backfill_pending(ctx.Notification, "user_email", "user_id") is False
+    assert ctx.Notification.query.one().user_id == alice.id
+    assert _reads() == expected
+
+
+def test_rows_written_before_signup_are_linked_to_the_new_user(ctx, make_user):
+    ctx._create_notification("carol@example.com", "general", "t", "m")
+    ctx.db.session.commit()
+    assert ctx.Notification.query.one().user_id is None
+
+    carol = make_user("carol")
+
+    ctx.db.session.expire_all()
+    assert ctx.Notification.query.one().user_id == carol.id
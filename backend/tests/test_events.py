@@ -0,0 +1,129 @@
+import json
+import queue
+from collections import deque
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def broker(ctx, monkeypatch):
+    # ブローカースレッドは起動せず、テストから _poll_user_events を直接呼ぶ
+    monkeypatch.setattr(ctx, "_ensure_event_broker_started", lambda: None)
+    monkeypatch.setattr(ctx, "_EVENT_SUBSCRIBERS", {})
+    monkeypatch.setattr(ctx, "_EVENT_STREAM_COUNT", 0)
+    monkeypatch.setattr(ctx, "_EVENT_RECENT_KEYS", set())
+    monkeypatch.setattr(ctx, "_EVENT_RECENT_ORDER", deque())
+    monkeypatch.setattr(ctx, "_EVENT_POLL_SINCE", {"chat_message": None, "notification": None})
+    monkeypatch.setattr(ctx, "_EVENT_POLL_SEEN", {"chat_message": {}, "notification": {}})
+    return ctx
+
+
+def _drain(subscriber):
+    events = []
+    while True:
+        try:
+            events.append(subscriber.get_nowait())
+        except queue.Empty:
+            return events
+
+
+def _insert_notification(ctx, email, **fields):
+    # 別ワーカーの書き込みを再現する（ORM を通さないのでこのプロセスの after_commit 配信は起きない）
+    values = {"user_email": email, "title": "t", "message": "m", "is_read": False, "created_at": datetime.utcnow()}
+    values.update(fields)
+    ctx.db.session.execute(ctx.Notification.__table__.insert().values(**values))
+    ctx.db.session.commit()
+
+
+def _seed_product(ctx, seller):
+    product = ctx.Product(title="book", price=500, seller_id=seller.id, status=1)
+    ctx.db.session.add(product)
+    ctx.db.session.commit()
+    return product
+
+
+def test_poll_delivers_rows_committed_out_of_id_order_once(broker, make_user):
+    reader = make_user("reader")
+    subscriber = broker._subscribe_user_events(reader.email)
+    broker._poll_user_events({reader.email})
+
+    _insert_notification(broker, reader.email, id=10)
+    broker._poll_user_events({reader.email})
+    # 先に採番された id の小さい行が後からコミットされる
+    _insert_notification(broker, reader.email, id=5, created_at=datetime.utcnow() - timedelta(seconds=1))
+    broker._poll_user_events({reader.email})
+    broker._poll_user_events({reader.email})
+
+    assert [payload["id"] for _kind, payload in _drain(subscriber)] == [10, 5]
+
+
+def test_seen_ids_are_forgotten_after_the_overlap_window(broker, make_user, monkeypatch):
+    monkeypatch.setattr(broker, "EVENT_BROKER_OVERLAP_SECONDS", 0)
+    reader = make_user("reader")
+    broker._subscribe_user_events(reader.email)
+    broker._poll_user_events({reader.email})
+    _insert_notification(broker, reader.email, created_at=datetime.utcnow() - timedelta(minutes=5))
+
+    broker._poll_user_events({reader.email})
+
+    assert broker._EVENT_POLL_SEEN["notification"] == {}
+
+
+def test_notifications_about_blocked_sellers_are_not_pushed(broker, client, make_user):
+    reader = make_user("reader")
+    seller = make_user("seller")
+    product = _seed_product(broker, seller)
+    assert client.post("/api/block", json={"blocker_email": reader.email, "blocked_email": seller.email}).status_code in (200, 201)
+    subscriber = broker._subscribe_user_events(reader.email)
+    broker._poll_user_events({reader.email})
+
+    # 同一プロセスのコミット直後の配信
+    broker._create_notification(reader.email, "like", "t", "m", related_product_id=product.id)
+    broker._create_notification(reader.email, "general", "t", "m")
+    broker.db.session.commit()
+    # 他ワーカーの書き込みをブローカーが拾う経路
+    _insert_notification(broker, reader.email, related_product_id=product.id)
+    _insert_notification(broker, reader.email, title="general")
+    broker._poll_user_events({reader.email})
+
+    delivered = _drain(subscriber)
+    assert len(delivered) == 2
+    assert all(payload["related_product_id"] is None for _kind, payload in delivered)
+
+
+def _open_stream(client, email):
+    return client.get("/api/events/stream", query_string={"email": email}, buffered=False)
+
+
+def test_stream_sends_published_events(broker, client, make_user):
+    reader = make_user("reader")
+    res = _open_stream(client, reader.email)
+    assert res.status_code == 200
+    chunks = iter(res.response)
+    assert next(chunks) == b"retry: 5000\n\n"
+
+    broker._publish_user_event(reader.email, "notification", {"id": 1, "title": "hello"}, event_id=1)
+
+    chunk = next(chunks).decode("utf-8")
+    assert chunk.startswith("event: notification\n")
+    assert json.loads(chunk.split("data: ", 1)[1]) == {"id": 1, "title": "hello"}
+    res.close()
+    assert broker._EVENT_SUBSCRIBERS == {}
+    assert broker._EVENT_STREAM_COUNT == 0
+
+
+def test_stream_connections_are_capped_per_process(broker, client, make_user, monkeypatch):
+    monkeypatch.setattr(broker, "EVENT_STREAM_MAX_CONNECTIONS", 1)
+    reader = make_user("reader")
+    first = _open_stream(client, reader.email)
+    next(iter(first.response))
+
+    refused = _open_stream(client, reader.email)
+    assert refused.status_code == 503
+    assert refused.headers["Retry-After"] == "30"
+
+    first.close()
+    again = _open_stream(client, reader.email)
+    assert again.status_code == 200
+    again.close()
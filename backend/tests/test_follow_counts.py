@@ -0,0 +1,63 @@
+def _counts(client, user):
+    body = client.get(f"/api/profile/{user.email}").get_json()
+    return body["follower_count"], body["following_count"]
+
+
+def _follow(client, follower, followee, path="/api/follow"):
+    return client.post(path, json={"follower_email": follower.email, "followee_email": followee.email})
+
+
+def test_follow_and_unfollow_maintain_counters(client, ctx, make_user):
+    alice, bob, carol = make_user("alice"), make_user("bob"), make_user("carol")
+
+    assert _follow(client, alice, bob).status_code == 201
+    assert _follow(client, carol, bob, path="/api/forum/follow").status_code == 201
+    assert _follow(client, alice, bob).status_code == 200
+    assert _counts(client, bob) == (2, 0)
+    assert _counts(client, alice) == (0, 1)
+
+    client.post("/api/unfollow", json={"follower_email": alice.email, "followee_email": bob.email})
+    client.post("/api/forum/unfollow", json={"follower_email": alice.email, "followee_email": bob.email})
+    assert _counts(client, bob) == (1, 0)
+    assert _counts(client, alice) == (0, 0)
+
+
+def test_block_removes_follows_in_both_directions_from_counters(client, ctx, make_user):
+    alice, bob = make_user("alice"), make_user("bob")
+    _follow(client, alice, bob)
+    _follow(client, bob, alice)
+
+    res = client.post("/api/block", json={"blocker_email": alice.email, "blocked_email": bob.email})
+
+    assert res.status_code in (200, 201), res.get_json()
+    assert _counts(client, alice) == (0, 0)
+    assert _counts(client, bob) == (0, 0)
+    assert _follow(client, bob, alice).status_code == 403
+
+
+def test_decrement_never_goes_negative(ctx, make_user):
+    alice, bob = make_user("alice"), make_user("bob")
+
+    ctx._adjust_follow_counts(alice.email, bob.email, -1)
+    ctx.db.session.commit()
+
+    ctx.db.session.expire_all()
+    assert ctx.db.session.get(ctx.User, bob.id).follower_count == 0
+    assert ctx.db.session.get(ctx.User, alice.id).following_count == 0
+
+
+def test_reconcile_repairs_drifted_counters_only(ctx, make_user):
+    alice, bob, carol = make_user("alice"), make_user("bob"), make_user("carol")
+    ctx.db.session.add(ctx.ForumFollow(follower_email=alice.email, followee_email=bob.email))
+    ctx.db.session.add(ctx.ForumFollow(follower_email=carol.email, followee_email=bob.email))
+    ctx.db.session.commit()
+    ctx._adjust_follow_counts(carol.email, bob.email, 1)
+    ctx.db.session.commit()
+
+    assert ctx._reconcile_follow_counts(batch_size=1) == 2
+
+    ctx.db.session.expire_all()
+    assert ctx.db.session.get(ctx.User, bob.id).follower_count == 2
+    assert ctx.db.session.get(ctx.User, alice.id).following_count == 1
+    assert ctx.db.session.get(ctx.User, carol.id).following_count == 1
+    assert ctx._reconcile_follow_counts() == 0
@@ -0,0 +1,133 @@
+def _list_product(client, seller, title):
+    res = client.post("/api/products", json={"title": title, "price": 500, "seller_id": seller.id})
+    assert res.status_code == 201, res.get_json()
+    return res.get_json()["product_id"]
+
+
+def _feed_titles(client, user):
+    return [product["title"] for product in client.get("/api/follow/feed", query_string={"email": user.email}).get_json()["products"]]
+
+
+def _follow(client, follower, followee):
+    assert client.post("/api/follow", json={"follower_email": follower.email, "followee_email": followee.email}).status_code == 201
+
+
+def test_new_listing_is_fanned_out_to_followers_only(client, ctx, make_user, drain_jobs):
+    seller, fan, stranger = make_user("seller"), make_user("fan"), make_user("stranger")
+    _follow(client, fan, seller)
+    drain_jobs()
+
+    _list_product(client, seller, "first")
+    _list_product(client, seller, "second")
+    drain_jobs()
+
+    assert _feed_titles(client, fan) == ["second", "first"]
+    assert _feed_titles(client, stranger) == []
+    assert ctx.FollowTimelineEntry.query.count() == 2
+
+
+def test_fan_out_retry_does_not_duplicate_entries(client, ctx, make_user, drain_jobs):
+    seller, fan = make_user("seller"), make_user("fan")
+    _follow(client, fan, seller)
+    product_id = _list_product(client, seller, "book")
+    drain_jobs()
+
+    assert ctx._fan_out_follow_timeline(product_id) == 0
+    ctx.db.session.commit()
+    assert ctx.FollowTimelineEntry.query.count() == 1
+
+
+def test_follow_backfills_and_unfollow_clears_the_timeline(client, ctx, make_user, drain_jobs):
+    seller, fan = make_user("seller"), make_user("fan")
+    _list_product(client, seller, "older")
+    _list_product(client, seller, "newer")
+    drain_jobs()
+    assert _feed_titles(client, fan) == []
+
+    _follow(client, fan, seller)
+    drain_jobs()
+    assert _feed_titles(client, fan) == ["newer", "older"]
+
+    client.post("/api/unfollow", json={"follower_email": fan.email, "followee_email": seller.email})
+    assert _feed_titles(client, fan) == []
+    assert ctx.FollowTimelineEntry.query.count() == 0
+
+
+def test_cancelled_listing_leaves_every_timeline(client, ctx, make_user, drain_jobs):
+    seller, fan = make_user("seller"), make_user("fan")
+    _follow(client, fan, seller)
+    product_id = _list_product(client, seller, "book")
+    drain_jobs()
+
+    res = client.post(f"/api/products/{product_id}/cancel", json={"seller_email": seller.email})
+
+    assert res.status_code == 200, res.get_json()
+    assert ctx.FollowTimelineEntry.query.count() == 0
+    assert _feed_titles(client, fan) == []
+
+
+def test_sellers_over_the_fan_out_limit_are_pulled_at_read_time(client, ctx, make_user, drain_jobs, monkeypatch):
+    monkeypatch.setattr(ctx, "FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS", 1)
+    star, regular, fan, other = make_user("star"), make_user("regular"), make_user("fan"), make_user("other")
+    _follow(client, fan, star)
+    _follow(client, other, star)
+    _follow(client, fan, regular)
+    drain_jobs()
+
+    _list_product(client, regular, "from regular")
+    _list_product(client, star, "from star")
+    drain_jobs()
+
+    assert ctx.FollowTimelineEntry.query.filter_by(seller_user_id=star.id).count() == 0
+    assert ctx.FollowTimelineEntry.query.filter_by(seller_user_id=regular.id).count() == 1
+    assert _feed_titles(client, fan) == ["from star", "from regular"]
+    assert _feed_titles(client, other) == ["from star"]
+
+
+def test_blocked_sellers_are_hidden_from_both_feed_branches(client, ctx, make_user, drain_jobs, monkeypatch):
+    monkeypatch.setattr(ctx, "FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS", 1)
+    star, regular, fan, other = make_user("star"), make_user("regular"), make_user("fan"), make_user("other")
+    _follow(client, fan, star)
+    _follow(client, other, star)
+    _follow(client, fan, regular)
+    _list_product(client, regular, "from regular")
+    _list_product(client, star, "from star")
+    drain_jobs()
+    assert _feed_titles(client, fan) == ["from star", "from regular"]
+
+    # ブロック時のフォロー解除より前に読まれた場合も、フィード側で除外する
+    ctx.db.session.add(ctx.UserBlock(blocker_email=star.email, blocked_email=fan.email))
+    ctx.db.session.add(ctx.UserBlock(blocker_email=fan.email, blocked_email=regular.email))
+    ctx.db.session.commit()
+
+    assert _feed_titles(client, fan) == []
+
+
+def test_listings_made_over_the_limit_are_refilled_when_the_seller_drops_below(client, ctx, make_user, drain_jobs, monkeypatch):
+    monkeypatch.setattr(ctx, "FOLLOW_TIMELINE_FANOUT_MAX_FOLLOWERS", 1)
+    star, fan, other = make_user("star"), make_user("fan"), make_user("other")
+    _follow(client, fan, star)
+    _follow(client, other, star)
+    _list_product(client, star, "while popular")
+    drain_jobs()
+    assert ctx.FollowTimelineEntry.query.count() == 0
+
+    client.post("/api/unfollow", json={"follower_email": other.email, "followee_email": star.email})
+    drain_jobs()
+
+    assert _feed_titles(client, fan) == ["while popular"]
+    assert ctx.FollowTimelineEntry.query.filter_by(owner_user_id=fan.id).count() == 1
+
+
+def test_fan_out_resolves_follows_written_without_user_ids(client, ctx, make_user, drain_jobs):
+    seller, fan = make_user("seller"), make_user("fan")
+    ctx.db.session.execute(ctx.ForumFollow.__table__.insert().values(
+        follower_email=fan.email, followee_email=seller.email, created_at=ctx.datetime.utcnow()
+    ))
+    ctx.db.session.commit()
+
+    _list_product(client, seller, "book")
+    drain_jobs()
+
+    assert _feed_titles(client, fan) == ["book"]
+    assert ctx.ForumFollow.query.one().follower_user_id == fan.id
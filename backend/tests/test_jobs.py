@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+
+
+def test_embedded_workers_start_on_first_request_without_enqueue(client, ctx, monkeypatch):
+    started = []
+    monkeypatch.setattr(ctx, "JOB_EMBEDDED_WORKERS", 1)
+    monkeypatch.setattr(ctx, "_ensure_embedded_job_workers_started", lambda: started.append(True))
+
+    res = client.get('/api/hello')
+
+    assert res.status_code == 200
+    assert started
+
+
+def test_pending_job_left_from_previous_process_is_processed(ctx, drain_jobs, monkeypatch):
+    handled = []
+    monkeypatch.setitem(ctx.BACKGROUND_JOB_HANDLERS, "remove_upload_file", lambda **payload: handled.append(payload))
+    ctx._enqueue_job("remove_upload_file", {"upload_path": "uploads/a.png"})
+    ctx.db.session.commit()
+
+    drain_jobs()
+
+    job = ctx.BackgroundJob.query.one()
+    assert job.status == 'done'
+    assert handled == [{"upload_path": "uploads/a.png"}]
+
+
+def _reclaim(ctx, job_id, worker_id):
+    jobs = ctx.BackgroundJob.__table__
+    ctx.db.session.execute(jobs.update().where(jobs.c.id == job_id).values(locked_by=worker_id, locked_at=datetime.utcnow()))
+
+
+def test_completion_does_not_overwrite_reclaimed_job(ctx, monkeypatch):
+    def slow_handler(**payload):
+        # 実行中にロック期限が切れて別ワーカーが取り直した状況を再現する
+        _reclaim(ctx, job.id, "worker-b")
+        ctx.db.session.commit()
+
+    monkeypatch.setitem(ctx.BACKGROUND_JOB_HANDLERS, "remove_upload_file", slow_handler)
+    job = ctx._enqueue_job("remove_upload_file", {})
+    ctx.db.session.commit()
+    assert ctx._claim_next_job("worker-a") == job.id
+
+    assert ctx._run_job(job.id, "worker-a") is False
+
+    ctx.db.session.expire_all()
+    job = ctx.db.session.get(ctx.BackgroundJob, job.id)
+    assert job.status == 'running'
+    assert job.locked_by == "worker-b"
+
+
+def test_heartbeat_aborts_when_lock_is_lost(ctx, monkeypatch):
+    beats = []
+
+    def batched_handler(**payload):
+        ctx._job_heartbeat()
+        beats.append(1)
+        _reclaim(ctx, job.id, "worker-b")
+        ctx.db.session.commit()
+        ctx._job_heartbeat()
+        beats.append(2)
+
+    monkeypatch.setitem(ctx.BACKGROUND_JOB_HANDLERS, "remove_upload_file", batched_handler)
+    job = ctx._enqueue_job("remove_upload_file", {})
+    ctx.db.session.commit()
+    ctx._claim_next_job("worker-a")
+
+    assert ctx._run_job(job.id, "worker-a") is False
+    assert beats == [1]
+    ctx.db.session.expire_all()
+    job = ctx.db.session.get(ctx.BackgroundJob, job.id)
+    assert job.locked_by == "worker-b"
+    assert job.last_error is None
+
+
+def test_failed_job_backs_off_then_fails_permanently(ctx, monkeypatch):
+    def broken_handler(**payload):
+        raise ValueError("boom")
+
+    monkeypatch.setitem(ctx.BACKGROUND_JOB_HANDLERS, "remove_upload_file", broken_handler)
+    job = ctx._enqueue_job("remove_upload_file", {}, max_attempts=2)
+    ctx.db.session.commit()
+
+    ctx._claim_next_job("worker-a")
+    ctx._run_job(job.id, "worker-a")
+    job = ctx.db.session.get(ctx.BackgroundJob, job.id)
+    assert job.status == 'pending'
+    assert job.attempts == 1
+    assert job.run_at > datetime.utcnow()
+    assert ctx._claim_next_job("worker-a") is None
+
+    job.run_at = datetime.utcnow() - timedelta(seconds=1)
+    ctx.db.session.commit()
+    ctx._claim_next_job("worker-a")
+    ctx._run_job(job.id, "worker-a")
+    job = ctx.db.session.get(ctx.BackgroundJob, job.id)
+    assert job.status == 'failed'
+    assert "boom" in job.last_error
+
+
+def test_stale_running_job_is_reclaimed(ctx):
+    job = ctx._enqueue_job("remove_upload_file", {})
+    ctx.db.session.commit()
+    ctx._claim_next_job("worker-a")
+    assert ctx._claim_next_job("worker-b") is None
+
+    job.locked_at = datetime.utcnow() - timedelta(seconds=ctx.JOB_LOCK_TIMEOUT_SECONDS + 1)
+    ctx.db.session.commit()
+    assert ctx._claim_next_job("worker-b") == job.id
+
+
+def test_claim_follows_run_at_and_skips_future_jobs(ctx):
+    now = datetime.utcnow()
+    later = ctx._enqueue_job("remove_upload_file", {}, run_at=now - timedelta(seconds=10))
+    earlier = ctx._enqueue_job("remove_upload_file", {}, run_at=now - timedelta(seconds=60))
+    future = ctx._enqueue_job("remove_upload_file", {}, run_at=now + timedelta(hours=1))
+    ctx.db.session.commit()
+
+    assert ctx._claim_next_job("worker-a") == earlier.id
+    assert ctx._claim_next_job("worker-b") == later.id
+    assert ctx._claim_next_job("worker-c") is None
+
+    ctx.db.session.expire_all()
+    assert ctx.db.session.get(ctx.BackgroundJob, future.id).status == 'pending'
+    assert ctx.db.session.get(ctx.BackgroundJob, earlier.id).locked_by == "worker-a"
+
+
+def test_idempotency_key_enqueues_once(ctx):
+    first = ctx._enqueue_job("remove_upload_file", {"upload_path": "uploads/a.png"}, idempotency_key="remove-upload:a.png")
+    ctx.db.session.commit()
+    second = ctx._enqueue_job("remove_upload_file", {"upload_path": "uploads/a.png"}, idempotency_key="remove-upload:a.png")
+    ctx.db.session.commit()
+
+    assert second.id == first.id
+    assert ctx.BackgroundJob.query.count() == 1
+
+
+def test_rolled_back_enqueue_leaves_no_job_and_no_wakeup(ctx):
+    ctx._JOB_WAKE_EVENT.clear()
+    ctx._enqueue_job("remove_upload_file", {"upload_path": "uploads/a.png"})
+    ctx.db.session.rollback()
+    ctx.db.session.commit()
+
+    assert ctx.BackgroundJob.query.count() == 0
+    assert not ctx._JOB_WAKE_EVENT.is_set()
+
+
+def test_stale_job_without_attempts_left_is_failed_instead_of_reclaimed(ctx):
+    job = ctx._enqueue_job("remove_upload_file", {}, max_attempts=1)
+    ctx.db.session.commit()
+    assert ctx._claim_next_job("worker-a") == job.id
+
+    # 最後の試行中にワーカーごと落ちた
+    job.locked_at = datetime.utcnow() - timedelta(seconds=ctx.JOB_LOCK_TIMEOUT_SECONDS + 1)
+    ctx.db.session.commit()
+
+    assert ctx._claim_next_job("worker-b") is None
+    ctx.db.session.expire_all()
+    job = ctx.db.session.get(ctx.BackgroundJob, job.id)
+    assert job.status == 'failed'
+    assert job.attempts == 1
+    assert job.locked_by is None
+    assert "JobLockExpired" in job.last_error
+
+
+def test_purge_removes_only_expired_finished_jobs(ctx):
+    now = datetime.utcnow()
+    rows = {
+        "old_done": ('done', now - timedelta(days=ctx.JOB_DONE_RETENTION_DAYS + 1)),
+        "new_done": ('done', now - timedelta(days=1)),
+        "old_failed": ('failed', now - timedelta(days=ctx.JOB_FAILED_RETENTION_DAYS + 1)),
+        "kept_failed": ('failed', now - timedelta(days=ctx.JOB_DONE_RETENTION_DAYS + 1)),
+        "pending": ('pending', None),
+    }
+    for key, (status, finished_at) in rows.items():
+        job = ctx._enqueue_job("remove_upload_file", {}, idempotency_key=key)
+        job.status = status
+        job.finished_at = finished_at
+    ctx.db.session.commit()
+
+    assert ctx._purge_finished_jobs(now=now, batch_size=1) == 2
+
+    remaining = {job.idempotency_key for job in ctx.BackgroundJob.query.all()}
+    assert remaining == {"new_done", "kept_failed", "pending"}
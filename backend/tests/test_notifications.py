@@ -0,0 +1,196 @@
+from datetime import datetime
+
+import pytest
+
+
+def _seed_product(ctx, seller):
+    product = ctx.Product(title="book", price=500, seller_id=seller.id, status=1)
+    ctx.db.session.add(product)
+    ctx.db.session.commit()
+    return product
+
+
+def test_fan_out_retry_does_not_duplicate_committed_batches(ctx, make_user, monkeypatch):
+    seller = make_user("seller")
+    followers = [make_user(f"follower{i}") for i in range(5)]
+    product = _seed_product(ctx, seller)
+    emails = [user.email for user in followers]
+    for email in emails:
+        assert ctx._get_unread_notification_count(email) == 0
+
+    monkeypatch.setattr(ctx, "NOTIFICATION_FANOUT_BATCH_SIZE", 2)
+    original = ctx._blocked_counterparts
+    calls = {"count": 0}
+
+    def fail_on_second_batch(email, candidates):
+        calls["count"] += 1
+        if calls["count"] == 2:
+            raise RuntimeError("worker died")
+        return original(email, candidates)
+
+    monkeypatch.setattr(ctx, "_blocked_counterparts", fail_on_second_batch)
+    with pytest.raises(RuntimeError):
+        ctx._fan_out_notifications(emails, "follow_listing", "t", "m", related_product_id=product.id, actor_email=seller.email)
+    assert ctx.Notification.query.count() == 2
+
+    monkeypatch.setattr(ctx, "_blocked_counterparts", original)
+    created = ctx._fan_out_notifications(emails, "follow_listing", "t", "m", related_product_id=product.id, actor_email=seller.email)
+
+    assert created == 3
+    for email in emails:
+        assert ctx.Notification.query.filter_by(user_email=email).count() == 1
+        assert ctx._get_unread_notification_count(email) == 1
+
+
+def test_increment_creates_a_missing_counter_row_with_a_full_recount(ctx, make_user):
+    user = make_user("reader")
+    ctx.db.session.add(ctx.Notification(user_email=user.email, title="t", message="m"))
+    ctx.db.session.commit()
+    assert ctx.db.session.get(ctx.NotificationCounter, user.email) is None
+
+    # 行が無い状態での加算は捨てずに、この通知を含めた再集計値で行を作る
+    ctx._create_notification(user.email, "general", "t2", "m2")
+    ctx.db.session.commit()
+
+    assert ctx.db.session.get(ctx.NotificationCounter, user.email).unread_count == 2
+    ctx._create_notification(user.email, "general", "t3", "m3")
+    ctx.db.session.commit()
+    assert ctx._get_unread_notification_count(user.email) == 3
+
+
+def test_recount_does_not_overwrite_a_row_created_concurrently(ctx, make_user):
+    user = make_user("reader")
+    ctx.db.session.add(ctx.Notification(user_email=user.email, title="t", message="m"))
+    ctx.db.session.commit()
+    # 読み取り側の再集計より先に、別リクエストの加算が行を作っていた状況
+    ctx.db.session.add(ctx.NotificationCounter(user_email=user.email, unread_count=2))
+    ctx.db.session.commit()
+
+    ctx._upsert_notification_counter(user.email, increment=False)
+    ctx.db.session.commit()
+
+    ctx.db.session.expire_all()
+    assert ctx._get_unread_notification_count(user.email) == 2
+
+
+def test_fan_out_counts_recipients_with_and_without_counter_rows(ctx, make_user):
+    seller = make_user("seller")
+    counted, fresh = make_user("counted"), make_user("fresh")
+    product = _seed_product(ctx, seller)
+    assert ctx._get_unread_notification_count(counted.email) == 0
+
+    ctx._fan_out_notifications([counted.email, fresh.email], "follow_listing", "t", "m", related_product_id=product.id, actor_email=seller.email)
+
+    ctx.db.session.expire_all()
+    assert ctx.db.session.get(ctx.NotificationCounter, counted.email).unread_count == 1
+    assert ctx.db.session.get(ctx.NotificationCounter, fresh.email).unread_count == 1
+
+
+def test_read_all_clears_rows_with_null_is_read(client, ctx, make_user):
+    user = make_user("reader")
+    ctx.db.session.add(ctx.Notification(user_email=user.email, title="t", message="m", is_read=None))
+    ctx.db.session.add(ctx.Notification(user_email=user.email, title="t", message="m", is_read=False))
+    ctx.db.session.commit()
+    assert ctx._get_unread_notification_count(user.email) == 2
+
+    res = client.post('/api/notifications/read-all', json={"email": user.email})
+
+    assert res.get_json()["updated"] == 2
+    assert ctx._count_unread_notifications(user.email) == 0
+    assert ctx._get_unread_notification_count(user.email) == 0
+
+
+def test_counter_follows_creates_and_read_all(client, ctx, make_user):
+    user = make_user("reader")
+    assert client.get("/api/notifications/unread-count", query_string={"email": user.email}).get_json()["unread_count"] == 0
+    assert ctx.db.session.get(ctx.NotificationCounter, user.email) is not None
+
+    for index in range(3):
+        ctx._create_notification(user.email, "general", f"t{index}", "m")
+    ctx.db.session.commit()
+    assert client.get("/api/notifications/unread-count", query_string={"email": user.email}).get_json()["unread_count"] == 3
+
+    client.post("/api/notifications/read-all", json={"email": user.email})
+    assert client.get("/api/notifications/unread-count", query_string={"email": user.email}).get_json()["unread_count"] == 0
+
+
+def test_block_recounts_notifications_about_the_blocked_seller(client, ctx, make_user):
+    reader = make_user("reader")
+    seller = make_user("seller")
+    product = _seed_product(ctx, seller)
+    ctx._create_notification(reader.email, "follow_listing", "t", "m", related_product_id=product.id)
+    ctx._create_notification(reader.email, "general", "t", "m")
+    ctx.db.session.commit()
+    assert ctx._get_unread_notification_count(reader.email) == 2
+
+    res = client.post("/api/block", json={"blocker_email": reader.email, "blocked_email": seller.email})
+    assert res.status_code in (200, 201), res.get_json()
+    ctx.db.session.expire_all()
+    assert ctx._get_unread_notification_count(reader.email) == 1
+
+    # ブロック中に届いた通知は加算しない
+    ctx._create_notification(reader.email, "follow_listing", "t", "m", related_product_id=product.id)
+    ctx.db.session.commit()
+    assert ctx._get_unread_notification_count(reader.email) == 1
+    assert ctx._count_unread_notifications(reader.email) == 1
+
+
+def _add_notifications(ctx, email, count, created_at, notification_type="general"):
+    rows = [
+        ctx.Notification(user_email=email, notification_type=notification_type, title=f"t{index}", message="m", created_at=created_at)
+        for index in range(count)
+    ]
+    ctx.db.session.add_all(rows)
+    ctx.db.session.commit()
+    return rows
+
+
+def test_notification_pages_walk_every_row_once(client, ctx, make_user):
+    reader = make_user("reader")
+    # 同時刻の行が多くても (created_at, id) で途切れず重複しない
+    _add_notifications(ctx, reader.email, 5, datetime(2024, 1, 2))
+    _add_notifications(ctx, reader.email, 4, datetime(2024, 1, 1))
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"email": reader.email, "limit": 4}
+        if cursor:
+            params["cursor"] = cursor
+        body = client.get("/api/notifications", query_string=params).get_json()
+        seen.extend(item["id"] for item in body["notifications"])
+        assert len(body["notifications"]) <= 4
+        if not body["has_more"]:
+            assert body["next_cursor"] is None
+            break
+        cursor = body["next_cursor"]
+
+    expected = [
+        row.id for row in ctx.Notification.query.order_by(ctx.Notification.created_at.desc(), ctx.Notification.id.desc())
+    ]
+    assert seen == expected
+
+
+def test_notification_list_filters_by_type_and_blocked_seller(client, ctx, make_user):
+    reader = make_user("reader")
+    seller = make_user("seller")
+    product = _seed_product(ctx, seller)
+    _add_notifications(ctx, reader.email, 2, datetime(2024, 1, 1), notification_type="like")
+    _add_notifications(ctx, reader.email, 1, datetime(2024, 1, 1))
+    ctx._create_notification(reader.email, "like", "t", "m", related_product_id=product.id)
+    ctx.db.session.commit()
+    assert client.post("/api/block", json={"blocker_email": reader.email, "blocked_email": seller.email}).status_code in (200, 201)
+
+    body = client.get("/api/notifications", query_string={"email": reader.email, "type": "like"}).get_json()
+
+    assert len(body["notifications"]) == 2
+    assert all(item["notification_type"] == "like" for item in body["notifications"])
+    assert all(item["related_product_id"] is None for item in body["notifications"])
+
+
+def test_notification_list_rejects_a_malformed_cursor(client, make_user):
+    reader = make_user("reader")
+
+    res = client.get("/api/notifications", query_string={"email": reader.email, "cursor": "not-a-cursor"})
+
+    assert res.status_code == 400
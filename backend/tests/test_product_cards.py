@@ -0,0 +1,62 @@
+def _card(client, product_id):
+    products = client.get("/api/products", query_string={"include_sold": 1, "limit": 100}).get_json()["products"]
+    return next(card for card in products if card["id"] == product_id)
+
+
+def test_listing_stores_the_first_image_on_the_product(client, ctx, make_user):
+    seller = make_user("seller")
+    res = client.post("/api/products", json={
+        "title": "book",
+        "price": 500,
+        "seller_id": seller.id,
+        "image_urls": ["uploads/products/a.png", "uploads/products/b.png"]
+    })
+    product_id = res.get_json()["product_id"]
+
+    assert ctx.db.session.get(ctx.Product, product_id).primary_image_url == "uploads/products/a.png"
+    assert _card(client, product_id)["image_url"] == "uploads/products/a.png"
+
+
+def test_purchase_and_status_updates_refresh_the_card(client, ctx, make_user):
+    seller = make_user("seller")
+    make_user("buyer")
+    product = ctx.Product(title="book", price=500, seller_id=seller.id, status=1)
+    ctx.db.session.add(product)
+    ctx.db.session.commit()
+
+    purchase, _product = ctx._upsert_purchase_from_session({
+        "id": "cs_test_1",
+        "amount_total": 500,
+        "customer_email": "buyer@example.com",
+        "payment_status": "paid",
+        "metadata": {"product_id": str(product.id)}
+    })
+    card = _card(client, product.id)
+    assert (card["purchase_id"], card["purchase_status"], card["is_in_transaction"]) == (purchase.id, "paid", True)
+
+    res = client.post(f"/api/purchases/{purchase.id}/status", json={"actor_email": seller.email, "status": "preparing"})
+    assert res.status_code == 200, res.get_json()
+    assert _card(client, product.id)["purchase_status"] == "preparing"
+
+
+def test_backfill_fills_cards_for_existing_products(client, ctx, make_user):
+    seller = make_user("seller")
+    with_image = ctx.Product(title="a", price=500, seller_id=seller.id, status=1)
+    sold = ctx.Product(title="b", price=500, seller_id=seller.id, status=0)
+    ctx.db.session.add_all([with_image, sold])
+    ctx.db.session.flush()
+    ctx.db.session.add(ctx.ProductImage(product_id=with_image.id, image_url="uploads/products/second.png", sort_order=1))
+    ctx.db.session.add(ctx.ProductImage(product_id=with_image.id, image_url="uploads/products/first.png", sort_order=0))
+    ctx.db.session.add(ctx.Purchase(
+        product_id=sold.id, seller_id=seller.id, buyer_email="buyer@example.com",
+        amount=500, stripe_session_id="cs_legacy", status="shipped"
+    ))
+    ctx.db.session.commit()
+    assert _card(client, with_image.id)["image_url"] == ""
+
+    result = ctx.app.test_cli_runner().invoke(args=["backfill-product-cards"])
+
+    assert result.exit_code == 0, result.output
+    assert _card(client, with_image.id)["image_url"] == "uploads/products/first.png"
+    sold_card = _card(client, sold.id)
+    assert (sold_card["purchase_status"], sold_card["is_in_transaction"]) == ("shipped", True)
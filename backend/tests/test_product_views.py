@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def views(ctx, make_user, monkeypatch):
+    # バックグラウンドのフラッシュスレッドは起動せず、テストから明示的にフラッシュする
+    monkeypatch.setattr(ctx, "_ensure_view_flusher_started", lambda: None)
+    ctx._drain_view_buffer()
+    seller = make_user("seller")
+    products = [ctx.Product(title=f"item{i}", price=100, seller_id=seller.id, status=1) for i in range(2)]
+    ctx.db.session.add_all(products)
+    ctx.db.session.commit()
+    yield products
+    ctx._drain_view_buffer()
+
+
+def _daily_counts(ctx, product_id):
+    ctx.db.session.expire_all()
+    rows = ctx.ProductViewDaily.query.filter_by(product_id=product_id).all()
+    return {row.view_date: row.view_count for row in rows}
+
+
+def test_detail_views_are_buffered_until_flush(client, ctx, views):
+    product = views[0]
+    for _ in range(3):
+        assert client.get(f"/api/products/{product.id}").status_code == 200
+
+    ctx.db.session.expire_all()
+    assert (ctx.db.session.get(ctx.Product, product.id).view_count or 0) == 0
+    assert ctx.ProductView.query.count() == 0
+
+    assert ctx._flush_product_views() == 3
+    assert ctx._flush_product_views() == 0
+
+    ctx.db.session.expire_all()
+    assert ctx.db.session.get(ctx.Product, product.id).view_count == 3
+    assert _daily_counts(ctx, product.id) == {datetime.utcnow().date(): 3}
+
+
+def test_repeated_flushes_add_to_the_same_daily_bucket(ctx, views):
+    product = views[0]
+    ctx._record_product_view(product.id)
+    ctx._flush_product_views()
+    ctx._record_product_view(product.id)
+    ctx._record_product_view(product.id)
+    ctx._flush_product_views()
+
+    assert _daily_counts(ctx, product.id) == {datetime.utcnow().date(): 3}
+    assert ctx.db.session.get(ctx.Product, product.id).view_count == 3
+
+
+def test_failed_flush_keeps_pending_views(ctx, views, monkeypatch):
+    product = views[0]
+    ctx._record_product_view(product.id)
+    ctx._record_product_view(product.id)
+
+    def broken(counts):
+        raise RuntimeError("database is locked")
+
+    original = ctx._apply_view_rollups
+    monkeypatch.setattr(ctx, "_apply_view_rollups", broken)
+    assert ctx._flush_product_views() == 0
+
+    monkeypatch.setattr(ctx, "_apply_view_rollups", original)
+    assert ctx._flush_product_views() == 2
+    ctx.db.session.expire_all()
+    assert ctx.db.session.get(ctx.Product, product.id).view_count == 2
+
+
+def test_compaction_folds_raw_view_log_into_rollups(ctx, views):
+    product = views[0]
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    for viewed_at in (yesterday, yesterday, datetime.utcnow()):
+        ctx.db.session.add(ctx.ProductView(product_id=product.id, viewed_at=viewed_at))
+    ctx.db.session.commit()
+
+    assert ctx._compact_product_views() == 3
+
+    assert ctx.ProductView.query.count() == 0
+    assert _daily_counts(ctx, product.id) == {yesterday.date(): 2, datetime.utcnow().date(): 1}
+    assert ctx.db.session.get(ctx.Product, product.id).view_count == 3
+
+
+def test_popular_sort_uses_recent_daily_buckets(client, ctx, views):
+    old_hit, recent_hit = views
+    today = datetime.utcnow().date()
+    ctx._apply_view_rollups({
+        (old_hit.id, today - timedelta(days=30)): 50,
+        (recent_hit.id, today): 5,
+    })
+    ctx.db.session.commit()
+
+    all_time = client.get("/api/products", query_string={"sort": "popular"}).get_json()["products"]
+    weekly = client.get("/api/products", query_string={"sort": "popular", "popular_days": 7}).get_json()["products"]
+
+    assert [product["id"] for product in all_time] == [old_hit.id, recent_hit.id]
+    assert [product["id"] for product in weekly] == [recent_hit.id, old_hit.id]
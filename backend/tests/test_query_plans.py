@@ -0,0 +1,203 @@
+import pytest
+from sqlalchemy import create_engine, insert, select
+
+from app import (
+    db, FollowTimelineEntry, ForumFollow, Notification, Product, ProductChatMessage, ProductImage, ProductView,
+    Purchase, UserBlock
+)
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = create_engine("sqlite://")
+    db.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def _query_plan(engine, stmt):
+    sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return " / ".join(row[-1] for row in rows)
+
+
+def test_products_latest_uses_status_created_index(engine):
+    stmt = (
+        select(Product.id)
+        .where(Product.status == 1)
+        .order_by(Product.created_at.desc(), Product.id.desc())
+        .limit(20)
+    )
+    plan = _query_plan(engine, stmt)
+    assert "ix_products_status_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_products_price_sort_uses_status_price_index(engine):
+    stmt = (
+        select(Product.id)
+        .where(Product.status == 1)
+        .order_by(Product.price.asc(), Product.id.asc())
+        .limit(20)
+    )
+    plan = _query_plan(engine, stmt)
+    assert "ix_products_status_price" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_seller_listing_uses_seller_status_created_index(engine):
+    stmt = (
+        select(Product.id)
+        .where(Product.seller_id == 1, Product.status == 1)
+        .order_by(Product.created_at.desc())
+        .limit(20)
+    )
+    plan = _query_plan(engine, stmt)
+    assert "ix_products_seller_status_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_product_images_use_product_sort_index(engine):
+    stmt = (
+        select(ProductImage.image_url)
+        .where(ProductImage.product_id == 1)
+        .order_by(ProductImage.sort_order.asc())
+    )
+    plan = _query_plan(engine, stmt)
+    assert "ix_product_images_product_sort" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_purchases_by_product_use_product_created_index(engine):
+    stmt = (
+        select(Purchase.id)
+        .where(Purchase.product_id == 1)
+        .order_by(Purchase.created_at.desc())
+        .limit(1)
+    )
+    plan = _query_plan(engine, stmt)
+    assert "ix_purchases_product_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_product_views_by_product_use_index(engine):
+    stmt = select(ProductView.id).where(ProductView.product_id == 1)
+    plan = _query_plan(engine, stmt)
+    assert "ix_product_views_product_id" in plan
+
+
+def test_follow_feed_reads_timeline_index(engine):
+    stmt = (
+        select(Product.id)
+        .join(FollowTimelineEntry, FollowTimelineEntry.product_id == Product.id)
+        .where(FollowTimelineEntry.owner_user_id == 1, Product.status == 1)
+        .order_by(FollowTimelineEntry.created_at.desc(), FollowTimelineEntry.product_id.desc())
+        .limit(8)
+    )
+    plan = _query_plan(engine, stmt)
+    assert "ix_follow_timeline_owner_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_follow_list_pages_use_created_indexes(engine):
+    followers = (
+        select(ForumFollow.id)
+        .where(ForumFollow.followee_email == "a@example.com")
+        .order_by(ForumFollow.created_at.desc(), ForumFollow.id.desc())
+        .limit(51)
+    )
+    plan = _query_plan(engine, followers)
+    assert "ix_forum_follows_followee_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+    blocks = (
+        select(UserBlock.id)
+        .where(UserBlock.blocker_email == "a@example.com")
+        .order_by(UserBlock.created_at.desc(), UserBlock.id.desc())
+        .limit(51)
+    )
+    plan = _query_plan(engine, blocks)
+    assert "ix_user_blocks_blocker_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_notification_inbox_uses_user_id_indexes(engine):
+    inbox = (
+        select(Notification.id)
+        .where(Notification.user_id == 1)
+        .order_by(Notification.created_at.desc(), Notification.id.desc())
+        .limit(31)
+    )
+    plan = _query_plan(engine, inbox)
+    assert "ix_notifications_user_id_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+    by_type = inbox.where(Notification.notification_type == "like")
+    plan = _query_plan(engine, by_type)
+    assert "ix_notifications_user_id_type_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_notification_inbox_fallback_reads_both_indexes(engine):
+    # バックフィル中は ID 未設定の行をメール列の索引で拾う
+    stmt = (
+        select(Notification.id)
+        .where(db.or_(
+            Notification.user_id == 1,
+            db.and_(Notification.user_id.is_(None), Notification.user_email == "a@example.com")
+        ))
+        .order_by(Notification.created_at.desc(), Notification.id.desc())
+        .limit(31)
+    )
+    plan = _query_plan(engine, stmt)
+    assert "MULTI-INDEX OR" in plan
+    assert "(user_id=?)" in plan
+    assert "(user_email=?)" in plan
+
+
+def test_social_graph_load_uses_user_id_indexes(engine):
+    following = select(ForumFollow.followee_email).where(ForumFollow.follower_user_id == 1)
+    assert "ix_forum_follows_follower_followee_user" in _query_plan(engine, following)
+
+    blocks = (
+        select(UserBlock.blocker_email, UserBlock.blocked_email)
+        .where(db.or_(UserBlock.blocker_user_id == 1, UserBlock.blocked_user_id == 1))
+    )
+    plan = _query_plan(engine, blocks)
+    assert "ix_user_blocks_blocker_blocked_user" in plan
+    assert "ix_user_blocks_blocked_blocker_user" in plan
+
+
+def test_chat_conversation_on_busy_listing_uses_user_id_indexes():
+    # 問い合わせの多い商品では、商品IDの索引より送受信者IDの索引の方が絞り込める
+    engine = create_engine("sqlite://")
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(ProductChatMessage.__table__), [
+            {
+                "product_id": 1,
+                "sender_email": f"buyer{i % 50}@example.com",
+                "receiver_email": "seller@example.com",
+                "sender_user_id": i % 50 + 2,
+                "receiver_user_id": 1,
+                "message": "m",
+            }
+            for i in range(500)
+        ])
+        conn.exec_driver_sql("ANALYZE")
+
+    stmt = (
+        select(ProductChatMessage.id)
+        .where(
+            ProductChatMessage.product_id == 1,
+            db.or_(
+                db.and_(ProductChatMessage.sender_user_id == 1, ProductChatMessage.receiver_user_id == 3),
+                db.and_(ProductChatMessage.sender_user_id == 3, ProductChatMessage.receiver_user_id == 1)
+            )
+        )
+        .order_by(ProductChatMessage.created_at.asc(), ProductChatMessage.id.asc())
+    )
+    plan = _query_plan(engine, stmt)
+    engine.dispose()
+    assert "ix_product_chat_messages_sender_user_product" in plan
@@ -0,0 +1,98 @@
+import pytest
+
+
+@pytest.fixture
+def seller(make_user):
+    return make_user("seller")
+
+
+@pytest.fixture
+def completed_purchase(ctx, seller, make_user):
+    def _completed_purchase(buyer_name):
+        buyer = make_user(buyer_name)
+        product = ctx.Product(title="book", price=800, seller_id=seller.id, status=0)
+        ctx.db.session.add(product)
+        ctx.db.session.flush()
+        purchase = ctx.Purchase(
+            product_id=product.id,
+            seller_id=seller.id,
+            buyer_email=buyer.email,
+            amount=800,
+            stripe_session_id=f"cs_{buyer_name}",
+            status="completed"
+        )
+        ctx.db.session.add(purchase)
+        ctx.db.session.commit()
+        return purchase, buyer
+    return _completed_purchase
+
+
+def _review(client, purchase, reviewer, rating, comment=""):
+    return client.post(
+        f"/api/purchases/{purchase.id}/reviews",
+        json={"reviewer_email": reviewer.email, "rating": rating, "comment": comment}
+    )
+
+
+def test_profile_rating_reflects_submitted_reviews(client, ctx, seller, completed_purchase):
+    for index, rating in enumerate([5, 4, 3, 5, 4, 2]):
+        purchase, buyer = completed_purchase(f"buyer{index}")
+        assert _review(client, purchase, buyer, rating, comment=f"comment {index}").status_code in (200, 201)
+
+    rating = client.get(f"/api/profile/{seller.email}").get_json()["rating"]
+
+    assert rating["count"] == 6
+    assert rating["average"] == round(23 / 6, 2)
+    assert [item["comment"] for item in rating["reviews"]] == [f"comment {i}" for i in (5, 4, 3, 2, 1)]
+    assert rating["reviews"][0]["reviewer_name"]
+
+
+def test_reviews_without_comment_count_but_are_not_listed(client, ctx, seller, completed_purchase):
+    purchase, buyer = completed_purchase("buyer")
+    _review(client, purchase, buyer, 4, comment="   ")
+
+    ctx.db.session.expire_all()
+    summary = ctx._build_user_rating_summary(seller.email)
+    assert (summary["count"], summary["average"], summary["reviews"]) == (1, 4.0, [])
+
+
+def test_duplicate_review_does_not_change_the_summary(client, ctx, seller, completed_purchase):
+    purchase, buyer = completed_purchase("buyer")
+    assert _review(client, purchase, buyer, 5, comment="great").status_code in (200, 201)
+    assert _review(client, purchase, buyer, 1, comment="again").status_code == 409
+
+    ctx.db.session.expire_all()
+    user = ctx.db.session.get(ctx.User, seller.id)
+    assert (user.rating_count, user.rating_sum) == (1, 5)
+
+
+def test_backfill_rebuilds_summaries_from_reviews(client, ctx, seller, completed_purchase):
+    for index, rating in enumerate([5, 2]):
+        purchase, buyer = completed_purchase(f"buyer{index}")
+        _review(client, purchase, buyer, rating, comment=f"comment {index}")
+    expected = ctx._build_user_rating_summary(seller.email)
+
+    ctx.db.session.execute(ctx.User.__table__.update().values(rating_count=0, rating_sum=0, recent_reviews_json=None))
+    ctx.db.session.commit()
+    ctx._backfill_user_rating_summaries()
+
+    ctx.db.session.expire_all()
+    assert ctx._build_user_rating_summary(seller.email) == expected
+
+
+def test_summary_for_email_without_user_row_is_aggregated_from_reviews(client, ctx, seller, completed_purchase):
+    for index, (rating, comment) in enumerate([(5, "great"), (2, "")]):
+        purchase, buyer = completed_purchase(f"buyer{index}")
+        ctx.db.session.add(ctx.PurchaseReview(
+            purchase_id=purchase.id,
+            reviewer_email=buyer.email,
+            reviewee_email="gone@example.com",
+            rating=rating,
+            comment=comment
+        ))
+    ctx.db.session.commit()
+
+    summary = ctx._build_user_rating_summary("Gone@Example.com")
+
+    assert (summary["count"], summary["average"]) == (2, 3.5)
+    assert [item["comment"] for item in summary["reviews"]] == ["great"]
@@ -0,0 +1,100 @@
+import pytest
+
+
+@pytest.fixture
+def catalog(ctx, make_user):
+    seller = make_user("seller")
+    rows = [
+        ("吾輩は猫である", "夏目漱石の長編小説", "文学"),
+        ("こころ", "吾輩は猫であるの作者による作品", "文学"),
+        ("線形代数入門", "行列と固有値", "数学"),
+        ("出品取り消し 吾輩は猫である", "", "文学"),
+    ]
+    products = []
+    for index, (title, description, category) in enumerate(rows):
+        product = ctx.Product(
+            title=title,
+            description=description,
+            category=category,
+            price=500 + index,
+            seller_id=seller.id,
+            status=2 if title.startswith("出品取り消し") else 1
+        )
+        ctx.db.session.add(product)
+        products.append(product)
+    ctx.db.session.commit()
+    return products
+
+
+def _search_titles(client, keyword, **params):
+    res = client.get("/api/products", query_string={"q": keyword, **params})
+    assert res.status_code == 200
+    body = res.get_json()
+    assert "error" not in body, body
+    return [product["title"] for product in body["products"]]
+
+
+def test_fts_search_ranks_title_hits_first_and_skips_cancelled(client, ctx, catalog):
+    assert _search_titles(client, "吾輩は猫") == ["吾輩は猫である", "こころ"]
+    assert ctx._SEARCH_BACKEND == "fts5"
+
+
+def test_index_follows_product_updates(client, ctx, catalog):
+    assert _search_titles(client, "固有値") == ["線形代数入門"]
+
+    product = catalog[2]
+    product.description = "ベクトル空間"
+    ctx._sync_product_search_index(product)
+    ctx.db.session.commit()
+    assert _search_titles(client, "固有値") == []
+    assert _search_titles(client, "ベクトル") == ["線形代数入門"]
+
+    product.status = 2
+    ctx._sync_product_search_index(product)
+    ctx.db.session.commit()
+    assert _search_titles(client, "ベクトル") == []
+
+
+def test_single_character_keyword_falls_back_to_like(client, ctx, catalog):
+    assert ctx._search_query_terms("猫") is None
+    assert sorted(_search_titles(client, "猫")) == ["こころ", "吾輩は猫である"]
+
+
+def test_terms_backend_matches_fts_results(client, ctx, catalog, monkeypatch):
+    monkeypatch.setattr(ctx, "_SEARCH_BACKEND", "terms")
+    assert ctx._rebuild_product_search_index() == 3
+
+    assert _search_titles(client, "吾輩は猫") == ["吾輩は猫である", "こころ"]
+    assert _search_titles(client, "存在しない語") == []
+
+
+def test_seeded_products_are_searchable(client, make_user):
+    make_user("seller")
+
+    assert client.post("/api/seed-products").status_code == 201
+
+    assert _search_titles(client, "ノルウェイ") == ["村上春樹 ノルウェイの森"]
+
+
+def test_index_drift_is_rebuilt_on_startup(client, ctx, catalog):
+    assert _search_titles(client, "固有値") == ["線形代数入門"]
+
+    # 索引を通さずに追加された商品（旧プロセスの書き込みなど）
+    ctx.db.session.add(ctx.Product(title="統計学入門", price=900, seller_id=catalog[0].seller_id, status=1))
+    ctx.db.session.commit()
+    ctx._SEARCH_BACKEND = None
+
+    assert _search_titles(client, "統計学") == ["統計学入門"]
+
+
+def test_index_setup_failure_is_reported_as_json(client, ctx, make_user, monkeypatch):
+    seller = make_user("seller")
+
+    def broken():
+        raise RuntimeError("index unavailable")
+
+    monkeypatch.setattr(ctx, "_ensure_search_index_once", broken)
+    res = client.post("/api/products", json={"title": "本", "price": 500, "seller_id": seller.id, "condition": "no_visible_damage"})
+
+    assert res.status_code == 500
+    assert "error" in res.get_json()
@@ -0,0 +1,95 @@
+def _new_request(ctx):
+    # テストではアプリコンテキストを共有するので、リクエスト単位の版数キャッシュを手で捨てる
+    ctx.g.pop('_social_graph_versions', None)
+
+
+def _count_loads(ctx, monkeypatch):
+    loads = []
+    original = ctx._load_social_graph_entry
+
+    def counting(email):
+        loads.append(email)
+        return original(email)
+
+    monkeypatch.setattr(ctx, "_load_social_graph_entry", counting)
+    return loads
+
+
+def test_write_in_another_process_invalidates_only_touched_users(ctx, make_user, monkeypatch):
+    alice, bob, carol = make_user("alice"), make_user("bob"), make_user("carol")
+    loads = _count_loads(ctx, monkeypatch)
+
+    assert ctx._get_block_relation(alice.email, bob.email)["is_blocked"] is False
+    assert ctx._get_blocked_email_set(carol.email) == set()
+    assert loads == [alice.email, carol.email]
+
+    # 別プロセスのブロック: 行の追加と当事者の版数更新だけが DB に残り、このプロセスのキャッシュは残ったまま
+    ctx.db.session.add(ctx.UserBlock(blocker_email=bob.email, blocked_email=alice.email))
+    versions = ctx.SocialGraphVersion.__table__
+    for email in (alice.email, bob.email):
+        ctx._insert_ignore(versions, {"user_email": email, "version": 0}, ['user_email'])
+        ctx.db.session.execute(versions.update().where(versions.c.user_email == email).values(version=versions.c.version + 1))
+    ctx.db.session.commit()
+
+    _new_request(ctx)
+    relation = ctx._get_block_relation(alice.email, bob.email)
+    assert relation["blocked_by_b"] is True
+    assert ctx._get_blocked_email_set(carol.email) == set()
+    assert loads == [alice.email, carol.email, alice.email]
+
+
+def test_follow_and_block_endpoints_refresh_cache(client, ctx, make_user):
+    alice, bob = make_user("alice"), make_user("bob")
+    assert ctx._is_following(alice.email, bob.email) is False
+
+    client.post('/api/follow', json={"follower_email": alice.email, "followee_email": bob.email})
+    assert ctx._is_following(alice.email, bob.email) is True
+
+    client.post('/api/block', json={"blocker_email": bob.email, "blocked_email": alice.email})
+    assert ctx._is_following(alice.email, bob.email) is False
+    assert ctx._get_block_relation(alice.email, bob.email)["blocked_by_b"] is True
+
+    client.post('/api/unblock', json={"blocker_email": bob.email, "blocked_email": alice.email})
+    assert ctx._get_block_relation(alice.email, bob.email)["is_blocked"] is False
+
+
+def test_bump_creates_missing_version_rows_without_conflict(ctx):
+    ctx._bump_social_graph_versions("new@example.com", "NEW@example.com ")
+    ctx._bump_social_graph_versions("new@example.com")
+    ctx.db.session.commit()
+
+    row = ctx.db.session.get(ctx.SocialGraphVersion, "new@example.com")
+    assert row.version == 2
+
+
+def test_seed_migration_creates_version_rows_for_existing_users(ctx, make_user):
+    make_user("alice")
+    ctx._bump_social_graph_versions("bob@example.com")
+    ctx.db.session.commit()
+
+    assert ctx._seed_social_graph_versions() == 1
+    assert ctx.db.session.get(ctx.SocialGraphVersion, "alice@example.com").version == 0
+    assert ctx.db.session.get(ctx.SocialGraphVersion, "bob@example.com").version == 1
+
+
+def test_follow_list_block_flags_match_per_row_relations(client, ctx, make_user):
+    viewer = make_user("viewer")
+    others = [make_user(f"user{i}") for i in range(4)]
+    for other in others:
+        assert client.post("/api/follow", json={"follower_email": viewer.email, "followee_email": other.email}).status_code in (200, 201)
+    # 片方向ずつのブロックを混ぜる（ブロックでフォローは外れるので一覧に残る相手だけを見る）
+    ctx.db.session.add(ctx.UserBlock(blocker_email=viewer.email, blocked_email=others[1].email))
+    ctx.db.session.add(ctx.UserBlock(blocker_email=others[2].email, blocked_email=viewer.email))
+    ctx._bump_social_graph_versions(viewer.email, others[1].email, others[2].email)
+    ctx.db.session.commit()
+    _new_request(ctx)
+
+    users = client.get("/api/follow/list", query_string={"email": viewer.email, "type": "following"}).get_json()["users"]
+
+    assert len(users) == 4
+    for item in users:
+        relation = ctx._get_block_relation(viewer.email, item["email"])
+        assert (item["blocked_by_me"], item["blocked_me"], item["is_blocked"]) == (
+            relation["blocked_by_a"], relation["blocked_by_b"], relation["is_blocked"]
+        )
+    assert {item["email"] for item in users if item["is_blocked"]} == {others[1].email, others[2].email}
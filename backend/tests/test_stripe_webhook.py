@@ -0,0 +1,120 @@
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+WEBHOOK_SECRET = "whsec_test"
+
+
+@pytest.fixture
+def webhook(client, ctx, monkeypatch):
+    monkeypatch.setattr(ctx, "STRIPE_WEBHOOK_SECRET", WEBHOOK_SECRET)
+
+    def _post(event):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        return client.post(
+            "/api/stripe/webhook",
+            data=payload,
+            headers={"Stripe-Signature": f"t={timestamp},v1={signature}"},
+            content_type="application/json"
+        )
+    return _post
+
+
+def _checkout_event(event_id, product, session_id="cs_test_1"):
+    return {
+        "id": event_id,
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": {
+            "id": session_id,
+            "object": "checkout.session",
+            "amount_total": product.price,
+            "currency": "jpy",
+            "customer_email": "buyer@example.com",
+            "payment_status": "paid",
+            "metadata": {"product_id": str(product.id)}
+        }}
+    }
+
+
+@pytest.fixture
+def product(ctx, make_user):
+    seller = make_user("seller")
+    product = ctx.Product(title="book", price=1200, seller_id=seller.id, status=1)
+    ctx.db.session.add(product)
+    ctx.db.session.commit()
+    return product
+
+
+def test_redelivered_event_is_stored_and_processed_once(ctx, webhook, product, drain_jobs, monkeypatch):
+    calls = []
+    original = ctx.STRIPE_EVENT_HANDLERS["checkout.session.completed"]
+    monkeypatch.setitem(ctx.STRIPE_EVENT_HANDLERS, "checkout.session.completed", lambda session: (calls.append(session["id"]), original(session)))
+    event = _checkout_event("evt_1", product)
+
+    assert webhook(event).status_code == 200
+    assert webhook(event).status_code == 200
+    assert ctx.StripeEvent.query.count() == 1
+    assert ctx.BackgroundJob.query.filter_by(job_type="process_stripe_event").count() == 1
+
+    drain_jobs()
+    assert webhook(event).status_code == 200
+    drain_jobs()
+
+    ctx.db.session.expire_all()
+    assert calls == ["cs_test_1"]
+    assert ctx.db.session.get(ctx.StripeEvent, "evt_1").status == "processed"
+    assert ctx.Purchase.query.count() == 1
+    assert ctx.db.session.get(ctx.Product, product.id).status == 0
+
+
+def test_distinct_events_for_the_same_session_create_one_purchase(ctx, webhook, product, drain_jobs):
+    assert webhook(_checkout_event("evt_1", product)).status_code == 200
+    assert webhook(_checkout_event("evt_2", product)).status_code == 200
+
+    drain_jobs()
+
+    assert ctx.StripeEvent.query.filter_by(status="processed").count() == 2
+    assert ctx.Purchase.query.filter_by(stripe_session_id="cs_test_1").count() == 1
+
+
+def test_unhandled_event_types_are_ignored(ctx, webhook, drain_jobs):
+    assert webhook({"id": "evt_3", "object": "event", "type": "charge.refunded", "data": {"object": {}}}).status_code == 200
+
+    drain_jobs()
+
+    assert ctx.db.session.get(ctx.StripeEvent, "evt_3").status == "ignored"
+
+
+def test_failed_processing_is_recorded_and_retried(ctx, webhook, product, monkeypatch):
+    def broken(session):
+        raise RuntimeError("db down")
+
+    monkeypatch.setitem(ctx.STRIPE_EVENT_HANDLERS, "checkout.session.completed", broken)
+    webhook(_checkout_event("evt_1", product))
+    job_id = ctx._claim_next_job("worker-a")
+    ctx._run_job(job_id, "worker-a")
+
+    ctx.db.session.expire_all()
+    stripe_event = ctx.db.session.get(ctx.StripeEvent, "evt_1")
+    assert stripe_event.status == "failed"
+    assert stripe_event.attempts == 1
+    assert "db down" in stripe_event.last_error
+    assert ctx.db.session.get(ctx.BackgroundJob, job_id).status == "pending"
+
+    monkeypatch.undo()
+    assert ctx._process_stripe_event("evt_1") == "processed"
+    assert ctx.Purchase.query.count() == 1
+
+
+def test_bad_signature_is_rejected(client, ctx, monkeypatch):
+    monkeypatch.setattr(ctx, "STRIPE_WEBHOOK_SECRET", WEBHOOK_SECRET)
+    res = client.post("/api/stripe/webhook", data="{}", headers={"Stripe-Signature": "t=1,v1=bad"})
+
+    assert res.status_code == 400
+    assert ctx.StripeEvent.query.count() == 0
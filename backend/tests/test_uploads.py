@@ -0,0 +1,217 @@
+import errno
+import hashlib
+import io
+import os
+import time
+from datetime import datetime
+
+
+def _png_bytes(size=(1200, 900)):
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 80, 40)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_backfill_product_cards_enqueues_missing_thumbnails(ctx, make_user, drain_jobs):
+    seller = make_user("seller")
+    path = os.path.join(ctx.app.config['UPLOAD_FOLDER'], "products", "cover.png")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(_png_bytes())
+    product = ctx.Product(title="book", price=500, seller_id=seller.id, status=1)
+    ctx.db.session.add(product)
+    ctx.db.session.flush()
+    ctx.db.session.add(ctx.ProductImage(product_id=product.id, image_url="uploads/products/cover.png", sort_order=0))
+    ctx.db.session.commit()
+
+    result = ctx.app.test_cli_runner().invoke(args=["backfill-product-cards"])
+    assert result.exit_code == 0, result.output
+    assert ctx.db.session.get(ctx.Product, product.id).thumbnail_url is None
+    assert ctx.BackgroundJob.query.filter_by(job_type="generate_image_variants").count() == 1
+
+    drain_jobs()
+
+    ctx.db.session.expire_all()
+    assert ctx.db.session.get(ctx.Product, product.id).thumbnail_url == "uploads/thumbs/products/cover_w640.webp"
+
+
+def test_profile_payload_exposes_thumbnail_after_variants_are_generated(client, ctx, make_user, drain_jobs):
+    user = make_user("reader")
+    res = client.post(
+        f"/api/profile/{user.email}/image",
+        data={"image": (io.BytesIO(_png_bytes()), "me.png")},
+        content_type="multipart/form-data"
+    )
+    assert res.status_code == 200, res.get_json()
+    assert client.get(f"/api/profile/{user.email}").get_json()["profile_thumbnail_url"] is None
+
+    drain_jobs()
+
+    body = client.get(f"/api/profile/{user.email}").get_json()
+    assert body["profile_thumbnail_url"] == ctx._image_variant_path(body["profile_image"], 320, "webp")
+    assert os.path.isfile(ctx._upload_absolute_path(body["profile_thumbnail_url"]))
+
+
+def _upload_profile(client, user, content, filename="me.png"):
+    res = client.post(
+        f"/api/profile/{user.email}/image",
+        data={"image": (io.BytesIO(content), filename)},
+        content_type="multipart/form-data"
+    )
+    assert res.status_code == 200, res.get_json()
+    return res.get_json()["profile_image"]
+
+
+def test_identical_uploads_share_one_content_addressed_file(client, ctx, make_user):
+    content = _png_bytes((40, 40))
+    first = _upload_profile(client, make_user("alice"), content)
+    second = _upload_profile(client, make_user("bob"), content, filename="copy.PNG")
+
+    assert first == second == f"uploads/profiles/{hashlib.sha256(content).hexdigest()}.png"
+    stored = [name for name in os.listdir(os.path.join(ctx.app.config['UPLOAD_FOLDER'], "profiles"))]
+    assert stored == [os.path.basename(first)]
+
+
+def test_shared_upload_is_removed_only_after_the_last_reference(client, ctx, make_user, monkeypatch):
+    monkeypatch.setattr(ctx, "UPLOAD_DELETE_GRACE_SECONDS", 0)
+    alice, bob = make_user("alice"), make_user("bob")
+    shared = _upload_profile(client, alice, _png_bytes((40, 40)))
+    _upload_profile(client, bob, _png_bytes((40, 40)))
+    absolute = ctx._upload_absolute_path(shared)
+
+    _upload_profile(client, alice, _png_bytes((50, 50)))
+    ctx._remove_upload_file_if_exists(shared)
+    assert os.path.isfile(absolute)
+
+    _upload_profile(client, bob, _png_bytes((60, 60)))
+    ctx._remove_upload_file_if_exists(shared)
+    assert not os.path.isfile(absolute)
+
+
+def test_recently_reuploaded_file_is_not_removed_within_grace(client, ctx, make_user):
+    user = make_user("alice")
+    path = _upload_profile(client, user, _png_bytes((40, 40)))
+    user.profile_image = None
+    ctx.db.session.commit()
+
+    ctx._remove_upload_file_if_exists(path)
+
+    assert os.path.isfile(ctx._upload_absolute_path(path))
+    retry = ctx.BackgroundJob.query.filter_by(job_type="remove_upload_file").order_by(ctx.BackgroundJob.id.desc()).first()
+    assert retry.run_at > datetime.utcnow()
+
+
+def test_content_addressed_upload_is_served_immutable_with_hash_etag(client, ctx, make_user):
+    content = _png_bytes((40, 40))
+    path = _upload_profile(client, make_user("alice"), content)
+    digest = hashlib.sha256(content).hexdigest()
+
+    res = client.get(f"/{path}")
+    assert res.status_code == 200
+    assert res.data == content
+    assert res.headers["ETag"] == f'"{digest}"'
+    assert res.headers["Cache-Control"] == f"public, max-age={ctx.UPLOAD_CACHE_MAX_AGE}, immutable"
+
+    assert client.get(f"/{path}", headers={"If-None-Match": f'"{digest}"'}).status_code == 304
+    partial = client.get(f"/{path}", headers={"Range": "bytes=0-9"})
+    assert partial.status_code == 206
+    assert partial.data == content[:10]
+
+
+def test_thumbnails_are_revalidated_after_forced_regeneration(client, ctx, make_user, drain_jobs):
+    path = _upload_profile(client, make_user("alice"), _png_bytes((800, 600)))
+    drain_jobs()
+    thumbnail = ctx._image_variant_path(path, 320, "webp")
+
+    first = client.get(f"/{thumbnail}")
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == f"public, max-age={ctx.THUMBNAIL_CACHE_MAX_AGE}"
+    etag = first.headers["ETag"]
+
+    absolute = ctx._upload_absolute_path(thumbnail)
+    old = time.time() - 3600
+    os.utime(absolute, (old, old))
+    result = ctx.app.test_cli_runner().invoke(args=["generate-thumbnails", "--force"])
+    assert result.exit_code == 0, result.output
+
+    # 同じ URL のまま作り直されても、保存済みの ETag では 304 にならない
+    assert client.get(f"/{thumbnail}", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_x_accel_mode_hands_the_file_to_the_proxy(client, ctx, make_user, monkeypatch):
+    monkeypatch.setattr(ctx, "UPLOAD_SERVE_MODE", "x-accel")
+    path = _upload_profile(client, make_user("alice"), _png_bytes((40, 40)))
+
+    res = client.get(f"/{path}")
+
+    assert res.status_code == 200
+    assert res.data == b""
+    assert res.headers["X-Accel-Redirect"] == ctx.UPLOAD_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + path[len("uploads/"):]
+    assert res.headers["Content-Type"] == "image/png"
+
+
+def test_serving_rejects_missing_and_traversal_paths(client):
+    assert client.get("/uploads/profiles/missing.png").status_code == 404
+    assert client.get("/uploads/../app.py").status_code == 404
+
+
+def _write_orphan(ctx, name, content=b"x"):
+    path = os.path.join(ctx.app.config['UPLOAD_FOLDER'], name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(content)
+    old = time.time() - 7 * 24 * 3600
+    os.utime(path, (old, old))
+    return path
+
+
+def test_gc_quarantine_survives_cross_device_moves(ctx, tmp_path, monkeypatch):
+    orphan = _write_orphan(ctx, "products/orphan.png")
+    real_rename = os.rename
+
+    def cross_device_rename(src, dst, *args, **kwargs):
+        if src == orphan:
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        return real_rename(src, dst, *args, **kwargs)
+
+    monkeypatch.setattr(os, "rename", cross_device_rename)
+    result = ctx.app.test_cli_runner().invoke(args=["gc-uploads", "--quarantine-dir", str(tmp_path / "quarantine")])
+
+    assert result.exit_code == 0, result.output
+    assert not os.path.exists(orphan)
+    moved = [os.path.join(root, name) for root, _dirs, names in os.walk(tmp_path / "quarantine") for name in names]
+    assert [os.path.basename(path) for path in moved] == ["orphan.png"]
+
+
+def test_gc_reports_per_file_errors_and_continues(ctx, tmp_path, monkeypatch):
+    first = _write_orphan(ctx, "products/a.png")
+    second = _write_orphan(ctx, "products/b.png")
+    real_move = ctx.shutil.move
+
+    def flaky_move(src, dst):
+        if src == first:
+            raise PermissionError(errno.EACCES, "Permission denied")
+        return real_move(src, dst)
+
+    monkeypatch.setattr(ctx.shutil, "move", flaky_move)
+    result = ctx.app.test_cli_runner().invoke(args=["gc-uploads", "--quarantine-dir", str(tmp_path / "quarantine")])
+
+    assert result.exit_code != 0
+    assert "failed: uploads/products/a.png" in result.output
+    assert "quarantined orphan uploads: 1" in result.output
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+
+
+def test_gc_keeps_referenced_uploads(ctx, make_user):
+    kept = _write_orphan(ctx, "profiles/kept.png")
+    make_user("owner", profile_image="uploads/profiles/kept.png")
+    orphan = _write_orphan(ctx, "profiles/orphan.png")
+
+    result = ctx.app.test_cli_runner().invoke(args=["gc-uploads"])
+
+    assert result.exit_code == 0, result.output
+    assert os.path.exists(kept)
+    assert not os.path.exists(orphan)
@@ -0,0 +1,64 @@
+from sqlalchemy import event
+
+
+def _count_selects(ctx):
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(ctx.db.engine, "before_cursor_execute", _record)
+    return statements, lambda: event.remove(ctx.db.engine, "before_cursor_execute", _record)
+
+
+def test_lookups_are_memoized_within_a_request(ctx, make_user):
+    make_user("alice")
+    make_user("bob")
+
+    with ctx.app.test_request_context():
+        statements, stop = _count_selects(ctx)
+        try:
+            ctx._prime_users_by_email(["Alice@example.com", "bob@example.com", "nobody@example.com"])
+            primed = len(statements)
+            assert ctx._find_user_by_email("alice@example.com").user_id == "alice"
+            assert ctx._find_user_by_email("BOB@example.com").user_id == "bob"
+            assert ctx._find_user_by_email("nobody@example.com") is None
+        finally:
+            stop()
+        assert primed == 1
+        assert len(statements) == 1
+
+
+def test_cache_is_not_shared_across_requests(ctx, make_user):
+    make_user("alice")
+
+    # 本番と同じくリクエストごとに新しいアプリコンテキスト（= 新しい g）を積む
+    with ctx.app.app_context(), ctx.app.test_request_context():
+        assert ctx._find_user_by_email("carol@example.com") is None
+
+    make_user("carol")
+
+    with ctx.app.app_context(), ctx.app.test_request_context():
+        user = ctx._find_user_by_email("carol@example.com")
+        assert user is not None
+        assert user.user_id == "carol"
+
+
+def test_cache_is_not_shared_across_jobs(ctx, make_user, drain_jobs, monkeypatch):
+    found = []
+    monkeypatch.setitem(
+        ctx.BACKGROUND_JOB_HANDLERS,
+        "remove_upload_file",
+        lambda **payload: found.append(ctx._find_user_by_email(payload["email"]) is not None),
+    )
+
+    ctx._enqueue_job("remove_upload_file", {"email": "carol@example.com"})
+    ctx.db.session.commit()
+    drain_jobs()
+    make_user("carol")
+    ctx._enqueue_job("remove_upload_file", {"email": "carol@example.com"})
+    ctx.db.session.commit()
+    drain_jobs()
+
+    assert found == [False, True]
@@ -6,6 +6,7 @@ import bibliLogo from '../assets/bibli-logo.png';
 import notificationIcon from '../../../image/tuti.png';
 import notificationUnreadIcon from '../../../image/tuti2.png';
 import { fetchUserProfileByEmail, readCachedUserProfile } from '../utils/userProfile';
+import { isUserEventStreamSupported, subscribeUserEvents } from '../utils/eventStream';
 
 function Header() {
   const [user, setUser] = useState(null);
@@ -98,7 +99,7 @@ function Header() {
       }
 
       try {
-        const response = await fetch(`http://localhost:5000/api/notifications?email=${encodeURIComponent(user.email)}`);
+        const response = await fetch(`http://localhost:5000/api/notifications/unread-count?email=${encodeURIComponent(user.email)}`);
         if (!response.ok) {
           throw new Error('通知件数の取得に失敗しました');
         }
@@ -113,11 +114,14 @@ function Header() {
     };
 
     loadNotificationCount();
-    timerId = window.setInterval(loadNotificationCount, 30000);
+    // SSE で新着を受け取れる場合、定期取得は取りこぼし対策の低頻度にする
+    const unsubscribe = subscribeUserEvents(user?.email, 'notification', loadNotificationCount);
+    timerId = window.setInterval(loadNotificationCount, isUserEventStreamSupported() ? 300000 : 30000);
     window.addEventListener('focus', loadNotificationCount);
 
     return () => {
       active = false;
+      unsubscribe();
       if (timerId) {
         window.clearInterval(timerId);
       }
@@ -139,7 +143,7 @@ function Header() {
     navigate('/search');
   };
 
-  const headerProfileImageUrl = getImageUrl(userProfile?.profile_image || '');
+  const headerProfileImageUrl = getImageUrl(userProfile?.profile_thumbnail_url || userProfile?.profile_image || '');
   const headerUserName = (userProfile?.user_name || user?.displayName || 'ユーザー').trim();
   const profilePath = userProfile?.user_id ? `/profile/${userProfile.user_id}` : '/settings';
   const hasUnreadNotifications = unreadNotificationCount > 0;
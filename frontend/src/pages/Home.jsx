@@ -45,7 +45,7 @@ function Home() {
             <div className="book-card">
               <div className="book-image">
                 {product.image_url ? (
-                  <img src={getImageUrl(product.image_url)} alt={product.title} />
+                  <img src={getImageUrl(product.thumbnail_url || product.image_url)} alt={product.title} loading="lazy" />
                 ) : (
                   'NO IMAGE'
                 )}
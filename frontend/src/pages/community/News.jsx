@@ -48,6 +48,8 @@ function News() {
   const [notifications, setNotifications] = useState([]);
   const [notificationsLoading, setNotificationsLoading] = useState(false);
   const [unreadCount, setUnreadCount] = useState(0);
+  const [notificationsCursor, setNotificationsCursor] = useState(null);
+  const [notificationsLoadingMore, setNotificationsLoadingMore] = useState(false);
 
   useEffect(() => {
     const fetchNews = async () => {
@@ -84,6 +86,7 @@ function News() {
       if (!currentEmail) {
         setNotifications([]);
         setUnreadCount(0);
+        setNotificationsCursor(null);
         return;
       }
 
@@ -94,14 +97,17 @@ function News() {
         if (response.ok) {
           setNotifications(data.notifications || []);
           setUnreadCount(data.unread_count || 0);
+          setNotificationsCursor(data.has_more ? data.next_cursor : null);
         } else {
           setNotifications([]);
           setUnreadCount(0);
+          setNotificationsCursor(null);
         }
       } catch (err) {
         console.error('Notification fetch error:', err);
         setNotifications([]);
         setUnreadCount(0);
+        setNotificationsCursor(null);
       } finally {
         setNotificationsLoading(false);
       }
@@ -110,6 +116,31 @@ function News() {
     fetchNotifications();
   }, [currentEmail]);
 
+  const loadMoreNotifications = async () => {
+    if (!currentEmail || !notificationsCursor || notificationsLoadingMore) {
+      return;
+    }
+
+    setNotificationsLoadingMore(true);
+    try {
+      const params = new URLSearchParams({ email: currentEmail, cursor: notificationsCursor });
+      const response = await fetch(`http://localhost:5000/api/notifications?${params.toString()}`);
+      const data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.error || '通知の取得に失敗しました');
+      }
+      setNotifications((prev) => {
+        const knownIds = new Set(prev.map((item) => item.id));
+        return [...prev, ...(data.notifications || []).filter((item) => !knownIds.has(item.id))];
+      });
+      setNotificationsCursor(data.has_more ? data.next_cursor : null);
+    } catch (err) {
+      console.error('Notification load more error:', err);
+    } finally {
+      setNotificationsLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     const markAllRead = async () => {
       if (activeTab !== 'notifications' || !currentEmail || unreadCount === 0) {
@@ -252,6 +283,16 @@ function News() {
                       )}
                     </div>
                   ))}
+                  {notificationsCursor && (
+                    <button
+                      type="button"
+                      className="load-more-btn"
+                      onClick={loadMoreNotifications}
+                      disabled={notificationsLoadingMore}
+                    >
+                      {notificationsLoadingMore ? '読み込み中...' : 'さらに表示'}
+                    </button>
+                  )}
                 </div>
               )}
             </div>
@@ -4,6 +4,7 @@ import { auth } from '../../css/firebase';
 import { onAuthStateChanged } from 'firebase/auth';
 import Header from '../../components/Header';
 import Footer from '../../components/Footer';
+import { isUserEventStreamSupported, subscribeUserEvents } from '../../utils/eventStream';
 import '../../css/product_detail.css';
 
 function ProductDetail() {
@@ -49,6 +50,7 @@ function ProductDetail() {
   const chatThreadRef = useRef(null);
   const chatInputRef = useRef(null);
   const isFetchingChatRef = useRef(false);
+  const lastChatMessageRef = useRef({ id: 0, counterpart: '' });
   const [purchaseStatusData, setPurchaseStatusData] = useState(null);
   const [purchaseStatusLoading, setPurchaseStatusLoading] = useState(false);
   const [purchaseStatusError, setPurchaseStatusError] = useState('');
@@ -252,7 +254,7 @@ function ProductDetail() {
   };
 
   const loadChatMessages = async (counterpartEmail = '', options = {}) => {
-    const { silent = false } = options;
+    const { silent = false, incremental = false } = options;
     if (!currentUser?.email || !product?.id) {
       return;
     }
@@ -269,11 +271,19 @@ function ProductDetail() {
 
     try {
       const params = new URLSearchParams({ email: currentUser.email });
-      if (isOwnProduct) {
-        const target = counterpartEmail || selectedChatEmail;
-        if (target) {
-          params.append('with_user', target);
-        }
+      const isSellerView = isOwnProduct;
+      const target = isSellerView ? (counterpartEmail || selectedChatEmail) : '';
+      if (target) {
+        params.append('with_user', target);
+      }
+      // 差分取得: 前回の最終メッセージID以降だけを取得する
+      const lastChat = lastChatMessageRef.current;
+      const isIncremental = incremental
+        && lastChat.id > 0
+        && lastChat.counterpart === target
+        && (!isSellerView || Boolean(target));
+      if (isIncremental) {
+        params.append('after_id', lastChat.id);
       }
 
       const response = await fetch(`http://localhost:5000/api/products/${product.id}/chat/messages?${params.toString()}`);
@@ -283,9 +293,31 @@ function ProductDetail() {
         throw new Error(data.error || 'チャットの読み込みに失敗しました');
       }
 
+      if (isIncremental && !data.participants_changed) {
+        lastChatMessageRef.current = { id: data.last_message_id || lastChat.id, counterpart: target };
+        const newMessages = Array.isArray(data.messages) ? data.messages : [];
+        if (data.changed && newMessages.length > 0) {
+          setChatMessages((prev) => {
+            const knownIds = new Set(prev.map((item) => item.id));
+            return [...prev, ...newMessages.filter((item) => !knownIds.has(item.id))];
+          });
+        }
+        return;
+      }
+      if (isIncremental) {
+        // 他の相手から新着があった場合は参加者一覧ごと取り直す
+        lastChatMessageRef.current = { id: 0, counterpart: '' };
+        setTimeout(() => loadChatMessages(counterpartEmail, { silent: true }), 0);
+        return;
+      }
+
       setChatParticipants(Array.isArray(data.participants) ? data.participants : []);
       setChatMessages(Array.isArray(data.messages) ? data.messages : []);
       setChatScope(data.chat_scope || 'open');
+      lastChatMessageRef.current = {
+        id: data.last_message_id || 0,
+        counterpart: isSellerView ? (data.selected_counterpart_email || target) : ''
+      };
 
       if (isOwnProduct) {
         const resolved = data.selected_counterpart_email || '';
@@ -388,6 +420,13 @@ function ProductDetail() {
     }
 
     const chatPollingTarget = isOwnProduct ? selectedChatEmail : '';
+    // SSE で新着通知を受けたら差分だけ取得する。定期取得は切断時の保険
+    const unsubscribe = subscribeUserEvents(currentUser.email, 'chat_message', (payload) => {
+      if (payload.product_id !== product.id || isChatSending) {
+        return;
+      }
+      loadChatMessages(chatPollingTarget, { silent: true, incremental: true });
+    });
     const timer = setInterval(() => {
       if (isChatSending) {
         return;
@@ -395,10 +434,13 @@ function ProductDetail() {
       if (document.activeElement === chatInputRef.current) {
         return;
       }
-      loadChatMessages(chatPollingTarget, { silent: true });
-    }, 10000);
+      loadChatMessages(chatPollingTarget, { silent: true, incremental: true });
+    }, isUserEventStreamSupported() ? 60000 : 10000);
 
-    return () => clearInterval(timer);
+    return () => {
+      unsubscribe();
+      clearInterval(timer);
+    };
   }, [isChatOpen, currentUser, product, isOwnProduct, selectedChatEmail, isChatSending]);
   const handlePurchaseClick = () => {
     if (!currentUser) {
@@ -900,7 +942,7 @@ function ProductDetail() {
                   <Link to={`/profile/${product.seller.user_id}`} className="seller-profile">
                     <div className="seller-avatar">
                       {product.seller.profile_image ? (
-                        <img src={getImageUrl(product.seller.profile_image)} alt={product.seller.user_name} />
+                        <img src={getImageUrl(product.seller.profile_thumbnail_url || product.seller.profile_image)} alt={product.seller.user_name} />
                       ) : (
                         'USER'
                       )}
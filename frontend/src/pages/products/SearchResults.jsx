@@ -24,7 +24,7 @@ function SearchResults() {
 
   const [filters, setFilters] = useState({
     keyword: searchParams.get('q') || '',
-    sort: searchParams.get('sort') || 'newest',
+    sort: searchParams.get('sort') || (searchParams.get('q') ? 'relevance' : 'newest'),
     includeSold: searchParams.get('include_sold') || '1',
     minPrice: searchParams.get('min_price') || '',
     maxPrice: searchParams.get('max_price') || '',
@@ -85,7 +85,7 @@ function SearchResults() {
     setFilters(prev => ({
       ...prev,
       keyword: searchParams.get('q') || '',
-      sort: searchParams.get('sort') || 'newest',
+      sort: searchParams.get('sort') || (searchParams.get('q') ? 'relevance' : 'newest'),
       includeSold: searchParams.get('include_sold') || '1',
       minPrice: searchParams.get('min_price') || '',
       maxPrice: searchParams.get('max_price') || '',
@@ -154,6 +154,7 @@ function SearchResults() {
                   value={filters.sort}
                   onChange={(e) => handleFilterChange('sort', e.target.value)}
                 >
+                  {filters.keyword && <option value="relevance">関連度順</option>}
                   <option value="price_asc">価格順（安い順）</option>
                   <option value="price_desc">価格順（高い順）</option>
                   <option value="popular">人気順</option>
@@ -228,13 +229,13 @@ function SearchResults() {
           <>
             <div className="book-grid" id="productsGrid">
               {products.map((product) => {
-                const imageSource = product.image_url || (Array.isArray(product.image_urls) ? product.image_urls[0] : '');
+                const imageSource = product.thumbnail_url || product.image_url || (Array.isArray(product.image_urls) ? product.image_urls[0] : '');
                 return (
                   <Link to={`/product-detail?id=${product.id}`} key={product.id} className="book-card-link">
                     <div className="book-card">
                       <div className="book-image">
                         {imageSource ? (
-                          <img src={getImageUrl(imageSource)} alt={product.title} />
+                          <img src={getImageUrl(imageSource)} alt={product.title} loading="lazy" />
                         ) : (
                           'NO IMAGE'
                         )}
@@ -4,6 +4,7 @@ import { onAuthStateChanged } from 'firebase/auth';
 import { auth } from '../../css/firebase';
 import Header from '../../components/Header';
 import Footer from '../../components/Footer';
+import { isUserEventStreamSupported, subscribeUserEvents } from '../../utils/eventStream';
 import '../../css/transaction.css';
 
 function Transaction() {
@@ -34,6 +35,7 @@ function Transaction() {
   const chatThreadRef = useRef(null);
   const chatInputRef = useRef(null);
   const isFetchingChatRef = useRef(false);
+  const lastChatMessageRef = useRef({ id: 0, counterpart: '' });
 
   const [reviewRating, setReviewRating] = useState('5');
   const [reviewComment, setReviewComment] = useState('');
@@ -157,7 +159,7 @@ function Transaction() {
   }, [productId, currentUser?.email]);
 
   const loadChatMessages = async (counterpartEmail = '', options = {}) => {
-    const { silent = false } = options;
+    const { silent = false, incremental = false } = options;
     if (!currentUser?.email || !productId || !isTransactionParty) {
       return;
     }
@@ -173,11 +175,19 @@ function Transaction() {
 
     try {
       const params = new URLSearchParams({ email: currentUser.email });
-      if (purchaseRole === 'seller') {
-        const target = counterpartEmail || selectedChatEmail;
-        if (target) {
-          params.append('with_user', target);
-        }
+      const isSellerView = purchaseRole === 'seller';
+      const target = isSellerView ? (counterpartEmail || selectedChatEmail) : '';
+      if (target) {
+        params.append('with_user', target);
+      }
+      // 差分取得: 前回の最終メッセージID以降だけを取得する
+      const lastChat = lastChatMessageRef.current;
+      const isIncremental = incremental
+        && lastChat.id > 0
+        && lastChat.counterpart === target
+        && (!isSellerView || Boolean(target));
+      if (isIncremental) {
+        params.append('after_id', lastChat.id);
       }
 
       const response = await fetch(`http://localhost:5000/api/products/${productId}/chat/messages?${params.toString()}`);
@@ -186,9 +196,31 @@ function Transaction() {
         throw new Error(data.error || 'チャットの読み込みに失敗しました');
       }
 
+      if (isIncremental && !data.participants_changed) {
+        lastChatMessageRef.current = { id: data.last_message_id || lastChat.id, counterpart: target };
+        const newMessages = Array.isArray(data.messages) ? data.messages : [];
+        if (data.changed && newMessages.length > 0) {
+          setChatMessages((prev) => {
+            const knownIds = new Set(prev.map((item) => item.id));
+            return [...prev, ...newMessages.filter((item) => !knownIds.has(item.id))];
+          });
+        }
+        return;
+      }
+      if (isIncremental) {
+        // 他の相手から新着があった場合は参加者一覧ごと取り直す
+        lastChatMessageRef.current = { id: 0, counterpart: '' };
+        setTimeout(() => loadChatMessages(counterpartEmail, { silent: true }), 0);
+        return;
+      }
+
       setChatParticipants(Array.isArray(data.participants) ? data.participants : []);
       setChatMessages(Array.isArray(data.messages) ? data.messages : []);
       setChatScope(data.chat_scope || 'open');
+      lastChatMessageRef.current = {
+        id: data.last_message_id || 0,
+        counterpart: isSellerView ? (data.selected_counterpart_email || target) : ''
+      };
 
       if (purchaseRole === 'seller') {
         const resolved = data.selected_counterpart_email || '';
@@ -224,14 +256,22 @@ function Transaction() {
       return;
     }
 
+    const target = purchaseRole === 'seller' ? selectedChatEmail : '';
+    // SSE で新着通知を受けたら差分だけ取得する。定期取得は切断時の保険
+    const unsubscribe = subscribeUserEvents(currentUser.email, 'chat_message', (payload) => {
+      if (String(payload.product_id) !== String(productId) || chatSending) return;
+      loadChatMessages(target, { silent: true, incremental: true });
+    });
     const timer = setInterval(() => {
       if (chatSending) return;
       if (document.activeElement === chatInputRef.current) return;
-      const target = purchaseRole === 'seller' ? selectedChatEmail : '';
-      loadChatMessages(target, { silent: true });
-    }, 10000);
+      loadChatMessages(target, { silent: true, incremental: true });
+    }, isUserEventStreamSupported() ? 60000 : 10000);
 
-    return () => clearInterval(timer);
+    return () => {
+      unsubscribe();
+      clearInterval(timer);
+    };
   }, [isTransactionParty, purchase?.id, currentUser?.email, purchaseRole, selectedChatEmail, chatSending]);
 
   useEffect(() => {
@@ -348,7 +348,7 @@ function ProfilePage() {
           <div className="profile-main">
             <div className="profile-avatar">
               {profile.profile_image ? (
-                <img src={getImageUrl(profile.profile_image)} alt="プロフィール" />
+                <img src={getImageUrl(profile.profile_thumbnail_url || profile.profile_image)} alt="プロフィール" />
               ) : (
                 'USER'
               )}
@@ -15,7 +15,9 @@ function Settings() {
   const [followingUsers, setFollowingUsers] = useState([]);
   const [followerUsers, setFollowerUsers] = useState([]);
   const [blockedUsers, setBlockedUsers] = useState([]);
+  const [followCursors, setFollowCursors] = useState({ following: null, followers: null, blocked: null });
   const [followLoading, setFollowLoading] = useState(false);
+  const [followLoadingMore, setFollowLoadingMore] = useState(false);
   const [followError, setFollowError] = useState('');
   const [actionTargetEmail, setActionTargetEmail] = useState('');
   const [notificationSettings, setNotificationSettings] = useState({
@@ -37,11 +39,20 @@ function Settings() {
     return `http://localhost:5000/${trimmed}`;
   };
 
+  const followListUrl = (mode, email, cursor = '') => {
+    const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+    if (mode === 'blocked') {
+      return `http://localhost:5000/api/block/list?email=${encodeURIComponent(email)}${cursorParam}`;
+    }
+    return `http://localhost:5000/api/follow/list?email=${encodeURIComponent(email)}&type=${mode}${cursorParam}`;
+  };
+
   const fetchFollowRelatedLists = async (email) => {
     if (!email) {
       setFollowingUsers([]);
       setFollowerUsers([]);
       setBlockedUsers([]);
+      setFollowCursors({ following: null, followers: null, blocked: null });
       return;
     }
 
@@ -49,9 +60,9 @@ function Settings() {
     setFollowError('');
     try {
       const [followingRes, followersRes, blockedRes] = await Promise.all([
-        fetch(`http://localhost:5000/api/follow/list?email=${encodeURIComponent(email)}&type=following`),
-        fetch(`http://localhost:5000/api/follow/list?email=${encodeURIComponent(email)}&type=followers`),
-        fetch(`http://localhost:5000/api/block/list?email=${encodeURIComponent(email)}`)
+        fetch(followListUrl('following', email)),
+        fetch(followListUrl('followers', email)),
+        fetch(followListUrl('blocked', email))
       ]);
 
       const [followingData, followersData, blockedData] = await Promise.all([
@@ -72,17 +83,51 @@ function Settings() {
       setFollowingUsers(followingData.users || []);
       setFollowerUsers(followersData.users || []);
       setBlockedUsers(blockedData.users || []);
+      setFollowCursors({
+        following: followingData.next_cursor || null,
+        followers: followersData.next_cursor || null,
+        blocked: blockedData.next_cursor || null
+      });
     } catch (err) {
       console.error('Follow list fetch error:', err);
       setFollowError(err.message || 'フォロー一覧の取得に失敗しました');
       setFollowingUsers([]);
       setFollowerUsers([]);
       setBlockedUsers([]);
+      setFollowCursors({ following: null, followers: null, blocked: null });
     } finally {
       setFollowLoading(false);
     }
   };
 
+  const loadMoreFollowList = async (mode) => {
+    const cursor = followCursors[mode];
+    if (!profile?.email || !cursor || followLoadingMore) return;
+
+    setFollowLoadingMore(true);
+    setFollowError('');
+    try {
+      const response = await fetch(followListUrl(mode, profile.email, cursor));
+      const data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.error || 'フォロー一覧の取得に失敗しました');
+      }
+      const appendUsers = (prev) => {
+        const known = new Set(prev.map((user) => user.email));
+        return [...prev, ...(data.users || []).filter((user) => !known.has(user.email))];
+      };
+      if (mode === 'following') setFollowingUsers(appendUsers);
+      if (mode === 'followers') setFollowerUsers(appendUsers);
+      if (mode === 'blocked') setBlockedUsers(appendUsers);
+      setFollowCursors((prev) => ({ ...prev, [mode]: data.next_cursor || null }));
+    } catch (err) {
+      console.error('Follow list load more error:', err);
+      setFollowError(err.message || 'フォロー一覧の取得に失敗しました');
+    } finally {
+      setFollowLoadingMore(false);
+    }
+  };
+
   const fetchNotificationSettings = async (email) => {
     if (!email) return;
     setNotificationError('');
@@ -390,21 +435,21 @@ function Settings() {
                   className={`follow-tab-btn ${activeFollowTab === 'following' ? 'active' : ''}`}
                   onClick={() => setActiveFollowTab('following')}
                 >
-                  フォロー中 ({followingUsers.length})
+                  フォロー中 ({followingUsers.length}{followCursors.following ? '+' : ''})
                 </button>
                 <button
                   type="button"
                   className={`follow-tab-btn ${activeFollowTab === 'followers' ? 'active' : ''}`}
                   onClick={() => setActiveFollowTab('followers')}
                 >
-                  フォロワー ({followerUsers.length})
+                  フォロワー ({followerUsers.length}{followCursors.followers ? '+' : ''})
                 </button>
                 <button
                   type="button"
                   className={`follow-tab-btn ${activeFollowTab === 'blocked' ? 'active' : ''}`}
                   onClick={() => setActiveFollowTab('blocked')}
                 >
-                  ブロック中 ({blockedUsers.length})
+                  ブロック中 ({blockedUsers.length}{followCursors.blocked ? '+' : ''})
                 </button>
               </div>
 
@@ -416,6 +461,16 @@ function Settings() {
                   {activeFollowTab === 'following' && renderUserRows(followingUsers, 'following')}
                   {activeFollowTab === 'followers' && renderUserRows(followerUsers, 'followers')}
                   {activeFollowTab === 'blocked' && renderUserRows(blockedUsers, 'blocked')}
+                  {followCursors[activeFollowTab] && (
+                    <button
+                      type="button"
+                      className="follow-load-more-btn"
+                      onClick={() => loadMoreFollowList(activeFollowTab)}
+                      disabled={followLoadingMore}
+                    >
+                      {followLoadingMore ? '読み込み中...' : 'もっと見る'}
+                    </button>
+                  )}
                 </div>
               )}
             </div>
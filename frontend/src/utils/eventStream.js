@@ -0,0 +1,39 @@
+import { apiUrl } from './apiBase';
+
+// 同じユーザーの購読は1本の EventSource を共有する
+const streams = new Map();
+
+export const isUserEventStreamSupported = () => typeof window !== 'undefined' && 'EventSource' in window;
+
+export const subscribeUserEvents = (email, eventType, listener) => {
+  if (!email || !isUserEventStreamSupported()) {
+    return () => {};
+  }
+
+  let stream = streams.get(email);
+  if (!stream) {
+    const source = new EventSource(apiUrl(`/api/events/stream?email=${encodeURIComponent(email)}`));
+    stream = { source, refCount: 0 };
+    streams.set(email, stream);
+  }
+
+  const handler = (event) => {
+    try {
+      listener(JSON.parse(event.data));
+    } catch (err) {
+      console.error('User event parse error:', err);
+    }
+  };
+
+  stream.refCount += 1;
+  stream.source.addEventListener(eventType, handler);
+
+  return () => {
+    stream.source.removeEventListener(eventType, handler);
+    stream.refCount -= 1;
+    if (stream.refCount <= 0) {
+      stream.source.close();
+      streams.delete(email);
+    }
+  };
+};